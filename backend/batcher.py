@@ -0,0 +1,109 @@
+"""
+Micro-batching for single-record /predict calls.
+
+During a surge many /predict requests arrive within a few milliseconds of
+each other, and each would otherwise pay for a full forest pass over one row.
+PredictBatcher parks each encoded row on a future, then runs every row that
+arrived within PREDICT_BATCH_WINDOW_MS (or as soon as PREDICT_BATCH_MAX rows
+are waiting) through one predict_proba call and hands each request its row
+of the result. A window of 0 disables coalescing.
+"""
+
+import asyncio
+import os
+import threading
+
+import numpy as np
+
+PREDICT_BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", 0))
+PREDICT_BATCH_MAX = int(os.environ.get("PREDICT_BATCH_MAX", 64))
+
+
+class PredictBatcher:
+    """
+    Coalesces (1, n_features) rows into batches for an async predict function.
+
+    run is awaited as run(X, group) with the stacked (batch, n_features)
+    matrix and must return one probability row per input row. Rows are only
+    batched with rows of the same group (e.g. the model version they were
+    encoded for) and the same event loop, since futures cannot be resolved
+    across loops. If run raises, every request in the batch receives that
+    exception.
+    """
+
+    def __init__(self, run, window_ms: float = PREDICT_BATCH_WINDOW_MS, max_batch: int = PREDICT_BATCH_MAX):
+        self.run = run
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.batches = 0
+        self.requests = 0
+        self.size_counts: dict[int, int] = {}
+        self._pending: dict[tuple, list] = {}
+        self._timers: dict[tuple, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_ms > 0 and self.max_batch > 1
+
+    async def predict_proba(self, row: np.ndarray, group=None) -> np.ndarray:
+        """Queue one encoded row and await its probability vector."""
+        loop = asyncio.get_running_loop()
+        key = (loop, group)
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((row, future))
+        if len(pending) >= self.max_batch:
+            self._flush(key)
+        elif len(pending) == 1:
+            self._timers[key] = loop.call_later(self.window_ms / 1000, self._flush, key)
+        return await future
+
+    def _flush(self, key: tuple) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            loop, group = key
+            task = loop.create_task(self._run_batch(batch, group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list, group) -> None:
+        with self._lock:
+            self.batches += 1
+            self.requests += len(batch)
+            self.size_counts[len(batch)] = self.size_counts.get(len(batch), 0) + 1
+        try:
+            probabilities = await self.run(np.concatenate([row for row, _ in batch]), group)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for i, (_, future) in enumerate(batch):
+            # A request whose client went away has a cancelled future
+            if not future.done():
+                future.set_result(probabilities[i])
+
+    def stats(self) -> dict:
+        """Counters plus the batch-size distribution in power-of-two buckets (upper bound inclusive)."""
+        with self._lock:
+            buckets: dict[str, int] = {}
+            bound = 1
+            while True:
+                buckets[f"le_{bound}"] = sum(c for size, c in self.size_counts.items() if bound // 2 < size <= bound)
+                if bound >= self.max_batch:
+                    break
+                bound *= 2
+            return {
+                "enabled": self.enabled,
+                "window_ms": self.window_ms,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "requests": self.requests,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "batch_sizes": buckets,
+            }
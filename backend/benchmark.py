@@ -0,0 +1,731 @@
+"""
+Latency benchmarks for backend components.
+
+Each benchmark returns {case: {"n", "mean_ms", "p50_ms", "p99_ms", ...}}.
+"storage" sweeps history sizes from 1e2 to 1e6 entries and "api" drives the
+FastAPI app in-process over httpx's ASGI transport at several batch sizes and
+concurrency levels; "imports" profiles the import time of the API module in
+fresh interpreters; "suite" runs every in-process benchmark. Results can be
+written as JSON (--output) and compared with an earlier run (--baseline), in
+which case cases whose p50 grew beyond --threshold are reported and the
+script exits with status 1.
+
+Run with: python benchmark.py <benchmark|suite> [-n N] [--max-history N]
+                              [--output results.json] [--baseline baseline.json] [--threshold 0.25]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import warnings
+from types import SimpleNamespace
+
+from encoder import FeatureEncoder
+from optimizer import allocate_incidents, optimize_cached, optimize_resources
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "model.pkl")
+DATASET_PATH = os.path.join(os.path.dirname(__file__), "disaster_data.csv")
+
+SAMPLE_RECORD = SimpleNamespace(disaster_type="Flood", deaths=150.0, affected=50000.0, damage_usd=5e6)
+
+warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+
+
+def _time_calls(fn, n: int) -> dict:
+    """Call fn n times and return latency statistics in milliseconds."""
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return _summarize(samples)
+
+
+def _summarize(samples: list[float]) -> dict:
+    """Latency statistics in milliseconds for samples already in milliseconds."""
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def _print_results(title: str, results: dict) -> None:
+    print(title)
+    for name, stats in results.items():
+        print(
+            f"  {name:<24} n={stats['n']:<6} mean={stats['mean_ms']:9.4f} ms"
+            f"  p50={stats['p50_ms']:9.4f} ms  p99={stats['p99_ms']:9.4f} ms"
+            + (f"  {stats['req_per_s']:9.1f} req/s" if "req_per_s" in stats else "")
+        )
+
+
+# A case regresses when its p50 grows by more than this fraction of the baseline...
+REGRESSION_THRESHOLD = 0.25
+# ...and by more than this many milliseconds, so timer noise on microsecond cases is ignored
+REGRESSION_MIN_MS = 0.25
+
+
+def compare_results(
+    current: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD, metric: str = "p50_ms"
+) -> list[dict]:
+    """
+    Cases of current ({benchmark: {case: stats}}) slower than in baseline.
+
+    Only cases present in both are compared. Returns one
+    {"benchmark", "case", "baseline", "current", "change"} per regression,
+    change being the relative growth of metric, worst first.
+    """
+    regressions = []
+    for bench, cases in current.items():
+        for case, stats in cases.items():
+            before = baseline.get(bench, {}).get(case, {}).get(metric)
+            if before is None or metric not in stats:
+                continue
+            after = stats[metric]
+            if after > before * (1 + threshold) and after - before > REGRESSION_MIN_MS:
+                regressions.append({
+                    "benchmark": bench, "case": case, "baseline": before, "current": after,
+                    "change": after / before - 1 if before else float("inf"),
+                })
+    return sorted(regressions, key=lambda r: -r["change"])
+
+
+def write_results(path: str, results: dict) -> None:
+    """Write {benchmark: {case: stats}} with the machine it ran on."""
+    document = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+
+def read_results(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def bench_optimizer(n: int = 200) -> dict:
+    """Per-request latency of a cache hit, the closed-form fast path and forcing CBC."""
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        cached = _time_calls(lambda: loop.run_until_complete(optimize_cached("Medium", 1_000_000)), n * 10)
+    finally:
+        loop.close()
+    return {
+        "cached": cached,
+        "closed_form": _time_calls(lambda: optimize_resources("Medium", 1_000_000), n),
+        "pulp": _time_calls(lambda: optimize_resources("Medium", 1_000_000, solver="pulp"), max(1, n // 10)),
+    }
+
+
+def _joint_problem(n_incidents: int, n_warehouses: int, seed: int = 0) -> tuple[list, list]:
+    """Random incidents spread over regions and warehouses reaching about half of them."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    regions = [f"region_{r}" for r in range(max(2, n_warehouses))]
+    incidents = [
+        {"id": f"incident_{i}", "region": str(rng.choice(regions)), "severity": str(rng.choice(["Low", "Medium", "High"])),
+         "priority": float(rng.integers(1, 4))}
+        for i in range(n_incidents)
+    ]
+    warehouses = [
+        {"id": f"warehouse_{w}",
+         "stock": {"food_kits": int(rng.integers(5_000, 50_000)), "medical_units": int(rng.integers(100, 2_000)),
+                   "shelters": int(rng.integers(1_000, 10_000))},
+         "transport_costs": {r: float(rng.uniform(1, 20)) for r in regions if rng.random() < 0.5 or r == regions[w % len(regions)]}}
+        for w in range(n_warehouses)
+    ]
+    return incidents, warehouses
+
+
+def bench_allocation(n: int = 3) -> dict:
+    """Joint allocation solve time as N incidents x M warehouses grows, cold and warm-started."""
+    results = {}
+    for n_incidents in (5, 20, 50, 100):
+        for n_warehouses in (2, 5, 10):
+            incidents, warehouses = _joint_problem(n_incidents, n_warehouses)
+            label = f"{n_incidents}x{n_warehouses}"
+            results[f"cold_{label}"] = _time_calls(
+                lambda: allocate_incidents(incidents, warehouses, warm_start=False), n
+            )
+            allocate_incidents(incidents, warehouses)
+            results[f"warm_{label}"] = _time_calls(lambda: allocate_incidents(incidents, warehouses), n)
+    return results
+
+
+def _load_model():
+    """Load model.pkl, or train one from the bundled dataset if it is missing."""
+    if os.path.exists(MODEL_PATH):
+        import joblib
+        return joblib.load(MODEL_PATH)
+    from data_pipeline import run_pipeline
+    from train import train_model
+    X_train, _, y_train, _ = run_pipeline(DATASET_PATH)
+    return train_model(X_train, y_train)
+
+
+def _dataframe_predict(model, record) -> tuple:
+    """The original /predict path: one-row DataFrame, column fill, predict + predict_proba."""
+    import pandas as pd
+    features = list(model.feature_names_in_)
+    data = {"deaths": [record.deaths], "affected": [record.affected], "damage_usd": [record.damage_usd]}
+    for feat in features:
+        if feat.startswith("disaster_type_"):
+            data[feat] = [1.0 if record.disaster_type == feat.replace("disaster_type_", "") else 0.0]
+    df = pd.DataFrame(data)
+    for col in features:
+        if col not in df.columns:
+            df[col] = 0.0
+    df = df[features]
+    return model.predict(df)[0], max(model.predict_proba(df)[0])
+
+
+def _encoder_predict(model, encoder, record) -> tuple:
+    probabilities = model.predict_proba(encoder.encode_one(record))[0]
+    best = probabilities.argmax()
+    return model.classes_[best], probabilities[best]
+
+
+def bench_encoder(n: int = 200) -> dict:
+    """Single-prediction latency: DataFrame feature path versus the precompiled encoder."""
+    model = _load_model()
+    encoder = FeatureEncoder.from_model(model)
+    return {
+        "encode_only": _time_calls(lambda: encoder.encode_one(SAMPLE_RECORD), n * 10),
+        "dataframe": _time_calls(lambda: _dataframe_predict(model, SAMPLE_RECORD), n),
+        "encoder": _time_calls(lambda: _encoder_predict(model, encoder, SAMPLE_RECORD), n),
+    }
+
+
+def bench_forest(n: int = 200) -> dict:
+    """sklearn predict_proba versus the FlatForest engine at batch sizes 1, 100 and 10k, plus load time."""
+    import tempfile
+
+    import joblib
+    import numpy as np
+
+    from forest import FlatForest, export_forest
+
+    model = _load_model()
+    flat = FlatForest.from_sklearn(model)
+    encoder = FeatureEncoder.from_model(model)
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch in (1, 100, 10_000):
+        X = np.repeat(encoder.encode_one(SAMPLE_RECORD), batch, axis=0)
+        X[:, :3] *= rng.uniform(0.01, 10.0, size=(batch, 3))
+        iterations = max(1, n // max(1, batch // 100))
+        results[f"sklearn_b{batch}"] = _time_calls(lambda: model.predict_proba(X), iterations)
+        results[f"flat_b{batch}"] = _time_calls(lambda: flat.predict_proba(X), iterations)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pkl_path, bundle_path = os.path.join(tmp, "model.pkl"), os.path.join(tmp, "model_bundle")
+        joblib.dump(model, pkl_path)
+        export_forest(model, bundle_path)
+        results["load_joblib"] = _time_calls(lambda: joblib.load(pkl_path), 10)
+        results["load_flat"] = _time_calls(lambda: FlatForest.load(bundle_path, mmap_mode=None), 10)
+        results["load_flat_mmap"] = _time_calls(lambda: FlatForest.load(bundle_path), 10)
+    return results
+
+
+def bench_explain(n: int = 200) -> dict:
+    """
+    Cost of per-prediction explanations: FlatForest.contributions versus
+    predict_proba at batch sizes 1, 100 and 1000 (prints the added ms per
+    row), and a memoized explanation lookup.
+    """
+    import numpy as np
+
+    from forest import FlatForest
+    from result_cache import ResultCache
+
+    flat = FlatForest.from_sklearn(_load_model())
+    encoder = FeatureEncoder.from_model(flat)
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch in (1, 100, 1000):
+        X = np.repeat(encoder.encode_one(SAMPLE_RECORD), batch, axis=0)
+        X[:, :3] *= rng.uniform(0.01, 10.0, size=(batch, 3))
+        iterations = max(1, n // max(1, batch // 10))
+        results[f"predict_b{batch}"] = _time_calls(lambda: flat.predict_proba(X), iterations)
+        results[f"explain_b{batch}"] = _time_calls(lambda: flat.contributions(X), iterations)
+        added = results[f"explain_b{batch}"]["p50_ms"] / batch
+        print(f"  batch {batch}: explanations add {added:.4f} ms per row")
+
+    cache = ResultCache(4096, float("inf"))
+    row = encoder.encode_one(SAMPLE_RECORD)
+    bias, contributions = flat.contributions(row)
+    key = (("memory:bench", "flat"), row.tobytes())
+    cache.put(key, {"base_value": float(bias[0]), "contributions": dict(zip(encoder.feature_names, contributions[0, :, 0].tolist()))})
+    results["cache_hit"] = _time_calls(lambda: cache.get(key), n * 10)
+    return results
+
+
+def bench_batching(n: int = 20) -> dict:
+    """
+    Time for a wave of concurrent single-row predictions: one forest pass
+    each versus coalesced by PredictBatcher (2 ms window).
+    """
+    import asyncio
+
+    import numpy as np
+    from starlette.concurrency import run_in_threadpool
+
+    from batcher import PredictBatcher
+
+    model = _load_model()
+    encoder = FeatureEncoder.from_model(model)
+    row = encoder.encode_one(SAMPLE_RECORD).copy()
+
+    async def run(X, group=None):
+        return await run_in_threadpool(model.predict_proba, X)
+
+    async def wave(concurrency, batcher):
+        if batcher is None:
+            return await asyncio.gather(*(run(row) for _ in range(concurrency)))
+        return await asyncio.gather(*(batcher.predict_proba(row) for _ in range(concurrency)))
+
+    results = {}
+    for concurrency in (1, 16, 64, 256):
+        batcher = PredictBatcher(run, window_ms=2, max_batch=64)
+        results[f"single_c{concurrency}"] = _time_calls(lambda: asyncio.run(wave(concurrency, None)), n)
+        results[f"batched_c{concurrency}"] = _time_calls(lambda: asyncio.run(wave(concurrency, batcher)), n)
+    return results
+
+
+def bench_metrics(n: int = 200) -> dict:
+    """Per-call cost of a stage timer with metrics enabled and disabled, 1000 timers per sample."""
+    import metrics
+
+    def timers():
+        for _ in range(1000):
+            with metrics.time_stage("bench"):
+                pass
+
+    results = {"stage_enabled": _time_calls(timers, n)}
+    metrics.METRICS_ENABLED = False
+    try:
+        results["stage_disabled"] = _time_calls(timers, n)
+    finally:
+        metrics.METRICS_ENABLED = True
+    results["render"] = _time_calls(lambda: metrics.render(metrics.REGISTRY.collect()), n)
+    return results
+
+
+def bench_pipeline(n: int = 200) -> dict:
+    """
+    In-memory run_pipeline versus the chunked columnar pipeline on a CSV of
+    n * 1000 rows resampled from the bundled dataset; prints peak traced memory.
+    """
+    import tempfile
+    import tracemalloc
+
+    import numpy as np
+    import pandas as pd
+
+    from data_pipeline import load_columnar, run_pipeline, write_columnar
+
+    source = pd.read_csv(DATASET_PATH)
+    rng = np.random.default_rng(0)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "large.csv")
+        source.iloc[rng.integers(0, len(source), n * 1000)].to_csv(csv_path, index=False)
+        cases = {
+            "run_pipeline": lambda: run_pipeline(csv_path),
+            "write_columnar": lambda: write_columnar(csv_path, os.path.join(tmp, "dataset"), chunk_rows=100_000),
+            "load_columnar": lambda: load_columnar(os.path.join(tmp, "dataset")),
+        }
+        for name, fn in cases.items():
+            results[name] = _time_calls(fn, 1)
+            # Measured in a second, untimed run: tracing slows allocation-heavy code several-fold
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {name}: peak traced memory {peak / 1e6:.1f} MB")
+    return results
+
+
+def bench_generator(n: int = 200) -> dict:
+    """Synthetic data throughput: n * 1000 dataset rows in memory and to CSV, and n * 100 history entries into storage."""
+    import tempfile
+
+    import generate_dataset
+    import storage
+
+    results = {"generate_dataset": _time_calls(lambda: generate_dataset.generate_dataset(n * 1000), 3)}
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "data.csv")
+        results["write_csv"] = _time_calls(lambda: generate_dataset.write_dataset(csv_path, n * 1000), 1)
+        previous_path = storage.DB_PATH
+        storage.DB_PATH = os.path.join(tmp, "storage.db")
+        try:
+            results["populate_history"] = _time_calls(lambda: generate_dataset.populate_history(n * 100), 1)
+        finally:
+            storage.DB_PATH = previous_path
+    return results
+
+
+# History sizes swept by the storage benchmark
+HISTORY_SIZES = (100, 1_000, 10_000, 100_000, 1_000_000)
+
+
+def bench_storage(n: int = 200, max_history: int = HISTORY_SIZES[-1]) -> dict:
+    """
+    Storage calls as history grows through HISTORY_SIZES (up to max_history).
+
+    Cheap calls (get_stats, add_history, a 50-entry history page) run n times
+    per size; full load_storage / save_storage round trips run fewer times as
+    history grows, down to once at 1e6 entries.
+    """
+    import tempfile
+
+    import storage
+    from generate_dataset import generate_history
+
+    sizes = [size for size in HISTORY_SIZES if size <= max_history]
+    entries = generate_history(sizes[-1] if sizes else 0)
+    plan = {"resource_plan": {"food_kits": 500, "medical_units": 20, "shelters": 100}, "total_cost": 59000}
+    results = {}
+    previous_path = storage.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "storage.db")
+        try:
+            stored = 0
+            for size in sizes:
+                stored += storage.append_history_entries(itertools.islice(entries, size - stored))
+                label = f"h{size}"
+                results[f"get_stats_{label}"] = _time_calls(storage.get_stats, n)
+                results[f"add_history_{label}"] = _time_calls(
+                    lambda: storage.add_history({"severity": "Low"}, plan), n
+                )
+                results[f"history_page_{label}"] = _time_calls(
+                    lambda: next(storage.iter_history(limit=50, chunk_size=50)), n
+                )
+                full_runs = max(1, min(n, 100_000 // size))
+                results[f"load_storage_{label}"] = _time_calls(storage.load_storage, full_runs)
+                snapshot = storage.load_storage()
+                results[f"save_storage_{label}"] = _time_calls(lambda: storage.save_storage(snapshot), full_runs)
+                del snapshot
+                # add_history grew the table; the next size tops up from the actual count
+                stored = storage.get_stats()["total_analyses"]
+        finally:
+            storage.DB_PATH = previous_path
+    return results
+
+
+async def _drive(client, requests: list[tuple], concurrency: int) -> dict:
+    """
+    Send (method, path, json) requests through client from concurrency tasks.
+
+    Returns latency statistics plus throughput and the number of responses
+    with status >= 400.
+    """
+    import asyncio
+
+    pending = iter(requests)
+    samples: list[float] = []
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        for method, path, body in pending:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            samples.append((time.perf_counter() - start) * 1000)
+            failed += response.status_code >= 400
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall
+    return {**_summarize(samples), "req_per_s": len(samples) / wall, "failed": failed}
+
+
+def bench_api(n: int = 200) -> dict:
+    """
+    In-process load generator: the FastAPI app behind httpx.ASGITransport.
+
+    /predict at concurrency 1, 16 and 64 (and with explanations at 16), /predict/batch at batch sizes 1 to
+    1000, and /optimize, /stats, /history and /health at concurrency 16, each
+    case n requests (n / 10 for the largest batches) against a fresh database
+    holding 10k history entries. Measures the full ASGI stack (routing,
+    validation, middleware, serialization) without socket overhead.
+    """
+    import asyncio
+    import tempfile
+
+    import httpx
+
+    import main
+    import storage
+    from generate_dataset import populate_history
+
+    records = [
+        {"disaster_type": t, "deaths": 10.0 * i, "affected": 1000.0 * i, "damage_usd": 1e5 * i}
+        for i, t in enumerate(["Flood", "Earthquake", "Storm", "Drought", "Wildfire"] * 200)
+    ]
+
+    def repeat(method, path, body=None, count=n):
+        return [(method, path, body)] * count
+
+    cases = {}
+    for concurrency in (1, 16, 64):
+        cases[f"predict_c{concurrency}"] = (
+            [("POST", "/predict", records[i % len(records)]) for i in range(n)], concurrency
+        )
+    cases["predict_explain_c16"] = ([("POST", "/predict?explain=true", records[i % len(records)]) for i in range(n)], 16)
+    for batch in (1, 10, 100, 1000):
+        count = n if batch < 1000 else max(1, n // 10)
+        cases[f"predict_batch_b{batch}"] = (repeat("POST", "/predict/batch", {"records": records[:batch]}, count), 4)
+    cases["optimize_c16"] = (repeat("POST", "/optimize", {"severity_level": "Low", "budget": 500_000}), 16)
+    cases["stats_c16"] = (repeat("GET", "/stats"), 16)
+    cases["history_page_c16"] = (repeat("GET", "/history?limit=50"), 16)
+    cases["health_c16"] = (repeat("GET", "/health"), 16)
+
+    async def run_all():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            return {name: await _drive(client, requests, concurrency) for name, (requests, concurrency) in cases.items()}
+
+    previous_path, previous_state = storage.DB_PATH, main.model_state
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, "storage.db")
+        try:
+            # Stock for every /optimize call, so each one reserves and commits
+            storage.save_storage({"inventory": {item: 10**9 for item in storage.RESOURCE_ITEMS}, "history": []})
+            populate_history(10_000)
+            main.set_model(_load_model())
+            results = asyncio.run(run_all())
+        finally:
+            storage.DB_PATH, main.model_state = previous_path, previous_state
+    return results
+
+
+def _ensure_model_file() -> None:
+    """Make sure model.pkl exists so a server subprocess can load it."""
+    if not os.path.exists(MODEL_PATH):
+        from train import save_model
+        save_model(_load_model(), MODEL_PATH)
+
+
+def _serve(port: int, env: dict):
+    """Start uvicorn on port in a subprocess and wait until /health answers."""
+    import subprocess
+    import sys
+
+    import httpx
+
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, **env},
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def _load_test(base_url: str, requests_per_client: int, clients: int = 16) -> dict:
+    """
+    Fire /predict/batch from many clients while one client polls /health.
+
+    Returns latency statistics for both, so the effect of CPU-bound routes
+    on light ones is visible alongside their own throughput.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    import httpx
+
+    records = [
+        {"disaster_type": t, "deaths": 10.0 * i, "affected": 1000.0 * i, "damage_usd": 1e5 * i}
+        for i, t in enumerate(["Flood", "Earthquake", "Storm", "Drought"] * 250)
+    ]
+    done = threading.Event()
+    health_samples = []
+
+    def poll_health():
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            while not done.is_set():
+                start = time.perf_counter()
+                client.get("/health")
+                health_samples.append((time.perf_counter() - start) * 1000)
+                time.sleep(0.01)
+
+    def run_client(_):
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            samples, rejected = [], 0
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                status = client.post("/predict/batch", json={"records": records}).status_code
+                samples.append((time.perf_counter() - start) * 1000)
+                rejected += status == 429
+            return samples, rejected
+
+    poller = threading.Thread(target=poll_health)
+    poller.start()
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        outcomes = list(pool.map(run_client, range(clients)))
+    wall = time.perf_counter() - wall
+    done.set()
+    poller.join()
+
+    predict = _summarize([s for samples, _ in outcomes for s in samples])
+    print(f"  {base_url}: {predict['n'] / wall:.1f} batch req/s, "
+          f"{sum(r for _, r in outcomes)} rejected with 429")
+    return {"predict_batch": predict, "health": _summarize(health_samples)}
+
+
+def bench_pool(n: int = 10) -> dict:
+    """
+    Load test a live server with the threadpool versus a WORKER_PROCESSES pool.
+
+    Each client sends n /predict/batch requests of 1000 records.
+    """
+    _ensure_model_file()
+    results = {}
+    for label, processes in (("threads", 0), ("pool", max(2, os.cpu_count() or 1))):
+        port = 8765 + processes
+        proc = _serve(port, {"WORKER_PROCESSES": str(processes), "WORKER_QUEUE_DEPTH": "256"})
+        try:
+            for name, stats in _load_test(f"http://127.0.0.1:{port}", n).items():
+                results[f"{label}_{name}"] = stats
+        finally:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+# Fail budget for "import main" in a fresh interpreter, checked by the test suite
+IMPORT_TIME_BUDGET_S = float(os.environ.get("IMPORT_TIME_BUDGET_S", 2.0))
+# Loaded by the first /predict or /optimize (or the startup prewarm), never by "import main"
+DEFERRED_MODULES = ("pandas", "sklearn", "joblib", "pulp", "scipy")
+
+
+def import_profile(module: str = "main") -> dict:
+    """
+    Import module in a fresh interpreter under -X importtime.
+
+    Returns the wall time in seconds, which of DEFERRED_MODULES ended up
+    loaded, and the cumulative import time in ms of each package module
+    imports directly.
+    """
+    import subprocess
+
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {DEFERRED_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+    )
+    # -X importtime lists children before their parent, indented two spaces per level:
+    # the direct imports of module are the depth-1 entries just before its own line
+    packages: dict[str, float] = {}
+    children: list[tuple[str, float]] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children.append((name.strip().split(".")[0], int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() == module:
+                for package, ms in children:
+                    packages[package] = packages.get(package, 0.0) + ms
+            children = []
+    return {**json.loads(proc.stdout.splitlines()[-1]), "packages": packages}
+
+
+def bench_imports(n: int = 5) -> dict:
+    """
+    Wall time of "import main" in fresh interpreters, plus a report of the
+    packages that dominate it and any deferred module that got loaded.
+    """
+    runs = [import_profile("main") for _ in range(max(1, n))]
+    last = runs[-1]
+    print(f"  import main: {last['seconds'] * 1000:.1f} ms (budget {IMPORT_TIME_BUDGET_S * 1000:.0f} ms)")
+    for package, ms in sorted(last["packages"].items(), key=lambda item: -item[1])[:10]:
+        print(f"    {package:<20} {ms:9.1f} ms")
+    if last["loaded"]:
+        print(f"  WARNING: loaded at import time: {', '.join(last['loaded'])}")
+    return {"import_main": _summarize([run["seconds"] * 1000 for run in runs])}
+
+
+BENCHMARKS = {
+    "optimizer": bench_optimizer,
+    "encoder": bench_encoder,
+    "forest": bench_forest,
+    "allocation": bench_allocation,
+    "pool": bench_pool,
+    "batching": bench_batching,
+    "metrics": bench_metrics,
+    "pipeline": bench_pipeline,
+    "generator": bench_generator,
+    "storage": bench_storage,
+    "api": bench_api,
+    "explain": bench_explain,
+    "imports": bench_imports,
+}
+
+# Run by "suite": every benchmark that stays in this process and needs no large inputs
+SUITE = ("optimizer", "encoder", "forest", "explain", "batching", "metrics", "storage", "api")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backend latency benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["suite"], help="Benchmark to run")
+    parser.add_argument("-n", type=int, default=200, help="Iterations per case")
+    parser.add_argument("--max-history", type=int, default=HISTORY_SIZES[-1], help="Largest history size for storage")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Allowed relative p50 growth")
+    args = parser.parse_args()
+
+    names = SUITE if args.benchmark == "suite" else (args.benchmark,)
+    results = {}
+    for name in names:
+        kwargs = {"max_history": args.max_history} if name == "storage" else {}
+        results[name] = BENCHMARKS[name](args.n, **kwargs)
+        _print_results(name, results[name])
+    if args.output:
+        write_results(args.output, results)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        regressions = compare_results(results, read_results(args.baseline), args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['benchmark']}/{r['case']}: p50 {r['baseline']:.4f} -> {r['current']:.4f} ms "
+                  f"(+{r['change']:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,29 @@
 """
 Data pipeline for disaster severity classification.
 Loads CSV data, engineers features, and prepares train/test splits.
+
+run_pipeline works on an in-memory DataFrame. For archives larger than RAM,
+write_columnar streams the CSV in chunks with compact dtypes into a columnar
+dataset directory (one .npy file per column per chunk), and
+run_columnar_pipeline / iter_columnar read it back without pandas parsing.
+Run with: python data_pipeline.py <input.csv> <output_dir> [--chunk-rows N]
 """
 
+import argparse
+import json
+import os
+import shutil
+
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
+NUMERIC_COLUMNS = ("deaths", "affected", "damage_usd")
+SEVERITY_LABELS = ("Low", "Medium", "High")
+SEVERITY_THRESHOLDS = (5.0, 10.0)
+CSV_DTYPES = {"disaster_type": "category", "deaths": "float64", "affected": "float64", "damage_usd": "float64"}
+CHUNK_ROWS = 1_000_000
+
 
 def load_data(filepath: str) -> pd.DataFrame:
     """Load disaster dataset from CSV."""
@@ -51,12 +68,21 @@ def assign_severity_labels(
     df: pd.DataFrame, thresholds: tuple[float, float] = (5.0, 10.0)
 ) -> pd.DataFrame:
     """Add severity_level column based on severity_score quantiles or fixed thresholds."""
-    df["severity_level"] = df["severity_score"].apply(
-        lambda s: classify_severity(s, thresholds)
-    )
+    codes = severity_codes(df["severity_score"].to_numpy(), thresholds)
+    df["severity_level"] = np.asarray(SEVERITY_LABELS, dtype=object)[codes]
     return df
 
 
+def severity_codes(scores: np.ndarray, thresholds: tuple[float, float] = SEVERITY_THRESHOLDS) -> np.ndarray:
+    """
+    Vectorized classify_severity: index into SEVERITY_LABELS for every score.
+
+    np.digitize puts score < low in bin 0, low <= score < high in bin 1 and
+    everything else (including NaN, like the scalar comparisons) in bin 2.
+    """
+    return np.digitize(scores, thresholds).astype(np.int8)
+
+
 def prepare_features(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
     """
     Prepare feature matrix X and target y.
@@ -79,6 +105,129 @@ def split_data(
     return train_test_split(X, y, test_size=test_size, random_state=random_state)
 
 
+def scan_disaster_types(filepath: str, chunk_rows: int = CHUNK_ROWS) -> list[str]:
+    """Sorted distinct disaster types, read one column at a time in chunks."""
+    types: set[str] = set()
+    for chunk in pd.read_csv(filepath, usecols=["disaster_type"], dtype={"disaster_type": "category"}, chunksize=chunk_rows):
+        types.update(chunk["disaster_type"].cat.categories)
+    return sorted(types)
+
+
+def columnar_feature_names(categories: list[str]) -> list[str]:
+    """Feature order produced by prepare_features: numerics, then dummies for all but the first type."""
+    return list(NUMERIC_COLUMNS) + [f"disaster_type_{c}" for c in categories[1:]]
+
+
+def write_columnar(
+    filepath: str,
+    output_dir: str,
+    chunk_rows: int = CHUNK_ROWS,
+    categories: list[str] | None = None,
+    thresholds: tuple[float, float] = SEVERITY_THRESHOLDS,
+) -> dict:
+    """
+    Stream a disaster CSV into a columnar dataset directory and return its meta.
+
+    Each chunk of chunk_rows rows becomes part-NNNNN/ holding deaths, affected
+    and damage_usd as float32 (missing values filled with 0), disaster_type as
+    int16 codes into the sorted category list (-1 when missing) and
+    severity_level as int8 codes into SEVERITY_LABELS. Severity scores are
+    computed from the values read as float64, before the downcast. Only one chunk is in memory at a
+    time; the category list comes from a first pass over the disaster_type
+    column unless given. The dataset is assembled in a temp directory and
+    renamed into place.
+    """
+    if categories is None:
+        categories = scan_disaster_types(filepath, chunk_rows)
+    dtypes = {**CSV_DTYPES, "disaster_type": pd.CategoricalDtype(categories)}
+
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    parts = []
+    reader = pd.read_csv(filepath, usecols=["disaster_type", *NUMERIC_COLUMNS], dtype=dtypes, chunksize=chunk_rows)
+    for i, chunk in enumerate(reader):
+        part = f"part-{i:05d}"
+        os.makedirs(os.path.join(tmp_dir, part))
+        values = {col: chunk[col].fillna(0).to_numpy(np.float64) for col in NUMERIC_COLUMNS}
+        # Labels come from the full-precision values; only the stored features are downcast
+        scores = 0.5 * np.log1p(values["deaths"]) + 0.3 * np.log1p(values["affected"]) + 0.2 * np.log1p(values["damage_usd"])
+        columns = {col: values[col].astype(np.float32) for col in NUMERIC_COLUMNS}
+        columns["disaster_type"] = chunk["disaster_type"].cat.codes.to_numpy(np.int16)
+        columns["severity_level"] = severity_codes(scores, thresholds)
+        for name, array in columns.items():
+            np.save(os.path.join(tmp_dir, part, f"{name}.npy"), array)
+        parts.append({"path": part, "rows": len(chunk)})
+
+    meta = {
+        "categories": categories,
+        "labels": list(SEVERITY_LABELS),
+        "thresholds": list(thresholds),
+        "feature_names": columnar_feature_names(categories),
+        "rows": sum(p["rows"] for p in parts),
+        "parts": parts,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=4)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(tmp_dir, output_dir)
+    return meta
+
+
+def read_columnar_meta(path: str) -> dict:
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        return json.load(f)
+
+
+def _part_features(path: str, part: dict, n_features: int, out: np.ndarray | None = None) -> tuple:
+    """Fill a (rows, n_features) float32 matrix and return it with the label codes of one part."""
+    load = lambda name: np.load(os.path.join(path, part["path"], f"{name}.npy"), mmap_mode="r")
+    X = np.zeros((part["rows"], n_features), dtype=np.float32) if out is None else out
+    for col, name in enumerate(NUMERIC_COLUMNS):
+        X[:, col] = load(name)
+    # Dummy column for category code c is len(NUMERIC_COLUMNS) + c - 1; code 0 is the dropped baseline
+    codes = np.asarray(load("disaster_type"))
+    rows = np.flatnonzero(codes > 0)
+    X[rows, len(NUMERIC_COLUMNS) + codes[rows] - 1] = 1.0
+    return X, np.asarray(load("severity_level"))
+
+
+def iter_columnar(path: str):
+    """Yield (X, y) per stored part: float32 feature matrix and severity label strings."""
+    meta = read_columnar_meta(path)
+    labels = np.asarray(meta["labels"])
+    for part in meta["parts"]:
+        X, codes = _part_features(path, part, len(meta["feature_names"]))
+        yield X, labels[codes]
+
+
+def load_columnar(path: str) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    Read a whole columnar dataset into one preallocated float32 matrix.
+
+    Returns X as a DataFrame over that matrix (so models keep feature names)
+    and y as a Series of severity labels: the same layout prepare_features
+    produces, at 4 bytes per feature value.
+    """
+    meta = read_columnar_meta(path)
+    names = meta["feature_names"]
+    X = np.zeros((meta["rows"], len(names)), dtype=np.float32)
+    y = np.empty(meta["rows"], dtype=np.int8)
+    start = 0
+    for part in meta["parts"]:
+        stop = start + part["rows"]
+        _, y[start:stop] = _part_features(path, part, len(names), out=X[start:stop])
+        start = stop
+    labels = np.asarray(meta["labels"], dtype=object)
+    return pd.DataFrame(X, columns=names, copy=False), pd.Series(labels[y], name="severity_level")
+
+
+def run_columnar_pipeline(path: str) -> tuple:
+    """run_pipeline for a dataset written by write_columnar."""
+    X, y = load_columnar(path)
+    return split_data(X, y)
+
+
 def run_pipeline(filepath: str) -> tuple:
     """Execute the full data pipeline and return X_train, X_test, y_train, y_test."""
     df = load_data(filepath)
@@ -88,3 +237,18 @@ def run_pipeline(filepath: str) -> tuple:
     X, y = prepare_features(df)
     X_train, X_test, y_train, y_test = split_data(X, y)
     return X_train, X_test, y_train, y_test
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert a disaster CSV into a columnar training dataset")
+    parser.add_argument("input", help="CSV with disaster_type, deaths, affected, damage_usd")
+    parser.add_argument("output", help="Dataset directory to create")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="Rows per chunk/part")
+    args = parser.parse_args()
+
+    meta = write_columnar(args.input, args.output, chunk_rows=args.chunk_rows)
+    print(f"Wrote {meta['rows']} rows in {len(meta['parts'])} parts -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
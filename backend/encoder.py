@@ -0,0 +1,77 @@
+"""
+Feature encoding for severity prediction requests.
+Maps request records straight to float64 rows in the model's feature order.
+"""
+
+import threading
+
+import numpy as np
+
+NUMERIC_FEATURES = ("deaths", "affected", "damage_usd")
+DISASTER_TYPE_PREFIX = "disaster_type_"
+IMPORTANCE_THRESHOLD = 0.01
+
+
+class FeatureEncoder:
+    """
+    Precompiled encoder built once from a fitted model's feature layout.
+
+    Column positions for the numeric inputs and every disaster_type dummy are
+    resolved up front, so encoding a record is a few array stores. Types that
+    were dropped as the baseline category (or never seen) encode as all zeros,
+    matching pd.get_dummies(drop_first=True) at training time.
+    """
+
+    def __init__(self, feature_names: list[str], feature_importances=None):
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+        self.numeric_columns = {
+            name: self.feature_names.index(name) for name in NUMERIC_FEATURES if name in self.feature_names
+        }
+        self.disaster_type_columns = {
+            feat[len(DISASTER_TYPE_PREFIX):]: i
+            for i, feat in enumerate(self.feature_names)
+            if feat.startswith(DISASTER_TYPE_PREFIX)
+        }
+        self.importance: dict[str, float] = {}
+        if feature_importances is not None:
+            self.importance = {
+                feat: float(score)
+                for feat, score in zip(self.feature_names, feature_importances)
+                if score > IMPORTANCE_THRESHOLD
+            }
+        self._local = threading.local()
+
+    @classmethod
+    def from_model(cls, model) -> "FeatureEncoder":
+        return cls(model.feature_names_in_, getattr(model, "feature_importances_", None))
+
+    def encode_one(self, record) -> np.ndarray:
+        """
+        Encode one record into a (1, n_features) row.
+
+        The row is a per-thread preallocated buffer that is overwritten by the
+        next call on the same thread; copy it if it must outlive the request.
+        """
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features), dtype=np.float64)
+        else:
+            row.fill(0.0)
+        for name, col in self.numeric_columns.items():
+            row[0, col] = getattr(record, name)
+        col = self.disaster_type_columns.get(record.disaster_type)
+        if col is not None:
+            row[0, col] = 1.0
+        return row
+
+    def encode_batch(self, records) -> np.ndarray:
+        """Encode many records into a new (n_records, n_features) matrix."""
+        X = np.zeros((len(records), self.n_features), dtype=np.float64)
+        for name, col in self.numeric_columns.items():
+            X[:, col] = [getattr(r, name) for r in records]
+        for row, r in enumerate(records):
+            col = self.disaster_type_columns.get(r.disaster_type)
+            if col is not None:
+                X[row, col] = 1.0
+        return X
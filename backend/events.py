@@ -0,0 +1,231 @@
+"""
+Server-sent events for the dashboard: inventory, stats and alerts.
+
+Instead of every operator screen polling /warehouse, /stats and /alerts,
+clients hold one GET /events stream. storage reports each committed write
+through a change listener; EventBroker then reads the dashboard state once,
+diffs it against what it last published and serializes each changed part
+once for all subscribers, so alert thresholds are evaluated once per change
+rather than once per request. Writes made by other processes (other uvicorn
+workers, CLI tools) are picked up by checking the storage version every
+EVENTS_POLL_S seconds while anyone is subscribed; the state is only read
+when the version moved.
+
+Events carry absolute values for whatever changed, so applying one twice is
+harmless:
+
+    snapshot   {"inventory", "stats", "alerts"}, sent once on connect
+    inventory  {item: count} for the items that changed
+    stats      {field: value} for the KPI fields that changed
+    alerts     {"raised": [alert], "cleared": [resource], "active": [alert]}
+
+A subscriber that falls EVENTS_QUEUE_MAX events behind is disconnected;
+EventSource reconnects on its own and starts again from a snapshot.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from contextlib import suppress
+
+import storage
+
+EVENTS_POLL_S = float(os.environ.get("EVENTS_POLL_S", 1.0))
+EVENTS_KEEPALIVE_S = float(os.environ.get("EVENTS_KEEPALIVE_S", 15))
+EVENTS_QUEUE_MAX = int(os.environ.get("EVENTS_QUEUE_MAX", 256))
+
+
+def read_dashboard_state() -> dict:
+    """Inventory, KPIs (without the inventory copy) and the alerts for that inventory."""
+    inventory = storage.get_inventory()
+    stats = storage.get_stats()
+    stats.pop("current_inventory", None)
+    return {"inventory": inventory, "stats": stats, "alerts": storage.alerts_for(inventory)}
+
+
+def diff_state(old: dict, new: dict) -> list[tuple[str, dict]]:
+    """(event, data) pairs describing how new differs from old; alerts only on threshold crossings."""
+    events = []
+    for part in ("inventory", "stats"):
+        changed = {key: value for key, value in new[part].items() if old[part].get(key) != value}
+        if changed:
+            events.append((part, changed))
+    old_keys = {(alert["resource"], alert["type"]) for alert in old["alerts"]}
+    new_keys = {(alert["resource"], alert["type"]) for alert in new["alerts"]}
+    if old_keys != new_keys:
+        alerted = {resource for resource, _ in new_keys}
+        events.append(("alerts", {
+            "raised": [a for a in new["alerts"] if (a["resource"], a["type"]) not in old_keys],
+            "cleared": sorted({resource for resource, _ in old_keys} - alerted),
+            "active": new["alerts"],
+        }))
+    return events
+
+
+def _message(event: str, data: dict, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventBroker:
+    """
+    Fans storage changes out to any number of SSE subscribers.
+
+    start() must run on the event loop that serves the streams. notify() is
+    the storage change listener and may be called from any thread; it only
+    wakes the broker, so bursts of writes coalesce into one state read.
+    """
+
+    def __init__(
+        self,
+        poll_s: float = EVENTS_POLL_S,
+        keepalive_s: float = EVENTS_KEEPALIVE_S,
+        queue_max: int = EVENTS_QUEUE_MAX,
+    ):
+        self.poll_s = poll_s
+        self.keepalive_s = keepalive_s
+        self.queue_max = queue_max
+        self.refreshes = 0
+        self.published = 0
+        self.dropped = 0
+        self._seq = 0
+        self._state: dict | None = None
+        self._version: dict | None = None
+        self._subscribers: set[asyncio.Queue] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._changed: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._lock = threading.Lock()
+
+    def notify(self) -> None:
+        """Storage change listener: schedule a refresh on the broker's loop."""
+        loop, changed = self._loop, self._changed
+        if loop is None:
+            return
+        with suppress(RuntimeError):  # loop already closed during shutdown
+            loop.call_soon_threadsafe(changed.set)
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        storage.add_change_listener(self.notify)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        storage.remove_change_listener(self.notify)
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        self._task = self._loop = self._changed = None
+        self._state = self._version = None
+        for queue in list(self._subscribers):
+            self._close(queue)
+
+    async def _run(self) -> None:
+        while True:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._changed.wait(), self.poll_s or None)
+            self._changed.clear()
+            if not self._subscribers:
+                continue
+            try:
+                events = await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"Warning: event refresh failed: {e}")
+                continue
+            for event, data in events:
+                self.publish(event, data)
+
+    def refresh(self) -> list[tuple[str, dict]]:
+        """Read the dashboard state if storage changed and return the events since the previous read."""
+        version = storage.get_version()
+        with self._lock:
+            if version == self._version:
+                return []
+        state = read_dashboard_state()
+        with self._lock:
+            if not self._is_newer(version):
+                # A subscriber's snapshot already moved the baseline past this read
+                return []
+            events = diff_state(self._state, state) if self._state is not None else []
+            self._state, self._version = state, version
+            self.refreshes += 1
+        return events
+
+    def _is_newer(self, version: dict) -> bool:
+        current = self._version
+        return (
+            current is None
+            or version["database_id"] != current["database_id"]
+            or version["version"] > current["version"]
+        )
+
+    def _read_snapshot(self, queue: asyncio.Queue) -> dict:
+        """
+        Dashboard state for a new subscriber.
+
+        When it is the only subscriber, its snapshot becomes the baseline that
+        refreshes diff against, so a write landing right after the snapshot is
+        published rather than folded into a first, silent baseline read. The
+        version is read first: a write in between only makes the next refresh
+        read the state again.
+        """
+        version = storage.get_version()
+        state = read_dashboard_state()
+        with self._lock:
+            if self._subscribers == {queue} and self._is_newer(version):
+                self._state, self._version = state, version
+        return state
+
+    def publish(self, event: str, data: dict) -> None:
+        """Serialize one event and queue it for every subscriber (on the broker's loop)."""
+        self._seq += 1
+        self.published += 1
+        message = _message(event, data, self._seq)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                self._close(queue)
+
+    def _close(self, queue: asyncio.Queue) -> None:
+        """Detach a subscriber and end its stream after what it has already read."""
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def stream(self):
+        """SSE text for one subscriber: a snapshot, then change events and keepalive comments."""
+        queue: asyncio.Queue = asyncio.Queue(self.queue_max)
+        # Subscribe before reading the snapshot so no change falls in between
+        self._subscribers.add(queue)
+        try:
+            snapshot = await asyncio.to_thread(self._read_snapshot, queue)
+            yield _message("snapshot", snapshot, self._seq)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.keepalive_s)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self._subscribers.discard(queue)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "refreshes": self.refreshes,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+broker = EventBroker()
@@ -0,0 +1,240 @@
+"""
+Flat array inference engine for the RandomForestClassifier.
+
+export_forest flattens every fitted tree into contiguous NumPy arrays and
+FlatForest evaluates them with a batched, pure-NumPy traversal. The result is
+a drop-in replacement for the estimator in /predict (same classes_,
+feature_names_in_, feature_importances_ and predict_proba) that loads without
+unpickling sklearn objects and skips its per-call input validation.
+
+FlatForest.contributions explains individual predictions by attributing
+each probability change along the decision paths to the splitting feature.
+
+The on-disk format is a bundle directory with one .npy file per array plus a
+small meta.json. Loading memory-maps the arrays, so every worker process on a
+host shares the same page-cache copy and startup does no deserialization.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+TREE_LEAF = -1
+ARRAY_NAMES = ("feature", "threshold", "left", "right", "value", "roots", "feature_importances")
+
+
+class FlatForest:
+    """
+    A random forest stored as one set of node arrays.
+
+    Nodes from all trees are concatenated; roots[t] is the index of tree t's
+    root. Leaves point at themselves on both sides, so a fixed number of
+    traversal steps (max_depth) lands every sample on its leaf without
+    per-sample branching. value[node] holds the class probabilities that
+    DecisionTreeClassifier.predict_proba returns for samples ending there.
+    """
+
+    def __init__(
+        self,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        max_depth: int,
+        classes: np.ndarray,
+        feature_names: np.ndarray,
+        feature_importances: np.ndarray,
+    ):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.feature_names_in_ = feature_names
+        self.feature_importances_ = feature_importances
+        self.n_estimators = len(roots)
+
+    @classmethod
+    def from_sklearn(cls, model) -> "FlatForest":
+        """Flatten a fitted RandomForestClassifier."""
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        n_classes = len(model.classes_)
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            idx = np.arange(offset, offset + n, dtype=np.int64)
+            is_leaf = tree.children_left == TREE_LEAF
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+            thresholds.append(tree.threshold.astype(np.float64))
+            lefts.append(np.where(is_leaf, idx, tree.children_left + offset))
+            rights.append(np.where(is_leaf, idx, tree.children_right + offset))
+            values.append(_normalized(tree.value[:, 0, :n_classes]))
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int64),
+            max_depth=max_depth,
+            classes=np.asarray(model.classes_),
+            feature_names=np.asarray(model.feature_names_in_),
+            feature_importances=np.asarray(model.feature_importances_, dtype=np.float64),
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Write the bundle directory at path.
+
+        The bundle is assembled in a sibling temp directory and then renamed
+        over the old one. That is two renames, so a reader opening path in
+        between finds nothing there; it never sees a half-written bundle, but
+        this is not an atomic replace. Bundles that are swapped under a live
+        server belong in the model registry, which publishes each version as
+        a fresh directory.
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        arrays = {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "left": self.left,
+            "right": self.right,
+            "value": self.value,
+            "roots": self.roots,
+            "feature_importances": self.feature_importances_,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array))
+        meta = {
+            "max_depth": self.max_depth,
+            "classes": [str(c) for c in self.classes_],
+            "feature_names": [str(f) for f in self.feature_names_in_],
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=4)
+
+        old_path = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = "r") -> "FlatForest":
+        """Open a bundle directory; arrays are memory-mapped read-only by default."""
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        # np.asarray drops the np.memmap subclass but keeps the mapped buffer
+        arrays = {
+            name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False))
+            for name in ARRAY_NAMES
+        }
+        return cls(
+            feature=arrays["feature"],
+            threshold=arrays["threshold"],
+            left=arrays["left"],
+            right=arrays["right"],
+            value=arrays["value"],
+            roots=arrays["roots"],
+            max_depth=meta["max_depth"],
+            classes=np.asarray(meta["classes"]),
+            feature_names=np.asarray(meta["feature_names"]),
+            feature_importances=arrays["feature_importances"],
+        )
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """Return the leaf index reached in every tree, shape (n_estimators, n_samples)."""
+        # sklearn evaluates splits on float32 inputs against float64 thresholds
+        X32 = np.ascontiguousarray(X, dtype=np.float32)
+        rows = np.arange(X32.shape[0])
+        nodes = np.repeat(self.roots[:, None], X32.shape[0], axis=1)
+        for _ in range(self.max_depth):
+            go_left = X32[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """
+        Class probabilities, bit-identical to RandomForestClassifier.predict_proba.
+
+        Tree outputs are accumulated in estimator order and then divided by the
+        number of trees, the same float operations sklearn performs when it
+        predicts single-threaded (n_jobs=None or 1).
+        """
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[1], self.value.shape[1]), dtype=np.float64)
+        for tree_leaves in leaves:
+            proba += self.value[tree_leaves]
+        proba /= self.n_estimators
+        return proba
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def contributions(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Per-feature contributions to each sample's class probabilities.
+
+        Returns (bias, contributions) with shapes (n_classes,) and (n_samples,
+        n_features, n_classes). Following each sample's path, the change in
+        node value at every split is credited to the split's feature (Saabas'
+        path attribution), averaged over trees; bias is the forest's mean root
+        value. bias + contributions.sum(axis=1) equals predict_proba(X) up to
+        float rounding. All trees and samples advance one level per step, as
+        in apply(), and each step's credits are summed with one bincount per
+        class.
+        """
+        X32 = np.ascontiguousarray(X, dtype=np.float32)
+        n_samples, n_features = X32.shape
+        n_classes = self.value.shape[1]
+        rows = np.arange(n_samples)
+        # Flat (sample, feature) slot of every tree's current node
+        slot_base = np.broadcast_to(rows * n_features, (self.n_estimators, n_samples))
+        nodes = np.repeat(self.roots[:, None], n_samples, axis=1)
+        totals = np.zeros((n_samples * n_features, n_classes), dtype=np.float64)
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            go_left = X32[rows, feature] <= self.threshold[nodes]
+            children = np.where(go_left, self.left[nodes], self.right[nodes])
+            # Leaves point at themselves, so their delta is zero
+            delta = self.value[children] - self.value[nodes]
+            slots = (slot_base + feature).ravel()
+            for c in range(n_classes):
+                totals[:, c] += np.bincount(slots, weights=delta[..., c].ravel(), minlength=len(totals))
+            nodes = children
+        bias = self.value[self.roots].mean(axis=0)
+        return bias, totals.reshape(n_samples, n_features, n_classes) / self.n_estimators
+
+
+def _normalized(value: np.ndarray) -> np.ndarray:
+    """
+    Per-node class fractions, normalized as DecisionTreeClassifier.predict_proba does.
+
+    scikit-learn < 1.4 stores weighted class counts in tree_.value, later
+    versions fractions; dividing by the row sum handles both.
+    """
+    value = value.astype(np.float64)
+    normalizer = value.sum(axis=1)[:, None]
+    normalizer[normalizer == 0.0] = 1.0
+    return value / normalizer
+
+
+def export_forest(model, filepath: str = "model_bundle") -> FlatForest:
+    """Flatten a fitted RandomForestClassifier and save it for FlatForest.load."""
+    flat = FlatForest.from_sklearn(model)
+    flat.save(filepath)
+    return flat
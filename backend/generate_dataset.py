@@ -1,69 +1,205 @@
 """
 Generate a synthetic disaster dataset for training.
 Run this script to create disaster_data.csv in the backend directory.
+
+Rows are drawn in blocks of BLOCK_ROWS with fully vectorized sampling, and
+block i is always seeded from SeedSequence(seed, spawn_key=(i,)), so the
+output depends only on the seed and row count, never on how many processes
+wrote it. write_dataset shards blocks across processes that stream to disk.
+generate_history / populate_history produce analysis history in the storage
+layer's entry format for benchmarks.
+
+Run with: python generate_dataset.py [--rows N] [--output PATH] [--format csv|parquet]
+                                     [--processes P] [--seed S] [--history N]
 """
 
+import argparse
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 
+DISASTER_TYPES = ("Flood", "Earthquake", "Storm", "Drought", "Wildfire")
+COLUMNS = ("disaster_type", "deaths", "affected", "damage_usd")
+
+# Mean of the exponential distribution for deaths, affected and damage_usd, per disaster type
+TYPE_PARAMETERS = np.array([
+    [100.0, 50_000.0, 1e8],   # Flood
+    [500.0, 100_000.0, 5e8],  # Earthquake
+    [50.0, 30_000.0, 2e8],    # Storm
+    [20.0, 200_000.0, 5e7],   # Drought
+    [30.0, 10_000.0, 1e8],    # Wildfire
+])
+# Share of each numeric value that is left missing
+MISSING_RATE = 0.05
+# Unit of generation and of seeding
+BLOCK_ROWS = 100_000
+
+# History entries: severity mix of generated analyses
+HISTORY_SEVERITY_WEIGHTS = {"Low": 0.5, "Medium": 0.35, "High": 0.15}
+
+
+def _block_seed(seed: int, index: int) -> np.random.SeedSequence:
+    """Seed of block index; the same as SeedSequence(seed).spawn(index + 1)[index]."""
+    return np.random.SeedSequence(seed, spawn_key=(index,))
+
+
+def generate_block(seed: int, index: int, n_rows: int = BLOCK_ROWS) -> pd.DataFrame:
+    """Draw block index of the dataset for seed: types uniformly, then every value in one call per column set."""
+    rng = np.random.default_rng(_block_seed(seed, index))
+    types = rng.integers(0, len(DISASTER_TYPES), n_rows)
+    values = rng.exponential(1.0, size=(n_rows, 3)) * TYPE_PARAMETERS[types]
+    values[rng.random((n_rows, 3)) < MISSING_RATE] = np.nan
+    return pd.DataFrame({
+        "disaster_type": pd.Categorical.from_codes(types, DISASTER_TYPES),
+        "deaths": values[:, 0],
+        "affected": values[:, 1],
+        "damage_usd": values[:, 2],
+    })
+
+
+def _block_sizes(n_samples: int) -> list[int]:
+    full, rest = divmod(n_samples, BLOCK_ROWS)
+    return [BLOCK_ROWS] * full + ([rest] if rest else [])
+
 
 def generate_dataset(n_samples: int = 1000, random_state: int = 42) -> pd.DataFrame:
     """Generate a synthetic disaster dataset."""
-    rng = np.random.RandomState(random_state)
-
-    disaster_types = ["Flood", "Earthquake", "Storm", "Drought", "Wildfire"]
-
-    records = []
-    for _ in range(n_samples):
-        dtype = rng.choice(disaster_types)
-
-        # Generate realistic-ish numbers based on disaster type
-        if dtype == "Earthquake":
-            deaths = rng.exponential(500)
-            affected = rng.exponential(100000)
-            damage = rng.exponential(5e8)
-        elif dtype == "Flood":
-            deaths = rng.exponential(100)
-            affected = rng.exponential(50000)
-            damage = rng.exponential(1e8)
-        elif dtype == "Storm":
-            deaths = rng.exponential(50)
-            affected = rng.exponential(30000)
-            damage = rng.exponential(2e8)
-        elif dtype == "Drought":
-            deaths = rng.exponential(20)
-            affected = rng.exponential(200000)
-            damage = rng.exponential(5e7)
-        else:  # Wildfire
-            deaths = rng.exponential(30)
-            affected = rng.exponential(10000)
-            damage = rng.exponential(1e8)
-
-        # Introduce some missing values (~5%)
-        if rng.random() < 0.05:
-            deaths = np.nan
-        if rng.random() < 0.05:
-            affected = np.nan
-        if rng.random() < 0.05:
-            damage = np.nan
-
-        records.append({
-            "disaster_type": dtype,
-            "deaths": deaths,
-            "affected": affected,
-            "damage_usd": damage,
-        })
-
-    return pd.DataFrame(records)
+    blocks = [generate_block(random_state, i, n) for i, n in enumerate(_block_sizes(n_samples))]
+    if not blocks:
+        return generate_block(random_state, 0, 0)
+    return pd.concat(blocks, ignore_index=True)
+
+
+def _write_shard(path: str, fmt: str, seed: int, blocks: list[tuple[int, int]]) -> int:
+    """Stream the given (index, rows) blocks into one file, one block in memory at a time."""
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        for index, n_rows in blocks:
+            table = pa.Table.from_pandas(generate_block(seed, index, n_rows), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        with open(path, "w", newline="") as f:
+            for index, n_rows in blocks:
+                generate_block(seed, index, n_rows).to_csv(f, header=False, index=False)
+    return sum(n for _, n in blocks)
+
+
+def write_dataset(
+    path: str, n_samples: int, seed: int = 42, fmt: str = "csv", processes: int | None = None
+) -> int:
+    """
+    Generate n_samples rows and stream them to path using several processes.
+
+    Blocks are split into contiguous shards, one per process, and each shard
+    is written to its own part file. For CSV the parts are then concatenated
+    under a single header into path. For Parquet (requires pyarrow) path
+    becomes a directory of part-NNNNN.parquet files. Returns the row count.
+    """
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow; install it or use --format csv") from e
+    elif fmt != "csv":
+        raise ValueError(f"Unknown format: {fmt}")
+
+    blocks = list(enumerate(_block_sizes(n_samples)))
+    processes = max(1, min(processes or os.cpu_count() or 1, len(blocks) or 1))
+    # Contiguous shards keep part files in row order for concatenation
+    per_shard = -(-len(blocks) // processes) if blocks else 0
+    shards = [blocks[i * per_shard:(i + 1) * per_shard] for i in range(processes)]
+
+    parts_dir = f"{path}.parts-{os.getpid()}" if fmt == "csv" else f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+    part_paths = [os.path.join(parts_dir, f"part-{i:05d}.{fmt}") for i in range(processes)]
+    if processes == 1:
+        _write_shard(part_paths[0], fmt, seed, shards[0])
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            list(pool.map(_write_shard, part_paths, [fmt] * processes, [seed] * processes, shards))
+
+    if fmt == "csv":
+        with open(path, "w", newline="") as out:
+            out.write(",".join(COLUMNS) + "\n")
+            for part_path in part_paths:
+                with open(part_path, "r", newline="") as part:
+                    shutil.copyfileobj(part, out, 1 << 20)
+        shutil.rmtree(parts_dir)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(parts_dir, path)
+    return n_samples
+
+
+def generate_history(
+    n_entries: int, seed: int = 0, start: str = "2025-01-01T00:00:00", interval_s: int = 60
+):
+    """
+    Yield synthetic analysis history entries in storage's entry format.
+
+    Entries are interval_s seconds apart from start. Severities follow
+    HISTORY_SEVERITY_WEIGHTS and each entry carries the plan /optimize
+    returns for its severity. Draws are vectorized per block of BLOCK_ROWS.
+    """
+    from optimizer import COSTS, DEMAND_MAP, SOLVER_CLOSED_FORM
+
+    levels = list(HISTORY_SEVERITY_WEIGHTS)
+    weights = np.array(list(HISTORY_SEVERITY_WEIGHTS.values()))
+    plans = {
+        level: {
+            "resource_plan": dict(DEMAND_MAP[level]),
+            "total_cost": sum(DEMAND_MAP[level][item] * COSTS[item] for item in COSTS),
+            "solver": SOLVER_CLOSED_FORM,
+        }
+        for level in levels
+    }
+    rng = np.random.default_rng(seed)
+    origin = np.datetime64(start, "s")
+    for offset in range(0, n_entries, BLOCK_ROWS):
+        n = min(BLOCK_ROWS, n_entries - offset)
+        codes = rng.choice(len(levels), size=n, p=weights / weights.sum())
+        stamps = (origin + (offset + np.arange(n)) * np.timedelta64(interval_s, "s")).astype(str)
+        for timestamp, code in zip(stamps.tolist(), codes.tolist()):
+            level = levels[code]
+            yield {"timestamp": timestamp, "prediction": {"severity": level}, "optimization": plans[level]}
+
+
+def populate_history(n_entries: int, seed: int = 0, **kwargs) -> int:
+    """Append n_entries generated history entries to the configured storage database."""
+    from storage import append_history_entries
+    return append_history_entries(generate_history(n_entries, seed, **kwargs))
 
 
 def main() -> None:
     """Generate and save the dataset."""
-    df = generate_dataset()
-    output_path = os.path.join(os.path.dirname(__file__), "disaster_data.csv")
-    df.to_csv(output_path, index=False)
-    print(f"Generated {len(df)} records -> {output_path}")
+    parser = argparse.ArgumentParser(description="Generate synthetic disaster data")
+    parser.add_argument("--rows", type=int, default=1000, help="Dataset rows to generate")
+    parser.add_argument(
+        "--output", default=os.path.join(os.path.dirname(__file__), "disaster_data.csv"), help="Output path"
+    )
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--processes", type=int, default=None, help="Writer processes (default: CPU count)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--history", type=int, default=0, help="Also append N synthetic entries to storage history")
+    args = parser.parse_args()
+
+    if args.rows:
+        write_dataset(args.output, args.rows, seed=args.seed, fmt=args.format, processes=args.processes)
+        print(f"Generated {args.rows} records -> {args.output}")
+    if args.history:
+        populate_history(args.history, seed=args.seed)
+        print(f"Appended {args.history} history entries to storage")
 
 
 if __name__ == "__main__":
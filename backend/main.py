@@ -2,36 +2,218 @@
 FastAPI application for disaster severity prediction and resource optimization.
 """
 
+import asyncio
 import os
-from contextlib import asynccontextmanager
-
-import joblib
-import pandas as pd
-from fastapi import FastAPI, HTTPException, Response
+import secrets
+import threading
+import time
+import warnings
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from email.utils import formatdate
+
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import io
 import csv
+import zlib
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-
-from optimizer import optimize_resources
-from storage import load_storage, save_storage, update_inventory, add_history, get_inventory, get_history, get_stats, get_alerts
+from pydantic import BaseModel, Field, confloat, conint
+
+from batcher import PredictBatcher
+from events import broker
+from metrics import REGISTRY, MetricsMiddleware, render, time_stage
+from model_registry import ModelState, artifact_path, latest_version
+from optimizer import COSTS, allocate_incidents, optimize_cache, optimize_cached, tables_version
+from storage import get_alerts, get_inventory, get_stats
+from storage import decode_cursor, get_version, history_exists, history_page, iter_history, iter_history_export_rows
+from storage import InsufficientInventoryError, commit_reservation, release_reservation, reserve_inventory
+from storage import compact_history
+from result_cache import ResultCache
+from workers import PoolBusyError, WorkerPool, explain_task, install_model, load_model, optimize_task, predict_proba_task
 
 # Load trained model at startup
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "model.pkl")
-model = None
-model_features: list[str] = []
+MODEL_BUNDLE_PATH = os.path.join(os.path.dirname(__file__), "model_bundle")
+# "sklearn" serves the pickled estimator, "flat" the memory-mapped FlatForest bundle
+MODEL_ENGINE = os.environ.get("MODEL_ENGINE", "sklearn")
+# Seconds between checks of the model registry for a new version; 0 disables the watcher
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", 5))
+# POST /admin/reload requires this value in the X-Admin-Token header; unset, the route answers 403
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Explanations memoized per (model version, encoded row)
+EXPLAIN_CACHE_SIZE = int(os.environ.get("EXPLAIN_CACHE_SIZE", 4096))
+# Seconds between storage compactions (archive old history, snapshot inventory and KPIs); 0 disables
+STORAGE_COMPACT_INTERVAL_S = float(os.environ.get("STORAGE_COMPACT_INTERVAL_S", 3600))
+# Load the model and import the solver in the background once the API is ready;
+# when off, both happen on the first /predict and /optimize instead
+PREWARM_ON_STARTUP = os.environ.get("PREWARM_ON_STARTUP", "1") != "0"
+
+# Startup timings reported by /health
+_process_start = time.perf_counter()
+startup_timings: dict[str, float] = {}
+# The serving model version. Replaced as one reference, so a request that
+# reads it once sees a consistent model, encoder and version.
+model_state: ModelState | None = None
+_reload_lock = threading.Lock()
+# Set once the initial model load has run (whether or not it found a model)
+_initial_load = threading.Event()
+_initial_load_lock = threading.Lock()
+# Runs inference and solves; a process pool when WORKER_PROCESSES > 0
+worker_pool = WorkerPool()
+
+MAX_BATCH_SIZE = 10_000
+MAX_HISTORY_PAGE = 10_000
+
+# The model is fitted on a DataFrame but fed plain arrays in model_features order
+warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+
+
+def set_model(loaded_model, version: str = "in-memory", source: str | None = None, engine: str = MODEL_ENGINE) -> ModelState:
+    """
+    Make a fitted model (sklearn forest or FlatForest) the serving version.
+
+    The model is warmed with one inference (and loaded by any worker
+    processes) before the single model_state reference is replaced, so no
+    request ever sees a partially loaded version.
+    """
+    global model_state
+    state = ModelState(loaded_model, version, source, engine)
+    state.warm_up()
+    install_model(state.key, loaded_model)
+    if source is not None:
+        worker_pool.warm(state.key)
+    model_state = state
+    return state
+
+
+def reload_model(version: str | None = None) -> ModelState:
+    """
+    Load a registry version (default: the latest) and swap it in.
+
+    Raises FileNotFoundError when the version or its artifact does not exist
+    and ValueError when it cannot be loaded or fails warm-up; the active
+    version is untouched in every case. Reloading the active version is a no-op.
+    """
+    with _reload_lock:
+        version = version or latest_version()
+        if version is None:
+            raise FileNotFoundError("The model registry holds no versions")
+        if model_state is not None and model_state.version == version:
+            return model_state
+        path = artifact_path(version, MODEL_ENGINE)
+        try:
+            loaded = load_model(path, MODEL_ENGINE)
+        except Exception as e:
+            raise ValueError(f"Model version {version!r} could not be loaded: {e}") from e
+        return set_model(loaded, version=version, source=path)
+
+
+async def _watch_registry() -> None:
+    """Reload whenever a new version appears in the registry."""
+    seen = latest_version()
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_S)
+        latest = latest_version()
+        if latest is None or latest == seen:
+            continue
+        seen = latest
+        try:
+            await asyncio.to_thread(reload_model, latest)
+            print(f"Model version {latest} is now active")
+        except Exception as e:
+            print(f"Warning: could not activate model version {latest}: {e}")
+
+
+async def _compact_storage() -> None:
+    """Periodically move history past HISTORY_RETENTION_DAYS into the archive and take a snapshot."""
+    while True:
+        await asyncio.sleep(STORAGE_COMPACT_INTERVAL_S)
+        try:
+            result = await asyncio.to_thread(compact_history)
+            if result["archived"]:
+                print(f"Archived {result['archived']} history entries")
+        except Exception as e:
+            print(f"Warning: storage compaction failed: {e}")
+
+
+def load_initial_model() -> ModelState | None:
+    """
+    Load the latest registry version, else the unversioned artifact, unless a model is already serving.
+
+    Runs once per startup, from the prewarm task or the first /predict; callers
+    arriving meanwhile wait for it rather than load a second copy.
+    """
+    with _initial_load_lock:
+        start = time.perf_counter()
+        try:
+            if model_state is None and latest_version() is not None:
+                reload_model()
+            elif model_state is None:
+                path = MODEL_BUNDLE_PATH if MODEL_ENGINE == "flat" else MODEL_PATH
+                if os.path.exists(path):
+                    loaded = load_model(path, MODEL_ENGINE)
+                    with _reload_lock:
+                        if model_state is None:
+                            set_model(loaded, version="unversioned", source=path)
+                else:
+                    print(f"Warning: Model file not found at {path}. /predict will be unavailable.")
+        except Exception as e:
+            print(f"Warning: could not load the model: {e}")
+        finally:
+            startup_timings.setdefault("model_load_ms", round((time.perf_counter() - start) * 1000, 3))
+            _initial_load.set()
+        return model_state
+
+
+def _prewarm() -> None:
+    """Load the model and import the solver ahead of the first /predict and /optimize."""
+    load_initial_model()
+    import pulp  # noqa: F401  (optimizer imports it on the first solve)
+    startup_timings["prewarm_ms"] = round((time.perf_counter() - _process_start) * 1000, 3)
+
+
+async def _serving_state() -> ModelState | None:
+    """The serving model, running (or waiting for) the initial load if it has not finished."""
+    state = model_state
+    if state is None and not _initial_load.is_set():
+        state = await asyncio.to_thread(load_initial_model)
+    return state
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Load the ML model on startup."""
-    global model, model_features
-    if os.path.exists(MODEL_PATH):
-        model = joblib.load(MODEL_PATH)
-        model_features = list(model.feature_names_in_)
-    else:
-        print(f"Warning: Model file not found at {MODEL_PATH}. /predict will be unavailable.")
+    """
+    Become ready without loading the model, then prewarm it in the background.
+
+    Until the prewarm finishes, /predict waits for it; everything else is
+    served right away. The registry is watched for new versions and storage
+    compacted every STORAGE_COMPACT_INTERVAL_S throughout.
+    """
+    startup_timings.clear()
+    _initial_load.clear()
+    start = time.perf_counter()
+    # Workers load the model when set_model warms them, like any later version
+    worker_pool.start(None)
+    ready = time.perf_counter()
+    startup_timings["worker_start_ms"] = round((ready - start) * 1000, 3)
+    startup_timings["ready_ms"] = round((ready - _process_start) * 1000, 3)
+    prewarm = asyncio.create_task(asyncio.to_thread(_prewarm)) if PREWARM_ON_STARTUP else None
+    watcher = asyncio.create_task(_watch_registry()) if MODEL_WATCH_INTERVAL_S > 0 else None
+    compactor = asyncio.create_task(_compact_storage()) if STORAGE_COMPACT_INTERVAL_S > 0 else None
+    await broker.start()
     yield
+    await broker.stop()
+    for task in (watcher, compactor):
+        if task is not None:
+            task.cancel()
+    if prewarm is not None:
+        # A load in progress cannot be interrupted; let it finish before the pool goes away
+        with suppress(Exception):
+            await prewarm
+    worker_pool.shutdown()
 
 
 app = FastAPI(
@@ -48,7 +230,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 # --- Root Route ---
@@ -56,7 +240,7 @@ app.add_middleware(
 def read_root():
     return {
         "message": "Disaster Resource Allocation API is running",
-        "endpoints": ["/predict", "/optimize", "/warehouse", "/history", "/export/history", "/health", "/docs"]
+        "endpoints": ["/predict", "/predict/batch", "/optimize", "/optimize/joint", "/warehouse", "/history", "/events", "/export/history", "/metrics", "/health", "/docs"]
     }
 
 
@@ -69,10 +253,32 @@ class PredictRequest(BaseModel):
     damage_usd: float = Field(..., ge=0, description="Estimated damage in USD")
 
 
+class Explanation(BaseModel):
+    """Why this record got its class: base_value plus the contributions equals its confidence."""
+    base_value: float
+    contributions: dict[str, float]
+
+
 class PredictResponse(BaseModel):
     severity_level: str
     confidence: float
     feature_importance: dict[str, float]
+    explanation: Explanation | None = None
+
+
+class BatchPredictRequest(BaseModel):
+    records: list[PredictRequest] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+
+class BatchPredictItem(BaseModel):
+    severity_level: str
+    confidence: float
+    explanation: Explanation | None = None
+
+
+class BatchPredictResponse(BaseModel):
+    results: list[BatchPredictItem]
+    feature_importance: dict[str, float]
 
 
 class OptimizeRequest(BaseModel):
@@ -83,137 +289,442 @@ class OptimizeRequest(BaseModel):
 class OptimizeResponse(BaseModel):
     resource_plan: dict[str, int] | None = None
     total_cost: int | None = None
+    solver: str | None = None
+    cached: bool = Field(False, description="Served from the optimizer cache; solver is that of the original solve")
+    error: str | None = None
+
+
+class JointIncident(BaseModel):
+    id: str
+    region: str
+    severity: str | None = Field(None, description="Low, Medium or High; used when demand is omitted")
+    demand: dict[str, conint(ge=0)] | None = Field(None, description="Explicit units needed per resource")
+    priority: float = Field(1.0, gt=0, description="Weight on this incident's unmet demand")
+
+
+class JointWarehouse(BaseModel):
+    id: str
+    stock: dict[str, conint(ge=0)]
+    transport_costs: dict[str, confloat(ge=0)] = Field(..., description="Cost per unit shipped to each reachable region")
+
+
+class JointOptimizeRequest(BaseModel):
+    incidents: list[JointIncident] = Field(..., min_length=1)
+    warehouses: list[JointWarehouse] = Field(..., min_length=1)
+    budget: float | None = Field(None, gt=0, description="Optional cap on total delivery cost")
+    time_limit: float | None = Field(None, gt=0, le=300, description="Solver time limit in seconds")
+
+
+class JointAllocation(BaseModel):
+    warehouse: str
+    incident: str
+    item: str
+    quantity: int
+
+
+class JointOptimizeResponse(BaseModel):
+    allocations: list[JointAllocation] = []
+    incidents: dict[str, dict[str, dict[str, int]]] = {}
+    total_cost: int | None = None
+    solver: str | None = None
+    proven_optimal: bool | None = None
+    solve_time_ms: float | None = None
     error: str | None = None
 
 
 # --- Endpoints ---
 
+async def _run_cpu(fn, *args):
+    """Await fn(*args) on the worker pool, mapping a full queue to 429."""
+    try:
+        return await worker_pool.run(fn, *args)
+    except PoolBusyError:
+        raise HTTPException(status_code=429, detail="Server busy, retry shortly.", headers={"Retry-After": "1"})
+
+
+async def _predict_rows(X: np.ndarray, model_key: tuple[str, str]) -> np.ndarray:
+    with time_stage("model_inference"):
+        return await _run_cpu(predict_proba_task, model_key, X)
+
+
+# Coalesces concurrent /predict calls; off unless PREDICT_BATCH_WINDOW_MS > 0
+predict_batcher = PredictBatcher(_predict_rows)
+
+explain_cache = ResultCache(EXPLAIN_CACHE_SIZE, float("inf"))
+
+
+async def _explain_rows(state: ModelState, X: np.ndarray, best: np.ndarray) -> list[Explanation]:
+    """
+    Explanations of the predicted class best[i] for each row of X.
+
+    Rows already explained for this model version come from explain_cache;
+    the rest are explained together in one FlatForest.contributions pass.
+    """
+    keys = [(state.key, row.tobytes()) for row in X]
+    explanations = [explain_cache.get(key) for key in keys]
+    missing = [i for i, explanation in enumerate(explanations) if explanation is None]
+    if missing:
+        with time_stage("explain"):
+            bias, contributions = await _run_cpu(explain_task, state.key, X[missing])
+        for j, i in enumerate(missing):
+            c = best[i]
+            explanations[i] = {
+                "base_value": float(bias[c]),
+                "contributions": dict(zip(state.encoder.feature_names, contributions[j, :, c].tolist())),
+            }
+            explain_cache.put(keys[i], explanations[i])
+    return [Explanation(**explanation) for explanation in explanations]
+
+
 @app.post("/predict", response_model=PredictResponse)
-def predict(req: PredictRequest) -> PredictResponse:
+async def predict(
+    req: PredictRequest,
+    explain: bool = Query(False, description="Add per-feature contributions to this prediction"),
+) -> PredictResponse:
     """Predict disaster severity level from input parameters."""
-    if model is None:
+    state = await _serving_state()
+    if state is None:
         raise HTTPException(status_code=503, detail="Model not loaded. Train the model first.")
 
-    # Build feature vector matching the trained model's expected columns
-    data: dict = {
-        "deaths": [req.deaths],
-        "affected": [req.affected],
-        "damage_usd": [req.damage_usd],
-    }
-    # One-hot encode disaster_type to match training features
-    for feat in model_features:
-        if feat.startswith("disaster_type_"):
-            dtype = feat.replace("disaster_type_", "")
-            data[feat] = [1.0 if req.disaster_type == dtype else 0.0]
-
-    df = pd.DataFrame(data)
-    # Ensure all expected columns exist, fill missing with 0
-    for col in model_features:
-        if col not in df.columns:
-            df[col] = 0.0
-    df = df[model_features]
-
-    # Predict class and probabilities
-    prediction = model.predict(df)[0]
-    probabilities = model.predict_proba(df)[0]
-    classes = list(model.classes_)
-    confidence = float(max(probabilities))
-
-    # Calculate Feature Importance (simulating SHAP impact for this specific prediction)
-    # For RandomForest, we can use global importances or specific contribution
-    # Here we simplify with global importance but formatted for the UI
-    importance = {}
-    for feat, score in zip(model_features, model.feature_importances_):
-        # Only include non-zero or interesting features
-        if score > 0.01:
-            importance[feat] = float(score)
+    # Copy: the encoder's row buffer is reused by the next request on this thread
+    with time_stage("encode"):
+        row = state.encoder.encode_one(req).copy()
+    if predict_batcher.enabled:
+        probabilities = await predict_batcher.predict_proba(row, state.key)
+    else:
+        probabilities = (await _predict_rows(row, state.key))[0]
+    best = int(probabilities.argmax())
 
     return PredictResponse(
-        severity_level=prediction,
-        confidence=confidence,
-        feature_importance=importance
+        severity_level=state.model.classes_[best],
+        confidence=float(probabilities[best]),
+        feature_importance=state.encoder.importance,
+        explanation=(await _explain_rows(state, row, np.array([best])))[0] if explain else None,
     )
 
 
+@app.get("/predict/batching")
+def predict_batching_stats() -> dict:
+    """Micro-batching settings and the distribution of coalesced batch sizes."""
+    return predict_batcher.stats()
+
+
+@app.post("/predict/batch", response_model=BatchPredictResponse)
+async def predict_batch(
+    req: BatchPredictRequest,
+    explain: bool = Query(False, description="Add per-feature contributions to every prediction"),
+) -> BatchPredictResponse:
+    """Predict severity for many records with a single forest traversal."""
+    state = await _serving_state()
+    if state is None:
+        raise HTTPException(status_code=503, detail="Model not loaded. Train the model first.")
+
+    with time_stage("encode"):
+        X = state.encoder.encode_batch(req.records)
+    probabilities = await _predict_rows(X, state.key)
+    # Same label rule as RandomForestClassifier.predict, without a second pass
+    best = probabilities.argmax(axis=1)
+    labels = state.model.classes_[best]
+    confidences = probabilities[np.arange(len(best)), best]
+    explanations = await _explain_rows(state, X, best) if explain else [None] * len(best)
+
+    return BatchPredictResponse(
+        results=[
+            BatchPredictItem(severity_level=label, confidence=float(conf), explanation=explanation)
+            for label, conf, explanation in zip(labels, confidences, explanations)
+        ],
+        feature_importance=state.encoder.importance,
+    )
+
+
+def _apply_plan(severity_level: str, result: dict) -> str | None:
+    """
+    Deduct a plan's resources and record it; returns an error message on shortage.
+
+    The stock is held first so concurrent requests can never over-draw it,
+    then history and the permanent deduction are written together.
+    """
+    try:
+        reservation_id = reserve_inventory(result["resource_plan"])
+    except InsufficientInventoryError as e:
+        return str(e)
+    try:
+        commit_reservation(reservation_id, {"severity": severity_level}, result)
+    except Exception:
+        release_reservation(reservation_id)
+        raise
+    return None
+
+
+async def _solve_optimize(severity_level: str, budget: float) -> dict:
+    with time_stage("optimize_solve"):
+        return await _run_cpu(optimize_task, severity_level, budget)
+
+
 @app.post("/optimize", response_model=OptimizeResponse)
-def optimize(req: OptimizeRequest) -> OptimizeResponse:
+async def optimize(req: OptimizeRequest) -> OptimizeResponse:
     """Optimize resource allocation for a given severity and budget."""
-    result = optimize_resources(req.severity_level, req.budget)
+    result = await optimize_cached(req.severity_level, req.budget, _solve_optimize)
     if "error" in result:
-        return OptimizeResponse(error=result["error"])
-    
-    # Track optimization in history and deduct from inventory
-    update_inventory(result["resource_plan"])
-    # Note: We don't have the predict request here, but in a real app we'd link them.
-    # For now, we record a simplified history entry or just the optimization.
-    add_history({"severity": req.severity_level}, result)
+        return OptimizeResponse(error=result["error"], solver=result.get("solver"), cached=result["cached"])
+
+    error = await run_in_threadpool(_apply_plan, req.severity_level, result)
+    if error is not None:
+        return OptimizeResponse(error=error, solver=result["solver"], cached=result["cached"])
 
     return OptimizeResponse(
         resource_plan=result["resource_plan"],
         total_cost=result["total_cost"],
+        solver=result["solver"],
+        cached=result["cached"],
     )
 
 
+@app.get("/optimize/cache")
+def optimize_cache_stats() -> dict:
+    """Hit/miss counters and occupancy of the /optimize result cache."""
+    return {**optimize_cache.stats(), "tables_version": tables_version()}
+
+
+@app.post("/optimize/joint", response_model=JointOptimizeResponse)
+def optimize_joint(req: JointOptimizeRequest) -> JointOptimizeResponse:
+    """Jointly allocate several warehouses' stock across many simultaneous incidents (planning only)."""
+    for items, kind in ((req.incidents, "incident"), (req.warehouses, "warehouse")):
+        if len({item.id for item in items}) != len(items):
+            raise HTTPException(status_code=400, detail=f"Duplicate {kind} ids.")
+    resources = [incident.demand or {} for incident in req.incidents] + [warehouse.stock for warehouse in req.warehouses]
+    unknown = sorted({item for units in resources for item in units} - COSTS.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown resources: {', '.join(unknown)}.")
+    with time_stage("joint_solve"):
+        result = allocate_incidents(
+            [incident.model_dump() for incident in req.incidents],
+            [warehouse.model_dump() for warehouse in req.warehouses],
+            budget=req.budget,
+            time_limit=req.time_limit,
+        )
+    return JointOptimizeResponse(**result)
+
+
+# --- Conditional GET ---
+# Read routes are tagged with the storage version. A client that sends back
+# the current ETag gets 304 without the data being read, and the serialized
+# body of each small route is kept per version, so repeated polls between
+# writes cost one version lookup.
+
+# route key -> (etag, serialized body) for the latest version seen
+_body_cache: dict[str, tuple[str, bytes]] = {}
+
+
+def _version_headers() -> tuple[str, dict]:
+    # Read before the data: a body is then never older than the version it is tagged with
+    version = get_version()
+    etag = f'"{version["database_id"]}-{version["version"]}"'
+    return etag, {
+        "ETag": etag,
+        "Last-Modified": formatdate(version["updated_at"], usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Whether If-None-Match lists etag (weak comparison, as RFC 9110 requires for GET)."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _conditional_json(request: Request, key: str, build) -> Response:
+    """JSON of build() tagged with the storage version; 304 or the cached body when unchanged."""
+    etag, headers = _version_headers()
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    cached = _body_cache.get(key)
+    if cached is not None and cached[0] == etag:
+        body = cached[1]
+    else:
+        body = JSONResponse(build()).body
+        _body_cache[key] = (etag, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+
 @app.get("/warehouse")
-def get_warehouse_status():
+def get_warehouse_status(request: Request):
     """Get current inventory levels."""
-    return get_inventory()
+    return _conditional_json(request, "warehouse", get_inventory)
+
+
+def _json_array_stream(chunks):
+    """Encode chunks of pre-serialized JSON values as one streamed JSON array."""
+    yield b"["
+    first = True
+    for chunk in chunks:
+        body = ", ".join(chunk)
+        yield (body if first else ", " + body).encode()
+        first = False
+    yield b"]"
 
 
 @app.get("/history")
-def get_all_history():
-    """Get all past prediction and optimization history."""
-    return get_history()
+def get_all_history(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=MAX_HISTORY_PAGE, description="Page size; omit for all matching entries"),
+    after: str | None = Query(None, description="Cursor from a previous page's X-Next-Cursor header"),
+    since: datetime | None = Query(None, description="Only entries at or after this time"),
+    until: datetime | None = Query(None, description="Only entries before this time"),
+    severity: str | None = Query(None, description="Only entries with this severity"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="asc: oldest first; desc: newest first"),
+):
+    """
+    Get past prediction and optimization history, oldest first (newest first with order=desc).
+
+    Results are streamed in chunks. When limit is set and more entries match,
+    the X-Next-Cursor response header holds the value to pass as after, with
+    the same order; order=desc&limit=N is therefore the N most recent entries.
+    Responses carry the storage ETag; bodies are not cached, since a full
+    history can be arbitrarily large.
+    """
+    try:
+        cursor = decode_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    descending = order == "desc"
+    etag, headers = _version_headers()
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    if limit is None:
+        chunks = iter_history(cursor, since, until, severity, raw=True, descending=descending)
+    else:
+        # The cursor and the page come from one snapshot, so a concurrent write can't shift the boundary
+        next_cursor, chunks = history_page(cursor, since, until, severity, limit, raw=True, descending=descending)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+    return StreamingResponse(_json_array_stream(chunks), media_type="application/json", headers=headers)
 
 
 @app.get("/stats")
-def get_dashboard_stats():
+def get_dashboard_stats(request: Request):
     """Get aggregate KPIs for the dashboard."""
-    return get_stats()
+    return _conditional_json(request, "stats", get_stats)
 
 
 @app.get("/alerts")
-def get_system_alerts():
+def get_system_alerts(request: Request):
     """Get active inventory alerts."""
-    return get_alerts()
+    return _conditional_json(request, "alerts", get_alerts)
 
 
-@app.get("/export/history")
-def export_history_csv():
-    """Export historical data as a CSV file."""
-    history = get_history()
-    if not history:
-        raise HTTPException(status_code=404, detail="No history found to export.")
+@app.get("/events")
+async def event_stream():
+    """
+    Server-sent events replacing /warehouse, /stats and /alerts polling.
+
+    Sends a snapshot on connect, then inventory / stats / alerts events
+    carrying only what changed, as storage is written.
+    """
+    return StreamingResponse(
+        broker.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+EXPORT_HEADER = ["Timestamp", "Severity", "Total Cost", "Food Kits", "Medical Units", "Shelters"]
 
+
+def _history_csv_stream(chunks, compress: bool = False):
+    """
+    Encode chunks of export rows as CSV, one write buffer per storage chunk.
+
+    Memory stays bounded by the chunk size regardless of history length.
+    With compress=True the output is a single gzip member.
+    """
     output = io.StringIO()
     writer = csv.writer(output)
-    
-    # Header
-    writer.writerow(["Timestamp", "Severity", "Total Cost", "Food Kits", "Medical Units", "Shelters"])
-    
-    # Rows
-    for entry in history:
-        prediction = entry.get("prediction", {})
-        optimization = entry.get("optimization", {})
-        plan = optimization.get("resource_plan", {})
-        writer.writerow([
-            entry.get("timestamp"),
-            prediction.get("severity"),
-            optimization.get("total_cost"),
-            plan.get("food_kits"),
-            plan.get("medical_units"),
-            plan.get("shelters")
-        ])
-    
-    output.seek(0)
-    return Response(
-        content=output.getvalue(),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=disaster_history.csv"}
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def drain() -> bytes:
+        data = output.getvalue().encode()
+        output.seek(0)
+        output.truncate()
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(EXPORT_HEADER)
+    yield drain()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        data = drain()
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+@app.get("/export/history")
+def export_history_csv(
+    since: datetime | None = Query(None, description="Only entries at or after this time"),
+    until: datetime | None = Query(None, description="Only entries before this time"),
+    gzip: bool = Query(False, description="Compress the CSV as .csv.gz"),
+    include_archive: bool = Query(False, description="Also export history moved to archive segments"),
+):
+    """Export historical data as a CSV file, streamed straight from storage."""
+    if not history_exists(since=since, until=until, archived=include_archive):
+        raise HTTPException(status_code=404, detail="No history found to export.")
+
+    filename = "disaster_history.csv.gz" if gzip else "disaster_history.csv"
+    return StreamingResponse(
+        _history_csv_stream(
+            iter_history_export_rows(since=since, until=until, archived=include_archive), compress=gzip
+        ),
+        media_type="application/gzip" if gzip else "text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    """Request and stage metrics in Prometheus text format, summed over workers when METRICS_DIR is set."""
+    return PlainTextResponse(render(REGISTRY.collect()), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/admin/reload")
+async def admin_reload(
+    version: str | None = Query(None, description="Registry version to activate; default the latest"),
+    x_admin_token: str | None = Header(None),
+) -> dict:
+    """Load a model version from the registry, warm it and swap it in without dropping requests."""
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled; set ADMIN_TOKEN to enable them.")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    previous = model_state.version if model_state is not None else None
+    start = time.perf_counter()
+    try:
+        state = await asyncio.to_thread(reload_model, version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {
+        "version": state.version,
+        "previous_version": previous,
+        "reload_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
 @app.get("/health")
 def health() -> dict:
     """Health check endpoint."""
-    return {"status": "ok", "model_loaded": model is not None}
+    state = model_state
+    return {
+        "status": "ok",
+        "model_loaded": state is not None,
+        "model_version": state.version if state is not None else None,
+        "model_engine": MODEL_ENGINE,
+        "startup": startup_timings,
+        "workers": worker_pool.stats(),
+        "events": broker.stats(),
+    }
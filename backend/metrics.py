@@ -0,0 +1,285 @@
+"""
+Prometheus text-format metrics for the API.
+
+Counts requests and records latency histograms per route, plus histograms
+for internal stages (feature encoding, model inference, optimizer solves,
+storage reads and writes). Served at /metrics.
+
+Every process keeps its own registry. With METRICS_DIR set (shared by all
+workers of one server), each process writes its snapshot there at most every
+METRICS_FLUSH_S seconds and /metrics sums every snapshot in the directory, so
+whichever worker answers the scrape reports the whole server. Snapshots
+left by processes that have exited are dropped (and deleted) when /metrics
+collects, so restarts don't keep counting dead workers. Set
+METRICS_ENABLED=0 to turn recording into no-ops.
+"""
+
+import asyncio
+import bisect
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_S = float(os.environ.get("METRICS_FLUSH_S", 1.0))
+
+# Histogram upper bounds in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple, lock: threading.Lock):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.series: dict[tuple, float] = {}
+        self._lock = lock
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        with self._lock:
+            self.series[labels] = self.series.get(labels, 0.0) + amount
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self.series.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple, lock: threading.Lock, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self.series: dict[tuple, list] = {}
+        self._lock = lock
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.series.get(labels)
+            if entry is None:
+                entry = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def snapshot(self) -> list:
+        return [[list(labels), list(counts), total] for labels, (counts, total) in self.series.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram] = {}
+        self._lock = threading.Lock()
+        self._next_flush = 0.0
+
+    def counter(self, name: str, help: str, labelnames: tuple) -> Counter:
+        self.metrics[name] = Counter(name, help, labelnames, self._lock)
+        return self.metrics[name]
+
+    def histogram(self, name: str, help: str, labelnames: tuple, buckets=DEFAULT_BUCKETS) -> Histogram:
+        self.metrics[name] = Histogram(name, help, labelnames, self._lock, buckets)
+        return self.metrics[name]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "kind": metric.kind,
+                    "help": metric.help,
+                    "labelnames": list(metric.labelnames),
+                    "buckets": list(getattr(metric, "buckets", ())),
+                    "series": metric.snapshot(),
+                }
+                for name, metric in self.metrics.items()
+            }
+
+    def flush(self, directory: str) -> None:
+        """Write this process's snapshot to directory, replacing its previous one atomically."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        # Per-thread temp name: the event loop's flush and a /metrics collect may overlap
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    async def maybe_flush(self) -> None:
+        """Flush to METRICS_DIR if METRICS_FLUSH_S has passed, off the event loop."""
+        if METRICS_DIR is None:
+            return
+        now = time.monotonic()
+        if now >= self._next_flush:
+            self._next_flush = now + METRICS_FLUSH_S
+            await asyncio.to_thread(self.flush, METRICS_DIR)
+
+    def collect(self) -> dict:
+        """This process's snapshot, or the sum over every live process when METRICS_DIR is set."""
+        if METRICS_DIR is None:
+            return self.snapshot()
+        self.flush(METRICS_DIR)
+        snapshots = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "metrics-*.json")):
+            pid = os.path.basename(path)[len("metrics-"):-len(".json")]
+            try:
+                if not _pid_alive(int(pid)):
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except FileNotFoundError:
+                # Another worker removed the same dead snapshot first
+                continue
+        return merge_snapshots(snapshots)
+
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process with this PID exists (signal 0 only checks)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_snapshots(snapshots: list[dict]) -> dict:
+    """Sum counters and histogram buckets with matching names and labels."""
+    merged: dict = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "series": {}})
+            for labels, *values in metric["series"]:
+                key = tuple(labels)
+                if metric["kind"] == "counter":
+                    target["series"][key] = target["series"].get(key, 0.0) + values[0]
+                else:
+                    counts, total = values
+                    current = target["series"].get(key)
+                    if current is None:
+                        target["series"][key] = [list(counts), total]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], counts)]
+                        current[1] += total
+    for metric in merged.values():
+        metric["series"] = [[list(key), *value] if metric["kind"] == "histogram" else [list(key), value]
+                            for key, value in metric["series"].items()]
+    return merged
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(snapshot: dict) -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labelnames"]
+        for labels, *values in sorted(metric["series"], key=lambda s: s[0]):
+            if metric["kind"] == "counter":
+                lines.append(f"{name}{_format_labels(names, labels)} {values[0]}")
+                continue
+            counts, total = values
+            cumulative = 0
+            for bound, count in zip([*metric["buckets"], "+Inf"], counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_format_labels(names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(names, labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+requests_total = REGISTRY.counter(
+    "http_requests_total", "HTTP requests handled, by route template, method and status.", ("route", "method", "status")
+)
+request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte.", ("route", "method")
+)
+stage_duration = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent in internal processing stages.", ("stage",)
+)
+
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stage_duration.observe(time.perf_counter() - self.start, self.stage)
+
+
+_DISABLED = nullcontext()
+
+
+def time_stage(stage: str):
+    """Context manager recording its body's duration under stage_duration_seconds{stage=...}."""
+    return _StageTimer(stage) if METRICS_ENABLED else _DISABLED
+
+
+def timed(stage: str):
+    """Decorator form of time_stage."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with time_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting and timing every HTTP request.
+
+    Requests are labelled with the matched route template (e.g. /history, not
+    /history?after=...), so label cardinality stays bounded; anything that
+    matched no route is labelled "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            requests_total.inc(path, scope["method"], str(status))
+            request_duration.observe(time.perf_counter() - start, path, scope["method"])
+            await REGISTRY.maybe_flush()
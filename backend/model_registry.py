@@ -0,0 +1,84 @@
+"""
+Versioned model registry and the serving-side model state.
+
+The registry is a directory with one subdirectory per model version, each
+holding the artifacts save_model writes (model.pkl and model_bundle/).
+train.publish_model assembles a version in a hidden temp directory and renames
+it into place, so a version directory is either absent or complete. Version
+names sort chronologically; the greatest one is the latest.
+
+ModelState bundles everything a request needs from one version (estimator,
+feature encoder, version label) so the API can swap versions by replacing a
+single reference.
+"""
+
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from encoder import FeatureEncoder
+
+MODEL_REGISTRY_DIR = os.environ.get(
+    "MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(__file__), "model_registry")
+)
+MODEL_FILENAME = "model.pkl"
+BUNDLE_DIRNAME = "model_bundle"
+
+# Record fed through a freshly loaded model before it takes traffic
+WARMUP_RECORD = {"disaster_type": "Flood", "deaths": 100.0, "affected": 50_000.0, "damage_usd": 1e7}
+
+
+def list_versions(registry: str | None = None) -> list[str]:
+    """Complete versions in the registry, oldest first."""
+    registry = registry or MODEL_REGISTRY_DIR
+    if not os.path.isdir(registry):
+        return []
+    return sorted(
+        name for name in os.listdir(registry)
+        if not name.startswith(".") and os.path.isdir(os.path.join(registry, name))
+    )
+
+
+def latest_version(registry: str | None = None) -> str | None:
+    versions = list_versions(registry)
+    return versions[-1] if versions else None
+
+
+def artifact_path(version: str, engine: str, registry: str | None = None) -> str:
+    """Path of the artifact a given engine loads for version; raises FileNotFoundError if absent."""
+    name = BUNDLE_DIRNAME if engine == "flat" else MODEL_FILENAME
+    path = os.path.join(registry or MODEL_REGISTRY_DIR, version, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Model version {version!r} has no {name}")
+    return path
+
+
+class ModelState:
+    """
+    One loaded model version, ready to serve.
+
+    key identifies the artifact to worker processes, which load and cache
+    models by key; in-memory models (no source path) are keyed by id.
+    """
+
+    def __init__(self, model, version: str, source: str | None = None, engine: str = "sklearn"):
+        self.model = model
+        self.encoder = FeatureEncoder.from_model(model)
+        self.version = version
+        self.source = source
+        self.engine = engine
+        self.loaded_at = time.time()
+        self.key = (source or f"memory:{id(model)}", engine)
+
+    def warm_up(self) -> None:
+        """
+        Run one inference so lazy initialization happens before traffic arrives.
+
+        Raises ValueError if the model does not return one finite probability
+        per class, so a broken artifact never becomes active.
+        """
+        probabilities = self.model.predict_proba(self.encoder.encode_batch([SimpleNamespace(**WARMUP_RECORD)]))
+        if probabilities.shape != (1, len(self.model.classes_)) or not np.all(np.isfinite(probabilities)):
+            raise ValueError(f"Model version {self.version!r} failed warm-up inference")
@@ -1,9 +1,30 @@
 """
 Resource allocation optimizer using PuLP linear programming.
 Minimizes total cost while meeting minimum resource demand within budget.
+
+Problems are first checked for structure that admits a closed-form answer;
+only models whose constraints actually couple the variables are handed to
+the CBC solver through PuLP.
+
+optimize_cached puts a bounded LRU/TTL cache in front of optimize_resources;
+/optimize awaits it with a solve callback that runs on the worker pool.
+
+allocate_incidents handles the joint case: many incidents competing for the
+stock of several warehouses, solved as one sparse transportation MIP.
+
+PuLP is imported by the functions that build models, so importing this
+module (and serving closed-form or cached plans) never loads it.
 """
 
-from pulp import LpMinimize, LpProblem, LpVariable, LpStatus, value
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from result_cache import ResultCache
 
 # Resource demand by severity level
 DEMAND_MAP: dict[str, dict[str, int]] = {
@@ -19,55 +40,316 @@ COSTS: dict[str, int] = {
     "shelters": 500,
 }
 
+SOLVER_CLOSED_FORM = "closed_form"
+SOLVER_PULP = "pulp"
+
+# Memoized optimize_resources results: entry bound and lifetime in seconds
+OPTIMIZE_CACHE_SIZE = int(os.environ.get("OPTIMIZE_CACHE_SIZE", 256))
+OPTIMIZE_CACHE_TTL_S = float(os.environ.get("OPTIMIZE_CACHE_TTL_S", 3600))
+
+# Wall-clock cap for a joint allocation solve; the best solution found so far is returned
+JOINT_TIME_LIMIT_S = float(os.environ.get("JOINT_TIME_LIMIT_S", 10))
+# Cost of leaving one unit of demand unmet, as a multiple of the item's most expensive delivery
+UNMET_DEMAND_PENALTY = 100
+
+# Previous joint solution, keyed by (warehouse, incident, item), used as a CBC warm start
+_last_joint_solution: dict[tuple[str, str, str], float] = {}
+_joint_lock = threading.Lock()
+
 
-def optimize_resources(severity_level: str, budget: float) -> dict:
+def _lhs(coeffs: dict[str, float], values: dict[str, float]) -> float:
+    return sum(coef * values[name] for name, coef in coeffs.items())
+
+
+def _satisfied(constraint: tuple, values: dict[str, float]) -> bool:
+    coeffs, sense, rhs = constraint
+    lhs = _lhs(coeffs, values)
+    return lhs <= rhs if sense == "<=" else lhs >= rhs
+
+
+def _solve_closed_form(
+    costs: dict[str, float], lower_bounds: dict[str, float], constraints: list[tuple]
+) -> dict | None:
     """
-    Optimize resource allocation for a given severity level and budget.
+    Solve min c.x s.t. x >= lb without a solver when the structure allows it.
 
-    Returns a dict with resource_plan and total_cost, or an error message.
+    With non-negative costs the lower-bound vector minimizes the objective over
+    the whole box x >= lb, so if it satisfies every constraint it is optimal.
+    If it violates a "<=" constraint whose coefficients are all non-negative,
+    raising any variable only makes that worse, so the problem is infeasible.
+    Anything else (e.g. a violated covering constraint) couples the variables
+    and returns None.
     """
-    if severity_level not in DEMAND_MAP:
-        return {"error": f"Unknown severity level: {severity_level}"}
+    if any(c < 0 for c in costs.values()):
+        return None
+    if any(float(lb) != int(lb) for lb in lower_bounds.values()):
+        return None
+
+    values = {name: int(lower_bounds[name]) for name in costs}
+    violated = [c for c in constraints if not _satisfied(c, values)]
+    if not violated:
+        return {"status": "Optimal", "values": values, "objective": _lhs(costs, values), "solver": SOLVER_CLOSED_FORM}
+    for coeffs, sense, _ in violated:
+        if sense == "<=" and all(coef >= 0 for coef in coeffs.values()):
+            return {"status": "Infeasible", "values": None, "objective": None, "solver": SOLVER_CLOSED_FORM}
+    return None
 
-    demand = DEMAND_MAP[severity_level]
 
-    # Create LP problem
+def _solve_pulp(
+    costs: dict[str, float], lower_bounds: dict[str, float], constraints: list[tuple]
+) -> dict:
+    from pulp import PULP_CBC_CMD, LpMinimize, LpProblem, LpStatus, LpVariable, lpSum, value
+
     prob = LpProblem("Disaster_Resource_Allocation", LpMinimize)
+    variables = {
+        name: LpVariable(name, lowBound=lower_bounds[name], cat="Integer") for name in costs
+    }
+    prob += lpSum(costs[name] * var for name, var in variables.items()), "Total_Cost"
+    for i, (coeffs, sense, rhs) in enumerate(constraints):
+        expr = lpSum(coef * variables[name] for name, coef in coeffs.items())
+        prob += (expr <= rhs if sense == "<=" else expr >= rhs), f"Constraint_{i}"
 
-    # Decision variables (must meet at least minimum demand)
-    food = LpVariable("food_kits", lowBound=demand["food_kits"], cat="Integer")
-    medical = LpVariable("medical_units", lowBound=demand["medical_units"], cat="Integer")
-    shelters = LpVariable("shelters", lowBound=demand["shelters"], cat="Integer")
+    prob.solve(PULP_CBC_CMD(msg=False))
 
-    # Objective: minimize total cost
-    total_cost_expr = (
-        COSTS["food_kits"] * food
-        + COSTS["medical_units"] * medical
-        + COSTS["shelters"] * shelters
-    )
-    prob += total_cost_expr, "Total_Cost"
+    status = LpStatus[prob.status]
+    if status != "Optimal":
+        return {"status": status, "values": None, "objective": None, "solver": SOLVER_PULP}
+    return {
+        "status": status,
+        "values": {name: value(var) for name, var in variables.items()},
+        "objective": value(prob.objective),
+        "solver": SOLVER_PULP,
+    }
+
+
+def solve_min_cost(
+    costs: dict[str, float],
+    lower_bounds: dict[str, float],
+    constraints: list[tuple],
+    solver: str = "auto",
+) -> dict:
+    """
+    Minimize sum(costs[v] * v) over integer variables v >= lower_bounds[v].
+
+    constraints is a list of (coeffs, sense, rhs) with sense "<=" or ">=".
+    solver="auto" tries the closed form first; solver="pulp" always calls CBC.
+    Returns a dict with status, values, objective and the solver path taken.
+    """
+    if solver == "auto":
+        result = _solve_closed_form(costs, lower_bounds, constraints)
+        if result is not None:
+            return result
+    return _solve_pulp(costs, lower_bounds, constraints)
 
-    # Budget constraint
-    prob += total_cost_expr <= budget, "Budget_Constraint"
 
-    # Solve
-    prob.solve()
+def optimize_resources(severity_level: str, budget: float, solver: str = "auto") -> dict:
+    """
+    Optimize resource allocation for a given severity level and budget.
+
+    Returns a dict with resource_plan, total_cost and the solver path used,
+    or an error message.
+    """
+    if severity_level not in DEMAND_MAP:
+        return {"error": f"Unknown severity level: {severity_level}"}
+
+    demand = DEMAND_MAP[severity_level]
+
+    # Decision variables must meet at least minimum demand; total cost within budget
+    constraints = [(COSTS, "<=", budget)]
+    result = solve_min_cost(COSTS, demand, constraints, solver=solver)
 
-    if LpStatus[prob.status] != "Optimal":
+    if result["status"] != "Optimal":
         return {
             "error": "Optimization infeasible: budget too low to meet minimum demand.",
-            "minimum_required": (
-                demand["food_kits"] * COSTS["food_kits"]
-                + demand["medical_units"] * COSTS["medical_units"]
-                + demand["shelters"] * COSTS["shelters"]
-            ),
+            "minimum_required": sum(demand[item] * COSTS[item] for item in COSTS),
+            "solver": result["solver"],
         }
 
-    resource_plan = {
-        "food_kits": int(value(food)),
-        "medical_units": int(value(medical)),
-        "shelters": int(value(shelters)),
+    resource_plan = {item: int(result["values"][item]) for item in COSTS}
+    total_cost = int(result["objective"])
+
+    return {"resource_plan": resource_plan, "total_cost": total_cost, "solver": result["solver"]}
+
+
+def tables_version() -> str:
+    """Short content hash of DEMAND_MAP and COSTS; changes whenever either table is edited."""
+    payload = json.dumps([DEMAND_MAP, COSTS], sort_keys=True).encode()
+    return hashlib.sha1(payload).hexdigest()[:12]
+
+
+optimize_cache = ResultCache(OPTIMIZE_CACHE_SIZE, OPTIMIZE_CACHE_TTL_S)
+
+
+def optimize_cache_key(severity_level: str, budget: float) -> tuple:
+    """
+    Cache key for an optimize_resources call.
+
+    Costs and demands are integers, so "total cost <= budget" holds exactly
+    when it holds for floor(budget); budgets with the same floor share an
+    entry. The key also carries tables_version(), so editing DEMAND_MAP or
+    COSTS misses every older entry.
+    """
+    return (severity_level, math.floor(budget), tables_version())
+
+
+async def optimize_cached(severity_level: str, budget: float, solve=None) -> dict:
+    """
+    optimize_resources behind optimize_cache.
+
+    On a miss, solve(severity_level, budget) is awaited; by default
+    optimize_resources runs in a worker thread. Results are pure: any
+    inventory side effects stay with the caller and run on every request.
+    The result's "cached" is True when it was served from the cache, whose
+    "solver" then names the solve that originally produced it.
+    """
+    key = optimize_cache_key(severity_level, budget)
+    result = optimize_cache.get(key)
+    if result is not None:
+        return {**result, "cached": True}
+    if solve is None:
+        result = await asyncio.to_thread(optimize_resources, severity_level, budget)
+    else:
+        result = await solve(severity_level, budget)
+    optimize_cache.put(key, result)
+    return {**result, "cached": False}
+
+
+def allocate_incidents(
+    incidents: list[dict],
+    warehouses: list[dict],
+    budget: float | None = None,
+    time_limit: float | None = None,
+    warm_start: bool = True,
+) -> dict:
+    """
+    Jointly allocate warehouse stock to many simultaneous incidents.
+
+    incidents: [{"id", "region", "severity" or "demand", "priority" (default 1)}]
+    warehouses: [{"id", "stock": {item: units}, "transport_costs": {region: cost per unit}}]
+
+    Minimizes unit cost plus transport cost plus a priority-weighted penalty
+    for unmet demand, subject to warehouse stock and an optional total
+    budget. Variables exist only for (warehouse, incident, item) triples where
+    the warehouse stocks the item, the incident needs it and the warehouse
+    reaches the incident's region, so the model stays sparse. The previous
+    solution seeds CBC (warm start) and the solve stops after time_limit
+    seconds with the best solution found.
+    """
+    if time_limit is None:
+        time_limit = JOINT_TIME_LIMIT_S
+
+    for kind, resources in (("demand", [i.get("demand") or {} for i in incidents]), ("stock", [w["stock"] for w in warehouses])):
+        for units in resources:
+            unknown = sorted(units.keys() - COSTS.keys())
+            if unknown:
+                return {"error": f"Unknown resources in {kind}: {', '.join(unknown)}"}
+            if any(n < 0 for n in units.values()):
+                return {"error": f"Negative {kind} is not allowed"}
+    if any(cost < 0 for w in warehouses for cost in w.get("transport_costs", {}).values()):
+        return {"error": "Negative transport costs are not allowed"}
+
+    demand: dict[str, dict[str, int]] = {}
+    for incident in incidents:
+        if "demand" in incident and incident["demand"] is not None:
+            demand[incident["id"]] = {item: int(incident["demand"].get(item, 0)) for item in COSTS}
+        elif incident.get("severity") in DEMAND_MAP:
+            demand[incident["id"]] = dict(DEMAND_MAP[incident["severity"]])
+        else:
+            return {"error": f"Incident {incident['id']}: unknown severity level {incident.get('severity')}"}
+
+    max_transport = max(
+        (cost for w in warehouses for cost in w.get("transport_costs", {}).values()), default=0
+    )
+    from pulp import PULP_CBC_CMD, LpMinimize, LpProblem, LpStatus, LpVariable, lpSum
+
+    prob = LpProblem("Joint_Disaster_Allocation", LpMinimize)
+    ship: dict[tuple[str, str, str], LpVariable] = {}
+    for w in warehouses:
+        for incident in incidents:
+            transport = w.get("transport_costs", {}).get(incident["region"])
+            if transport is None:
+                continue
+            for item in COSTS:
+                if w["stock"].get(item, 0) > 0 and demand[incident["id"]][item] > 0:
+                    key = (w["id"], incident["id"], item)
+                    ship[key] = LpVariable(f"ship_{len(ship)}", lowBound=0, cat="Integer")
+    unmet = {
+        (incident["id"], item): LpVariable(f"unmet_{i}_{item}", lowBound=0, upBound=demand[incident["id"]][item])
+        for i, incident in enumerate(incidents)
+        for item in COSTS
+        if demand[incident["id"]][item] > 0
     }
-    total_cost = int(value(prob.objective))
 
-    return {"resource_plan": resource_plan, "total_cost": total_cost}
+    transport_cost = {w["id"]: w.get("transport_costs", {}) for w in warehouses}
+    region = {incident["id"]: incident["region"] for incident in incidents}
+    delivery_cost = lpSum(
+        (COSTS[item] + transport_cost[w_id][region[i_id]]) * var for (w_id, i_id, item), var in ship.items()
+    )
+    priority = {incident["id"]: incident.get("priority", 1) for incident in incidents}
+    penalty = lpSum(
+        UNMET_DEMAND_PENALTY * (COSTS[item] + max_transport) * priority[i_id] * var
+        for (i_id, item), var in unmet.items()
+    )
+    prob += delivery_cost + penalty, "Total_Cost"
+
+    by_incident: dict[tuple[str, str], list] = {key: [] for key in unmet}
+    by_warehouse: dict[tuple[str, str], list] = {}
+    for (w_id, i_id, item), var in ship.items():
+        by_incident[(i_id, item)].append(var)
+        by_warehouse.setdefault((w_id, item), []).append(var)
+    for (i_id, item), shipped in by_incident.items():
+        prob += lpSum(shipped) + unmet[(i_id, item)] == demand[i_id][item], f"Demand_{len(prob.constraints)}"
+    stock = {w["id"]: w["stock"] for w in warehouses}
+    for (w_id, item), shipped in by_warehouse.items():
+        prob += lpSum(shipped) <= stock[w_id][item], f"Stock_{len(prob.constraints)}"
+    if budget is not None:
+        prob += delivery_cost <= budget, "Budget_Constraint"
+
+    with _joint_lock:
+        previous = dict(_last_joint_solution) if warm_start else {}
+    seeded = 0
+    for key, var in ship.items():
+        if key in previous:
+            var.setInitialValue(previous[key])
+            seeded += 1
+
+    start = time.perf_counter()
+    prob.solve(PULP_CBC_CMD(msg=False, timeLimit=time_limit, warmStart=seeded > 0))
+    solve_ms = (time.perf_counter() - start) * 1000
+
+    status = LpStatus[prob.status]
+    if status != "Optimal":
+        return {"error": f"Joint allocation failed: {status}", "solver": SOLVER_PULP, "solve_time_ms": solve_ms}
+
+    quantities = {key: int(round(var.value() or 0)) for key, var in ship.items()}
+    with _joint_lock:
+        _last_joint_solution.clear()
+        _last_joint_solution.update(quantities)
+
+    allocations = [
+        {"warehouse": w_id, "incident": i_id, "item": item, "quantity": qty}
+        for (w_id, i_id, item), qty in quantities.items()
+        if qty > 0
+    ]
+    fulfilled = {i_id: {item: 0 for item in COSTS} for i_id in demand}
+    total_cost = 0
+    for (w_id, i_id, item), qty in quantities.items():
+        fulfilled[i_id][item] += qty
+        total_cost += qty * (COSTS[item] + transport_cost[w_id][region[i_id]])
+
+    return {
+        "allocations": allocations,
+        "incidents": {
+            i_id: {
+                "fulfilled": fulfilled[i_id],
+                "shortfall": {item: demand[i_id][item] - fulfilled[i_id][item] for item in COSTS},
+            }
+            for i_id in demand
+        },
+        "total_cost": int(round(total_cost)),
+        "solver": SOLVER_PULP,
+        # CBC reports 1 for a proven optimum, 2 when the time limit stopped it at a feasible solution
+        "proven_optimal": prob.sol_status == 1,
+        "warm_started_variables": seeded,
+        "solve_time_ms": solve_ms,
+    }
@@ -1,8 +1,49 @@
+"""
+Persistent storage for warehouse inventory and analysis history.
+
+State lives in a SQLite database (WAL mode): history is an append-only,
+indexed table and inventory is a small keyed table that every process keeps
+materialized in memory. Every mutation runs in a BEGIN IMMEDIATE transaction,
+which takes SQLite's write lock and so serializes writers across threads and
+processes; stock deductions check availability under that lock and never
+drive inventory negative. Dashboard KPIs are running aggregates updated in the
+same transaction as each history append, so /stats never scans history.
+The legacy ``storage.json`` file is migrated into the database the first
+time it is opened (see ``migrate_from_json``). Every transaction that
+changes a row also bumps a persistent, monotonically increasing version in
+the meta table, shared by all processes (see ``get_version``); callbacks
+registered with ``add_change_listener`` run after such commits in this process.
+
+History older than HISTORY_RETENTION_DAYS is moved out of the database by
+``compact_history`` into one gzip-compressed JSON-lines segment per month in
+the archive directory, catalogued in the archive_segments table. API reads
+only see the rows still in the database; exports can include the archive.
+The aggregates of archived rows are kept in archived_aggregates, so KPIs keep
+counting them and ``verify_stats`` still recomputes exactly. Each compaction
+also records a snapshot of the inventory and aggregates (``take_snapshot``).
+"""
+
+import argparse
+import base64
+import glob
+import gzip
+import heapq
+import itertools
 import json
 import os
-from datetime import datetime
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager, suppress
+from datetime import datetime, timedelta
+
+from metrics import timed
 
 STORAGE_PATH = os.path.join(os.path.dirname(__file__), "storage.json")
+DB_PATH = os.environ.get("STORAGE_DB_PATH", os.path.join(os.path.dirname(__file__), "storage.db"))
+# Archive segments go here; by default an "archive" directory next to the database
+ARCHIVE_DIR = os.environ.get("STORAGE_ARCHIVE_DIR")
 
 DEFAULT_STATE = {
     "inventory": {
@@ -13,42 +54,950 @@ DEFAULT_STATE = {
     "history": []
 }
 
-def load_storage():
-    if not os.path.exists(STORAGE_PATH):
-        save_storage(DEFAULT_STATE)
-        return DEFAULT_STATE
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory (
+    item TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    severity TEXT,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_severity ON history(severity, timestamp);
+CREATE TABLE IF NOT EXISTS reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    items TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_pending ON reservations(status, created_at);
+CREATE TABLE IF NOT EXISTS aggregates (
+    name TEXT PRIMARY KEY,
+    value NUMERIC NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive_segments (
+    month TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    entries INTEGER NOT NULL,
+    first_timestamp TEXT NOT NULL,
+    last_timestamp TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archived_aggregates (
+    name TEXT PRIMARY KEY,
+    value NUMERIC NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    version INTEGER NOT NULL,
+    inventory TEXT NOT NULL,
+    aggregates TEXT NOT NULL
+);
+"""
+
+SEVERITY_LEVELS = ("Low", "Medium", "High")
+RESOURCE_ITEMS = ("food_kits", "medical_units", "shelters")
+
+# Rows fetched per round trip when streaming history
+HISTORY_CHUNK_SIZE = 500
+
+# Pending reservations older than this are released back to stock
+RESERVATION_TTL_S = float(os.environ.get("RESERVATION_TTL_S", 300))
+
+# compact_history archives history older than this many days; 0 keeps it all in the database
+HISTORY_RETENTION_DAYS = float(os.environ.get("HISTORY_RETENTION_DAYS", 90))
+# Archive segments whose newest entry is older than this many days are deleted; 0 keeps them forever
+ARCHIVE_RETENTION_DAYS = float(os.environ.get("ARCHIVE_RETENTION_DAYS", 0))
+# Most recent snapshots kept by take_snapshot
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", 48))
+
+
+class InsufficientInventoryError(ValueError):
+    """Raised when a deduction or reservation asks for more than is in stock."""
+
+    def __init__(self, shortages: dict):
+        self.shortages = shortages
+        details = ", ".join(
+            f"{item} (requested {s['requested']:,}, available {s['available']:,})" for item, s in shortages.items()
+        )
+        super().__init__(f"Insufficient inventory: {details}")
+
+# Per-thread connection plus the inventory materialized for that connection.
+# ``PRAGMA data_version`` changes whenever another connection commits, so the
+# cached inventory is only re-read after a foreign write.
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized: set[str] = set()
+
+# Called with no arguments after each committed transaction that changed a row
+_change_listeners: list = []
+
+
+def add_change_listener(callback) -> None:
+    """
+    Run callback() after every data-changing transaction this process commits.
+
+    Callbacks run on the writing thread, so they must be quick and must not
+    raise (e.g. only schedule work elsewhere). Writes by other processes are
+    not reported; compare get_stats() / get_inventory() to detect those.
+    """
+    _change_listeners.append(callback)
+
+
+def remove_change_listener(callback) -> None:
+    if callback in _change_listeners:
+        _change_listeners.remove(callback)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH and _local.pid == os.getpid():
+        return conn
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    # A connection inherited through fork() must not be used by the child
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn = conn
+    _local.path = DB_PATH
+    _local.pid = os.getpid()
+    _local.inventory = None
+    _local.data_version = None
+    _ensure_schema(conn)
+    return conn
+
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    with _init_lock:
+        if DB_PATH in _initialized:
+            return
+        conn.executescript(SCHEMA)
+        with _transaction(conn):
+            conn.executemany(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)",
+                [("database_id", uuid.uuid4().hex[:12]), ("version", 0), ("updated_at", time.time())],
+            )
+            seeded = conn.execute("SELECT COUNT(*) FROM inventory").fetchone()[0]
+            if not seeded:
+                state = _read_json(STORAGE_PATH) if os.path.exists(STORAGE_PATH) else DEFAULT_STATE
+                _replace_state(conn, state)
+            elif conn.execute("SELECT 1 FROM aggregates WHERE name = 'total_analyses'").fetchone() is None:
+                # Database created before aggregates existed
+                _write_aggregates(conn, _compute_aggregates(conn))
+        _initialized.add(DB_PATH)
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    """
+    BEGIN IMMEDIATE takes the write lock up front, serializing writers across processes.
+
+    If the body changed any row, the storage version is bumped in the same
+    transaction and the change listeners run after the commit.
+    """
+    changes = conn.total_changes
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        with open(STORAGE_PATH, "r") as f:
-            return json.load(f)
-    except Exception:
-        return DEFAULT_STATE
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        _local.inventory = None
+        raise
+    changed = conn.total_changes != changes
+    if changed:
+        conn.execute(
+            "UPDATE meta SET value = CASE key WHEN 'version' THEN value + 1 ELSE ? END "
+            "WHERE key IN ('version', 'updated_at')",
+            (time.time(),),
+        )
+    conn.execute("COMMIT")
+    if changed:
+        for callback in list(_change_listeners):
+            callback()
+
+
+def get_version() -> dict:
+    """
+    The storage version: {"version", "updated_at", "database_id"}.
+
+    version increases with every committed change by any process; updated_at
+    is the Unix time of that change. database_id is fixed when the database
+    is created, so (database_id, version) never repeats across databases.
+    """
+    return dict(_connect().execute(
+        "SELECT key, value FROM meta WHERE key IN ('database_id', 'version', 'updated_at')"
+    ).fetchall())
+
+
+def _read_json(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _history_row(entry: dict) -> tuple:
+    return (
+        entry.get("timestamp") or datetime.now().isoformat(),
+        entry.get("prediction", {}).get("severity"),
+        json.dumps({"prediction": entry.get("prediction", {}), "optimization": entry.get("optimization", {})}),
+    )
+
+
+def _history_entry(timestamp: str, entry: str) -> dict:
+    return {"timestamp": timestamp, **json.loads(entry)}
+
+
+def _raw_history_entry(entry_id: int, timestamp: str, entry: str) -> str:
+    # Stored entries are JSON objects, so the id/timestamp fields can be prepended textually
+    return f'{{"id": {entry_id}, "timestamp": {json.dumps(timestamp)}, {entry[1:]}'
+
+
+def _aggregate_deltas(prediction: dict, optimization: dict) -> dict:
+    """Contribution of one history entry to each running aggregate."""
+    plan = optimization.get("resource_plan", {})
+    deltas = {"total_analyses": 1, "total_cost": optimization.get("total_cost", 0)}
+    for item in RESOURCE_ITEMS:
+        deltas[f"deployed:{item}"] = plan.get(item, 0)
+    severity = prediction.get("severity", "")
+    if severity in SEVERITY_LEVELS:
+        deltas[f"severity:{severity}"] = 1
+    return deltas
+
+
+def _empty_aggregates() -> dict:
+    aggregates = {"total_analyses": 0, "total_cost": 0}
+    aggregates.update({f"deployed:{item}": 0 for item in RESOURCE_ITEMS})
+    aggregates.update({f"severity:{level}": 0 for level in SEVERITY_LEVELS})
+    return aggregates
+
+
+def _compute_aggregates(conn: sqlite3.Connection) -> dict:
+    """Recompute every aggregate from the raw history rows, plus those of archived rows."""
+    aggregates = _empty_aggregates()
+    for name, value in conn.execute("SELECT name, value FROM archived_aggregates"):
+        aggregates[name] = aggregates.get(name, 0) + value
+    return _add_deltas(aggregates, (entry for (entry,) in conn.execute("SELECT entry FROM history ORDER BY id")))
+
+
+def _add_deltas(aggregates: dict, entries) -> dict:
+    """Add the aggregate deltas of stored entry JSON strings to aggregates."""
+    for entry in entries:
+        data = json.loads(entry)
+        for name, delta in _aggregate_deltas(data.get("prediction", {}), data.get("optimization", {})).items():
+            aggregates[name] = aggregates.get(name, 0) + delta
+    return aggregates
+
+
+def _write_aggregates(conn: sqlite3.Connection, aggregates: dict) -> None:
+    conn.execute("DELETE FROM aggregates")
+    conn.executemany("INSERT INTO aggregates (name, value) VALUES (?, ?)", list(aggregates.items()))
 
+
+def _read_aggregates(conn: sqlite3.Connection) -> dict:
+    aggregates = _empty_aggregates()
+    aggregates.update(conn.execute("SELECT name, value FROM aggregates").fetchall())
+    return aggregates
+
+
+def _replace_state(conn: sqlite3.Connection, data: dict) -> None:
+    """Replace inventory and all history, archived included; _remove_orphan_segments deletes the old files."""
+    conn.execute("DELETE FROM inventory")
+    conn.execute("DELETE FROM history")
+    conn.execute("DELETE FROM archive_segments")
+    conn.execute("DELETE FROM archived_aggregates")
+    conn.executemany(
+        "INSERT INTO inventory (item, count) VALUES (?, ?)",
+        list(data.get("inventory", DEFAULT_STATE["inventory"]).items()),
+    )
+    conn.executemany(
+        "INSERT INTO history (timestamp, severity, entry) VALUES (?, ?, ?)",
+        (_history_row(h) for h in data.get("history", [])),
+    )
+    _write_aggregates(conn, _compute_aggregates(conn))
+    _local.inventory = None
+
+
+def migrate_from_json(json_path: str = STORAGE_PATH, overwrite: bool = False) -> int:
+    """
+    Import a legacy storage.json file into the database.
+
+    Refuses to touch a database that already holds history unless overwrite
+    is set. Returns the number of history entries imported.
+    """
+    data = _read_json(json_path)
+    conn = _connect()
+    with _transaction(conn):
+        existing = conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        if existing and not overwrite:
+            raise RuntimeError(f"Database at {DB_PATH} already holds {existing} history entries; use overwrite=True.")
+        _replace_state(conn, data)
+    _remove_orphan_segments(conn)
+    return len(data.get("history", []))
+
+
+@timed("load_storage")
+def load_storage():
+    """Return a full snapshot of the stored state (inventory and history)."""
+    return {"inventory": get_inventory(), "history": get_history()}
+
+
+@timed("save_storage")
 def save_storage(data):
-    with open(STORAGE_PATH, "w") as f:
-        json.dump(data, f, indent=4)
+    """Replace the whole stored state with ``data``."""
+    conn = _connect()
+    with _transaction(conn):
+        _replace_state(conn, data)
+    _remove_orphan_segments(conn)
 
-def update_inventory(resources: dict):
-    data = load_storage()
-    for item, count in resources.items():
-        if item in data["inventory"]:
-            data["inventory"][item] -= count
-    save_storage(data)
 
-def add_history(prediction: dict, optimization: dict):
-    data = load_storage()
+def _cache_inventory(conn: sqlite3.Connection) -> None:
+    """Refresh this connection's materialized inventory from inside a write transaction."""
+    _local.inventory = dict(conn.execute("SELECT item, count FROM inventory ORDER BY rowid").fetchall())
+    _local.data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def _deduct(conn: sqlite3.Connection, resources: dict) -> None:
+    """Decrement every tracked item at once, or raise InsufficientInventoryError and change nothing."""
+    inventory = dict(conn.execute("SELECT item, count FROM inventory").fetchall())
+    shortages = {
+        item: {"requested": count, "available": inventory[item]}
+        for item, count in resources.items()
+        if item in inventory and count > inventory[item]
+    }
+    if shortages:
+        raise InsufficientInventoryError(shortages)
+    conn.executemany(
+        "UPDATE inventory SET count = count - ? WHERE item = ?",
+        [(count, item) for item, count in resources.items()],
+    )
+
+
+def _append_history(conn: sqlite3.Connection, prediction: dict, optimization: dict) -> None:
     history_entry = {
         "timestamp": datetime.now().isoformat(),
         "prediction": prediction,
         "optimization": optimization
     }
-    data["history"].append(history_entry)
-    save_storage(data)
+    conn.execute("INSERT INTO history (timestamp, severity, entry) VALUES (?, ?, ?)", _history_row(history_entry))
+    conn.executemany(
+        "INSERT INTO aggregates (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        list(_aggregate_deltas(prediction, optimization).items()),
+    )
+
+
+def _restock(conn: sqlite3.Connection, items: dict) -> None:
+    conn.executemany(
+        "UPDATE inventory SET count = count + ? WHERE item = ?",
+        [(count, item) for item, count in items.items()],
+    )
+
+
+def _expire_reservations(conn: sqlite3.Connection) -> None:
+    """Return stock held by pending reservations older than RESERVATION_TTL_S (e.g. from a crashed worker)."""
+    expired = conn.execute(
+        "SELECT id, items FROM reservations WHERE status = 'pending' AND created_at < ?",
+        (time.time() - RESERVATION_TTL_S,),
+    ).fetchall()
+    for reservation_id, items in expired:
+        _restock(conn, json.loads(items))
+        conn.execute("UPDATE reservations SET status = 'expired' WHERE id = ?", (reservation_id,))
+
+
+def update_inventory(resources: dict):
+    """Deduct resources from inventory atomically; raises InsufficientInventoryError on shortage."""
+    conn = _connect()
+    with _transaction(conn):
+        _deduct(conn, resources)
+        _cache_inventory(conn)
+
+
+@timed("reserve_inventory")
+def reserve_inventory(resources: dict) -> int:
+    """
+    Hold stock for a plan and return the reservation id.
+
+    All items are taken out of inventory in one transaction, or none are and
+    InsufficientInventoryError is raised. Follow with commit_reservation or
+    release_reservation.
+    """
+    conn = _connect()
+    with _transaction(conn):
+        _expire_reservations(conn)
+        _deduct(conn, resources)
+        cursor = conn.execute(
+            "INSERT INTO reservations (items, status, created_at) VALUES (?, 'pending', ?)",
+            (json.dumps(resources), time.time()),
+        )
+        _cache_inventory(conn)
+    return cursor.lastrowid
+
+
+def _close_reservation(conn: sqlite3.Connection, reservation_id: int, status: str) -> dict:
+    row = conn.execute(
+        "SELECT items FROM reservations WHERE id = ? AND status = 'pending'", (reservation_id,)
+    ).fetchone()
+    if row is None:
+        raise KeyError(f"No pending reservation {reservation_id}")
+    conn.execute("UPDATE reservations SET status = ? WHERE id = ?", (status, reservation_id))
+    return json.loads(row[0])
+
+
+@timed("commit_reservation")
+def commit_reservation(reservation_id: int, prediction: dict | None = None, optimization: dict | None = None) -> None:
+    """
+    Make a reservation's deduction permanent.
+
+    When prediction/optimization are given, the history entry is appended in
+    the same transaction, so stock and history can never disagree.
+    """
+    conn = _connect()
+    with _transaction(conn):
+        _close_reservation(conn, reservation_id, "committed")
+        if optimization is not None:
+            _append_history(conn, prediction or {}, optimization)
+
+
+@timed("release_reservation")
+def release_reservation(reservation_id: int) -> None:
+    """Cancel a pending reservation and return its stock."""
+    conn = _connect()
+    with _transaction(conn):
+        _restock(conn, _close_reservation(conn, reservation_id, "released"))
+        _cache_inventory(conn)
+
+
+def append_history_entries(entries, batch_size: int = 10_000) -> int:
+    """
+    Bulk-append history entries that carry their own timestamps.
+
+    Entries are inserted batch_size at a time, each batch in one transaction
+    together with its summed aggregate deltas, so memory stays bounded for
+    any iterable. Returns the number of entries written.
+    """
+    conn = _connect()
+    entries = iter(entries)
+    total = 0
+    while batch := list(itertools.islice(entries, batch_size)):
+        deltas: dict = {}
+        for entry in batch:
+            for name, delta in _aggregate_deltas(entry.get("prediction", {}), entry.get("optimization", {})).items():
+                deltas[name] = deltas.get(name, 0) + delta
+        with _transaction(conn):
+            conn.executemany(
+                "INSERT INTO history (timestamp, severity, entry) VALUES (?, ?, ?)", [_history_row(e) for e in batch]
+            )
+            conn.executemany(
+                "INSERT INTO aggregates (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                list(deltas.items()),
+            )
+        total += len(batch)
+    return total
+
+
+@timed("add_history")
+def add_history(prediction: dict, optimization: dict):
+    conn = _connect()
+    with _transaction(conn):
+        _append_history(conn, prediction, optimization)
+
 
 def get_inventory():
-    return load_storage()["inventory"]
+    conn = _connect()
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if _local.inventory is None or _local.data_version != data_version:
+        _local.inventory = dict(conn.execute("SELECT item, count FROM inventory ORDER BY rowid").fetchall())
+        _local.data_version = data_version
+    return dict(_local.inventory)
+
 
 def get_history():
-    return load_storage()["history"]
+    rows = _connect().execute("SELECT timestamp, entry FROM history ORDER BY id")
+    return [_history_entry(ts, entry) for ts, entry in rows]
+
+
+def encode_cursor(timestamp: str, entry_id: int) -> str:
+    """Opaque pagination cursor pointing just past the given history row."""
+    return base64.urlsafe_b64encode(f"{timestamp},{entry_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit(",", 1)
+        return timestamp, int(entry_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor!r}") from e
+
+
+def _timestamp_bound(value) -> str:
+    """Normalize a datetime (naive = local time) or ISO string to the stored timestamp format."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+
+def _history_filter(
+    after: tuple | None, since, until, severity: str | None, descending: bool = False
+) -> tuple[str, list]:
+    """
+    WHERE clause over the (timestamp, id) ordering.
+
+    after selects the rows past the cursor in the direction of travel.
+    Every combination is served by idx_history_timestamp or, with a severity
+    filter, idx_history_severity (scanned backwards when descending), so only
+    matching rows are visited.
+    """
+    clauses, params = [], []
+    if severity is not None:
+        clauses.append("severity = ?")
+        params.append(severity)
+    if after is not None:
+        clauses.append(f"(timestamp, id) {'<' if descending else '>'} (?, ?)")
+        params.extend(after)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(_timestamp_bound(since))
+    if until is not None:
+        clauses.append("timestamp < ?")
+        params.append(_timestamp_bound(until))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return where, params
+
+
+def _history_order(descending: bool) -> str:
+    return "timestamp DESC, id DESC" if descending else "timestamp, id"
+
+
+@contextmanager
+def _reader():
+    """A private connection for long-running reads, so streams never share a writer's connection."""
+    _connect()
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def iter_history(
+    after: tuple | None = None,
+    since=None,
+    until=None,
+    severity: str | None = None,
+    limit: int | None = None,
+    chunk_size: int = HISTORY_CHUNK_SIZE,
+    raw: bool = False,
+    descending: bool = False,
+):
+    """
+    Stream history in (timestamp, id) order as chunks of at most chunk_size rows.
+
+    after is a decoded cursor (timestamp, id); since is inclusive and until
+    exclusive. Entries carry their "id". With raw=True each entry is yielded
+    as a JSON string spliced from the stored row instead of a dict. With
+    descending=True the newest entries come first, so limit takes the tail.
+    The rows are read from a single snapshot on a dedicated connection.
+    """
+    sql, params = _history_query(after, since, until, severity, limit, descending)
+    with _reader() as conn:
+        yield from _history_chunks(conn.execute(sql, params), chunk_size, raw)
+
+
+def history_page(
+    after: tuple | None = None,
+    since=None,
+    until=None,
+    severity: str | None = None,
+    limit: int = HISTORY_CHUNK_SIZE,
+    chunk_size: int = HISTORY_CHUNK_SIZE,
+    raw: bool = False,
+    descending: bool = False,
+):
+    """
+    One limit-sized page of history as (next_cursor, chunks).
+
+    next_cursor is what next_history_cursor would return, and chunks streams
+    the page like iter_history. Both are read in one read transaction, so a
+    write landing while the page is served can neither skip a row nor
+    repeat one across pages.
+    """
+    page = _history_page(after, since, until, severity, limit, chunk_size, raw, descending)
+    return next(page), page
+
+
+def _history_page(after, since, until, severity, limit, chunk_size, raw, descending):
+    """Yield the next-page cursor, then the page's chunks, from a single snapshot."""
+    sql, params = _history_query(after, since, until, severity, limit, descending)
+    with _reader() as conn:
+        conn.execute("BEGIN")
+        try:
+            yield _next_cursor(conn, after, since, until, severity, limit, descending)
+            yield from _history_chunks(conn.execute(sql, params), chunk_size, raw)
+        finally:
+            conn.rollback()
+
+
+def _history_query(after, since, until, severity, limit, descending) -> tuple[str, list]:
+    where, params = _history_filter(after, since, until, severity, descending)
+    sql = f"SELECT id, timestamp, entry FROM history {where} ORDER BY {_history_order(descending)}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def _history_chunks(cursor, chunk_size: int, raw: bool):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        if raw:
+            yield [_raw_history_entry(i, ts, entry) for i, ts, entry in rows]
+        else:
+            yield [{"id": i, **_history_entry(ts, entry)} for i, ts, entry in rows]
+
+
+def iter_history_export_rows(since=None, until=None, chunk_size: int = HISTORY_CHUNK_SIZE, archived: bool = False):
+    """
+    Stream (timestamp, severity, total_cost, food_kits, medical_units, shelters)
+    tuples in (timestamp, id) order, chunk_size rows at a time.
+
+    Fields are extracted by SQLite's JSON functions, so no row is parsed in
+    Python. With archived=True, entries from the archive segments that
+    overlap the range are merged in.
+    """
+    where, params = _history_filter(None, since, until, None)
+    sql = (
+        "SELECT timestamp, json_extract(entry, '$.prediction.severity'), "
+        "json_extract(entry, '$.optimization.total_cost'), "
+        "json_extract(entry, '$.optimization.resource_plan.food_kits'), "
+        "json_extract(entry, '$.optimization.resource_plan.medical_units'), "
+        "json_extract(entry, '$.optimization.resource_plan.shelters') "
+        f"FROM history {where} ORDER BY timestamp, id"
+    )
+    with _history_snapshot(since, until, archived) as (conn, files):
+        cursor = conn.execute(sql, params)
+        chunks = iter(lambda: cursor.fetchmany(chunk_size), [])
+        if archived:
+            # Rows not yet compacted may be older than archived ones, so merge rather than concatenate
+            rows = heapq.merge(
+                (_export_row(entry) for entry in _archived_entries(files, since, until)),
+                itertools.chain.from_iterable(chunks),
+                key=lambda row: row[0],
+            )
+            chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+        yield from chunks
+
+
+def _export_row(entry: dict) -> tuple:
+    """The iter_history_export_rows tuple for a parsed history entry."""
+    optimization = entry.get("optimization", {})
+    plan = optimization.get("resource_plan", {})
+    return (
+        entry["timestamp"], entry.get("prediction", {}).get("severity"), optimization.get("total_cost"),
+        plan.get("food_kits"), plan.get("medical_units"), plan.get("shelters"),
+    )
+
+
+def history_exists(since=None, until=None, severity: str | None = None, archived: bool = False) -> bool:
+    """Whether any history entry matches the filters (one index probe, plus an archive scan if asked)."""
+    where, params = _history_filter(None, since, until, severity)
+    if _connect().execute(f"SELECT 1 FROM history {where} LIMIT 1", params).fetchone() is not None:
+        return True
+    return archived and any(
+        severity is None or entry.get("prediction", {}).get("severity") == severity
+        for entry in iter_archived_history(since, until)
+    )
+
+
+def next_history_cursor(
+    after: tuple | None = None,
+    since=None,
+    until=None,
+    severity: str | None = None,
+    limit: int = HISTORY_CHUNK_SIZE,
+    descending: bool = False,
+) -> str | None:
+    """Cursor for the page after a limit-sized page, or None when that page is the last one."""
+    return _next_cursor(_connect(), after, since, until, severity, limit, descending)
+
+
+def _next_cursor(conn, after, since, until, severity, limit, descending) -> str | None:
+    where, params = _history_filter(after, since, until, severity, descending)
+    rows = conn.execute(
+        f"SELECT id, timestamp FROM history {where} ORDER BY {_history_order(descending)} LIMIT 2 OFFSET ?",
+        params + [limit - 1],
+    ).fetchall()
+    if len(rows) < 2:
+        return None
+    entry_id, timestamp = rows[0]
+    return encode_cursor(timestamp, entry_id)
+
+
+def _archive_dir() -> str:
+    return ARCHIVE_DIR or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "archive")
+
+
+def list_archive_segments() -> list[dict]:
+    """The archive catalog, oldest month first."""
+    rows = _connect().execute(
+        "SELECT month, path, entries, first_timestamp, last_timestamp, created_at FROM archive_segments ORDER BY month"
+    ).fetchall()
+    keys = ("month", "path", "entries", "first_timestamp", "last_timestamp", "created_at")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def _open_segments(conn: sqlite3.Connection, since: str | None, until: str | None) -> list:
+    """Open the segments overlapping [since, until), in month order; FileNotFoundError if one was replaced."""
+    clauses, params = [], []
+    if since is not None:
+        clauses.append("last_timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        clauses.append("first_timestamp < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    files = []
+    try:
+        for (name,) in conn.execute(f"SELECT path FROM archive_segments {where} ORDER BY month", params).fetchall():
+            files.append(gzip.open(os.path.join(_archive_dir(), name), "rt"))
+    except FileNotFoundError:
+        for f in files:
+            f.close()
+        raise
+    return files
+
+
+@contextmanager
+def _history_snapshot(since=None, until=None, archived: bool = True):
+    """
+    A reader connection in a read transaction, plus the archive segments overlapping [since, until) opened.
+
+    Reading the catalog and the history table in one transaction means an
+    entry is never seen both archived and in the database. Open files stay
+    readable after a compaction replaces them.
+    """
+    for _ in range(3):
+        with _reader() as conn:
+            conn.execute("BEGIN")
+            try:
+                files = _open_segments(conn, _timestamp_bound(since), _timestamp_bound(until)) if archived else []
+            except FileNotFoundError:
+                # A compaction replaced a segment after this snapshot began; start a newer one
+                conn.execute("ROLLBACK")
+                continue
+            try:
+                yield conn, files
+            finally:
+                for f in files:
+                    f.close()
+                conn.execute("ROLLBACK")
+            return
+    raise RuntimeError("Archive segments kept changing while being opened")
+
+
+def _archived_entries(files: list, since=None, until=None):
+    since, until = _timestamp_bound(since), _timestamp_bound(until)
+    for f in files:
+        for line in f:
+            entry = json.loads(line)
+            if until is not None and entry["timestamp"] >= until:
+                break
+            if since is None or entry["timestamp"] >= since:
+                yield entry
+
+
+def iter_archived_history(since=None, until=None):
+    """
+    Stream archived entries (dicts carrying their "id") in (timestamp, id) order.
+
+    since is inclusive and until exclusive; only segments whose time range
+    overlaps them are read.
+    """
+    with _history_snapshot(since, until) as (_, files):
+        yield from _archived_entries(files, since, until)
+
+
+def _segment_lines(path: str):
+    """((timestamp, id), line) for every entry of a segment file, in file order."""
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            entry = json.loads(line)
+            yield (entry["timestamp"], entry["id"]), line.rstrip("\n")
+
+
+def _next_month(month: str) -> str:
+    year, mon = map(int, month.split("-"))
+    return f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+
+
+def _archive_month(conn: sqlite3.Connection, month: str, until: str) -> tuple[int, str | None]:
+    """
+    Move the history rows of month ("YYYY-MM") before until into its segment, in the caller's transaction.
+
+    The segment is written as a new file holding its previous entries merged
+    with the moved rows, so the catalog swap commits together with the row
+    deletion. Returns (rows moved, file name of the replaced segment or None).
+    """
+    directory = _archive_dir()
+    previous = conn.execute("SELECT path FROM archive_segments WHERE month = ?", (month,)).fetchone()
+    where, params = "WHERE timestamp >= ? AND timestamp < ?", (month, until)
+    moved_rows = (
+        ((timestamp, entry_id), _raw_history_entry(entry_id, timestamp, entry))
+        for entry_id, timestamp, entry in conn.execute(
+            f"SELECT id, timestamp, entry FROM history {where} ORDER BY timestamp, id", params
+        )
+    )
+    kept_rows = _segment_lines(os.path.join(directory, previous[0])) if previous else ()
+    name = f"history-{month}.{uuid.uuid4().hex[:8]}.jsonl.gz"
+    entries, first, last = 0, None, None
+    with open(os.path.join(directory, f"{name}.tmp"), "wb") as raw:
+        with gzip.open(raw, "wt") as out:
+            for (timestamp, _), line in heapq.merge(kept_rows, moved_rows, key=lambda item: item[0]):
+                out.write(line + "\n")
+                entries += 1
+                first = first or timestamp
+                last = timestamp
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(os.path.join(directory, f"{name}.tmp"), os.path.join(directory, name))
+
+    deltas = _add_deltas({}, (entry for (entry,) in conn.execute(f"SELECT entry FROM history {where}", params)))
+    moved = conn.execute(f"DELETE FROM history {where}", params).rowcount
+    conn.execute(
+        "INSERT OR REPLACE INTO archive_segments (month, path, entries, first_timestamp, last_timestamp, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (month, name, entries, first, last, time.time()),
+    )
+    conn.executemany(
+        "INSERT INTO archived_aggregates (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        list(deltas.items()),
+    )
+    return moved, previous[0] if previous else None
+
+
+def _remove_segment_files(names) -> None:
+    for name in names:
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(_archive_dir(), name))
+
+
+def _remove_orphan_segments(conn: sqlite3.Connection) -> None:
+    """Delete segment files missing from the catalog, under the write lock so no compaction is writing one."""
+    with _transaction(conn):
+        catalogued = {path for (path,) in conn.execute("SELECT path FROM archive_segments")}
+        pattern = os.path.join(_archive_dir(), "history-*.jsonl.gz*")
+        _remove_segment_files(
+            name for name in map(os.path.basename, glob.glob(pattern)) if name not in catalogued
+        )
+
+
+def compact_history(
+    retention_days: float = HISTORY_RETENTION_DAYS,
+    archive_retention_days: float = ARCHIVE_RETENTION_DAYS,
+    now: datetime | None = None,
+) -> dict:
+    """
+    Archive history older than retention_days, delete expired segments and take a snapshot.
+
+    Rows move one month per transaction, and the write lock is held while that
+    month's segment is written. A crash leaves either the old or the new
+    segment in the catalog, never both; files left behind by a crash are
+    removed by the next run. Returns {"archived", "months", "expired", "snapshot"}.
+    """
+    now = now or datetime.now()
+    conn = _connect()
+    os.makedirs(_archive_dir(), exist_ok=True)
+    _remove_orphan_segments(conn)
+
+    archived, months = 0, []
+    cutoff = _timestamp_bound(now - timedelta(days=retention_days)) if retention_days > 0 else None
+    while cutoff is not None:
+        with _transaction(conn):
+            oldest = conn.execute(
+                "SELECT timestamp FROM history WHERE timestamp < ? ORDER BY timestamp LIMIT 1", (cutoff,)
+            ).fetchone()
+            if oldest is None:
+                break
+            month = oldest[0][:7]
+            moved, replaced = _archive_month(conn, month, min(cutoff, f"{_next_month(month)}-01"))
+        _remove_segment_files([replaced] if replaced else [])
+        archived += moved
+        months.append(month)
+
+    expired = []
+    if archive_retention_days > 0:
+        horizon = _timestamp_bound(now - timedelta(days=archive_retention_days))
+        with _transaction(conn):
+            expired = conn.execute(
+                "SELECT month, path FROM archive_segments WHERE last_timestamp < ? ORDER BY month", (horizon,)
+            ).fetchall()
+            conn.execute("DELETE FROM archive_segments WHERE last_timestamp < ?", (horizon,))
+        _remove_segment_files(path for _, path in expired)
+
+    return {
+        "archived": archived,
+        "months": sorted(set(months)),
+        "expired": [month for month, _ in expired],
+        "snapshot": take_snapshot(),
+    }
+
+
+def take_snapshot() -> dict | None:
+    """
+    Record the inventory and KPI aggregates, unless nothing changed since the last snapshot.
+
+    Each snapshot carries the storage version it was taken at; only the
+    SNAPSHOT_KEEP most recent are kept. Returns the snapshot, or None.
+    """
+    conn = _connect()
+    with _transaction(conn):
+        version = int(conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+        last = conn.execute("SELECT version FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+        if last is not None and last[0] == version:
+            return None
+        # Inserting the snapshot bumps the version once more, on commit
+        snapshot = {
+            "created_at": time.time(),
+            "version": version + 1,
+            "inventory": dict(conn.execute("SELECT item, count FROM inventory ORDER BY rowid").fetchall()),
+            "aggregates": _read_aggregates(conn),
+        }
+        cursor = conn.execute(
+            "INSERT INTO snapshots (created_at, version, inventory, aggregates) VALUES (?, ?, ?, ?)",
+            (snapshot["created_at"], snapshot["version"], json.dumps(snapshot["inventory"]),
+             json.dumps(snapshot["aggregates"])),
+        )
+        conn.execute(
+            "DELETE FROM snapshots WHERE id NOT IN (SELECT id FROM snapshots ORDER BY id DESC LIMIT ?)",
+            (SNAPSHOT_KEEP,),
+        )
+    return {"id": cursor.lastrowid, **snapshot}
+
+
+def list_snapshots(limit: int = 10) -> list[dict]:
+    """The most recent snapshots, newest first."""
+    rows = _connect().execute(
+        "SELECT id, created_at, version, inventory, aggregates FROM snapshots ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [
+        {"id": i, "created_at": created, "version": version,
+         "inventory": json.loads(inventory), "aggregates": json.loads(aggregates)}
+        for i, created, version, inventory, aggregates in rows
+    ]
 
 # Inventory alert thresholds
 ALERT_THRESHOLDS = {
@@ -57,35 +1006,58 @@ ALERT_THRESHOLDS = {
     "shelters": 2000,
 }
 
+@timed("get_stats")
 def get_stats():
-    """Compute aggregate KPIs from history."""
-    data = load_storage()
-    history = data.get("history", [])
-    inventory = data.get("inventory", {})
-
-    total_analyses = len(history)
-    total_cost = sum(h.get("optimization", {}).get("total_cost", 0) for h in history)
-    total_food = sum(h.get("optimization", {}).get("resource_plan", {}).get("food_kits", 0) for h in history)
-    total_medical = sum(h.get("optimization", {}).get("resource_plan", {}).get("medical_units", 0) for h in history)
-    total_shelters = sum(h.get("optimization", {}).get("resource_plan", {}).get("shelters", 0) for h in history)
-
-    severity_counts = {"Low": 0, "Medium": 0, "High": 0}
-    for h in history:
-        sev = h.get("prediction", {}).get("severity", "")
-        if sev in severity_counts:
-            severity_counts[sev] += 1
+    """Return aggregate KPIs, read from the running aggregates in O(1)."""
+    aggregates = _read_aggregates(_connect())
+    inventory = get_inventory()
 
     return {
-        "total_analyses": total_analyses,
-        "total_cost": total_cost,
-        "total_resources_deployed": total_food + total_medical + total_shelters,
-        "severity_distribution": severity_counts,
+        "total_analyses": aggregates["total_analyses"],
+        "total_cost": aggregates["total_cost"],
+        "total_resources_deployed": sum(aggregates[f"deployed:{item}"] for item in RESOURCE_ITEMS),
+        "severity_distribution": {level: aggregates[f"severity:{level}"] for level in SEVERITY_LEVELS},
         "current_inventory": inventory,
     }
 
+
+def verify_stats() -> dict:
+    """
+    Recompute the aggregates from raw history and compare with the stored ones.
+
+    Returns {name: (stored, recomputed)} for every mismatch; empty when consistent.
+    """
+    conn = _connect()
+    # A read transaction gives both reads the same snapshot
+    conn.execute("BEGIN")
+    try:
+        stored = _read_aggregates(conn)
+        recomputed = _compute_aggregates(conn)
+    finally:
+        conn.execute("COMMIT")
+    return {
+        name: (stored.get(name), value)
+        for name, value in recomputed.items()
+        if stored.get(name) != value
+    }
+
+
+def rebuild_stats() -> dict:
+    """Recompute the aggregates from raw history and store them. Returns the new aggregates."""
+    conn = _connect()
+    with _transaction(conn):
+        aggregates = _compute_aggregates(conn)
+        _write_aggregates(conn, aggregates)
+    return aggregates
+
+@timed("get_alerts")
 def get_alerts():
     """Check inventory thresholds and return active alerts."""
-    inventory = get_inventory()
+    return alerts_for(get_inventory())
+
+
+def alerts_for(inventory: dict) -> list[dict]:
+    """Alerts for the given inventory levels against ALERT_THRESHOLDS."""
     alerts = []
     for item, threshold in ALERT_THRESHOLDS.items():
         current = inventory.get(item, 0)
@@ -94,3 +1066,59 @@ def get_alerts():
         elif current < threshold:
             alerts.append({"type": "warning", "resource": item, "current": current, "threshold": threshold, "message": f"{item.replace('_', ' ').title()} below {threshold:,} — currently {current:,}"})
     return alerts
+
+
+def main() -> None:
+    """Storage maintenance commands."""
+    parser = argparse.ArgumentParser(description="Disaster storage maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Import a legacy storage.json into the database")
+    migrate.add_argument("--json", default=STORAGE_PATH, help="Path to the legacy JSON file")
+    migrate.add_argument("--force", action="store_true", help="Overwrite existing database contents")
+    rebuild = sub.add_parser("rebuild-stats", help="Verify KPI aggregates against history and rebuild them")
+    rebuild.add_argument("--verify-only", action="store_true", help="Report mismatches without rewriting")
+    compact = sub.add_parser("compact", help="Archive old history into monthly segments and take a snapshot")
+    compact.add_argument("--retention-days", type=float, default=HISTORY_RETENTION_DAYS,
+                         help="Keep this many days of history in the database (0 keeps all)")
+    compact.add_argument("--archive-retention-days", type=float, default=ARCHIVE_RETENTION_DAYS,
+                         help="Delete archive segments older than this many days (0 keeps all)")
+    compact.add_argument("--vacuum", action="store_true", help="VACUUM the database afterwards to return freed space")
+    sub.add_parser("snapshot", help="Record the inventory and KPI aggregates now")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        count = migrate_from_json(args.json, overwrite=args.force)
+        print(f"Migrated {count} history entries -> {DB_PATH}")
+    elif args.command == "rebuild-stats":
+        mismatches = verify_stats()
+        for name, (stored, recomputed) in mismatches.items():
+            print(f"  {name}: stored={stored} recomputed={recomputed}")
+        if not mismatches:
+            print("Aggregates are consistent with history.")
+        elif args.verify_only:
+            raise SystemExit(1)
+        else:
+            rebuild_stats()
+            print(f"Rebuilt {len(mismatches)} aggregate(s).")
+    elif args.command == "compact":
+        result = compact_history(args.retention_days, args.archive_retention_days)
+        print(f"Archived {result['archived']} history entries into {', '.join(result['months']) or 'no segments'}"
+              f" -> {_archive_dir()}")
+        if result["expired"]:
+            print(f"Deleted expired segments: {', '.join(result['expired'])}")
+        if args.vacuum:
+            conn = _connect()
+            conn.execute("VACUUM")
+            # In WAL mode the file only shrinks once the vacuumed pages are checkpointed
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print(f"Vacuumed {DB_PATH} ({os.path.getsize(DB_PATH):,} bytes)")
+        if result["snapshot"]:
+            print(f"Snapshot {result['snapshot']['id']} at storage version {result['snapshot']['version']}")
+    elif args.command == "snapshot":
+        snapshot = take_snapshot()
+        print(f"Snapshot {snapshot['id']} at storage version {snapshot['version']}" if snapshot
+              else "Nothing changed since the last snapshot.")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,28 @@ from data_pipeline import (
     classify_severity,
     assign_severity_labels,
 )
-from optimizer import optimize_resources
+import optimizer
+from optimizer import allocate_incidents, optimize_cached, optimize_resources, solve_min_cost
+import result_cache
+from result_cache import ResultCache
+import storage
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(tmp_path, monkeypatch):
+    """Point the storage layer at a fresh database for every test."""
+    monkeypatch.setattr(storage, "DB_PATH", str(tmp_path / "storage.db"))
+    monkeypatch.setattr(storage, "STORAGE_PATH", str(tmp_path / "storage.json"))
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def trained_model():
+    """A small forest trained on the bundled dataset."""
+    from data_pipeline import run_pipeline
+    from train import train_model
+    X_train, _, y_train, _ = run_pipeline(os.path.join(os.path.dirname(__file__), "disaster_data.csv"))
+    return train_model(X_train, y_train, n_estimators=20)
 
 
 # --- data_pipeline tests ---
@@ -49,6 +70,74 @@ class TestDataPipeline:
         result = assign_severity_labels(df)
         assert list(result["severity_level"]) == ["Low", "Medium", "High"]
 
+    def test_vectorized_labels_match_classify_severity(self):
+        scores = np.array([-1.0, 4.999, 5.0, 9.999, 10.0, 40.0, np.nan])
+        result = assign_severity_labels(pd.DataFrame({"severity_score": scores}))
+        assert list(result["severity_level"]) == [classify_severity(s) for s in scores]
+
+    def test_columnar_dataset_matches_dataframe_pipeline(self, tmp_path):
+        from data_pipeline import iter_columnar, load_columnar, load_data, prepare_features, write_columnar
+        csv_path = os.path.join(os.path.dirname(__file__), "disaster_data.csv")
+        meta = write_columnar(csv_path, str(tmp_path / "dataset"), chunk_rows=300)
+        assert [p["rows"] for p in meta["parts"]] == [300, 300, 300, 100]
+
+        df = assign_severity_labels(compute_severity_score(handle_missing_values(load_data(csv_path))))
+        X_expected, y_expected = prepare_features(df)
+        X, y = load_columnar(str(tmp_path / "dataset"))
+        assert list(X.columns) == list(X_expected.columns)
+        assert X.dtypes.unique().tolist() == [np.float32]
+        np.testing.assert_array_equal(X.to_numpy(), X_expected.to_numpy(np.float32))
+        assert y.tolist() == y_expected.tolist()
+
+        chunks = list(iter_columnar(str(tmp_path / "dataset")))
+        np.testing.assert_array_equal(np.concatenate([Xc for Xc, _ in chunks]), X.to_numpy())
+        assert np.concatenate([yc for _, yc in chunks]).tolist() == y.tolist()
+
+    def test_columnar_labels_use_full_precision_scores(self, tmp_path):
+        from data_pipeline import load_columnar, write_columnar
+        # Scores exactly 10.0 in float64 but just under it once damage_usd is rounded to float32
+        csv_path = tmp_path / "edge.csv"
+        csv_path.write_text("disaster_type,deaths,affected,damage_usd\nFlood,0,0,5.184705528587072e+21\n")
+        df = assign_severity_labels(compute_severity_score(pd.read_csv(csv_path)))
+        write_columnar(str(csv_path), str(tmp_path / "dataset"))
+        assert load_columnar(str(tmp_path / "dataset"))[1].tolist() == df["severity_level"].tolist() == ["High"]
+
+
+class TestGenerateDataset:
+    def test_vectorized_generator_is_deterministic(self):
+        import generate_dataset as gen
+        df = gen.generate_dataset(20_000, random_state=7)
+        assert list(df.columns) == list(gen.COLUMNS)
+        pd.testing.assert_frame_equal(df, gen.generate_dataset(20_000, random_state=7))
+        assert not df.equals(gen.generate_dataset(20_000, random_state=8))
+        assert df[["deaths", "affected", "damage_usd"]].isna().mean().between(0.04, 0.06).all()
+        means = df.groupby("disaster_type", observed=True)["affected"].mean()
+        assert means["Drought"] > means["Earthquake"] > means["Wildfire"]
+
+    def test_sharded_csv_is_independent_of_process_count(self, tmp_path, monkeypatch):
+        import generate_dataset as gen
+        monkeypatch.setattr(gen, "BLOCK_ROWS", 250)
+        one, three = str(tmp_path / "one.csv"), str(tmp_path / "three.csv")
+        gen.write_dataset(one, 1_100, seed=3, processes=1)
+        gen.write_dataset(three, 1_100, seed=3, processes=3)
+        with open(one) as a, open(three) as b:
+            assert a.read() == b.read()
+        written = pd.read_csv(one)
+        expected = gen.generate_dataset(1_100, random_state=3)
+        assert written["disaster_type"].tolist() == expected["disaster_type"].tolist()
+        np.testing.assert_allclose(written["damage_usd"], expected["damage_usd"])
+        assert sorted(os.listdir(tmp_path)) == ["one.csv", "three.csv"]
+
+    def test_populate_history_feeds_storage_aggregates(self):
+        import generate_dataset as gen
+        assert gen.populate_history(2_500, seed=1) == 2_500
+        stats = storage.get_stats()
+        assert stats["total_analyses"] == 2_500
+        history = list(storage.iter_history(limit=2))
+        assert [h for chunk in history for h in chunk][1]["timestamp"] == "2025-01-01T00:01:00"
+        assert sum(stats["severity_distribution"].values()) == 2_500
+        assert storage.verify_stats() == {}
+
 
 # --- optimizer tests ---
 
@@ -84,6 +173,543 @@ class TestOptimizer:
         assert plan["medical_units"] >= 20
         assert plan["shelters"] >= 100
 
+    def test_optimize_uses_closed_form(self):
+        result = optimize_resources("Medium", 1_000_000)
+        assert result["solver"] == "closed_form"
+        assert result["total_cost"] == 454000
+
+    def test_closed_form_matches_pulp(self):
+        for severity, budget in [("Low", 1_000_000), ("Medium", 454000), ("High", 10_000_000), ("High", 100)]:
+            fast = optimize_resources(severity, budget)
+            slow = optimize_resources(severity, budget, solver="pulp")
+            assert slow["solver"] == "pulp"
+            assert fast.get("resource_plan") == slow.get("resource_plan")
+            assert fast.get("total_cost") == slow.get("total_cost")
+            assert ("error" in fast) == ("error" in slow)
+
+    def test_coupled_constraints_fall_back_to_pulp(self):
+        # A covering constraint violated at the lower bounds needs a real solve
+        result = solve_min_cost({"a": 1, "b": 3}, {"a": 0, "b": 0}, [({"a": 1, "b": 1}, ">=", 10)])
+        assert result["solver"] == "pulp"
+        assert result["values"] == {"a": 10, "b": 0}
+
+    def test_cache_buckets_budget_and_tracks_tables(self, monkeypatch):
+        import asyncio
+        monkeypatch.setattr(optimizer, "optimize_cache", ResultCache(16, 60))
+
+        def cached(severity, budget):
+            return asyncio.run(optimize_cached(severity, budget))
+
+        first = cached("Medium", 454000.4)
+        assert first.pop("cached") is False
+        first["resource_plan"]["food_kits"] = -1
+        assert cached("Medium", 454000.9) == {**optimize_resources("Medium", 454000), "cached": True}
+        assert cached("Medium", 453999.9)["error"]
+        assert optimizer.optimize_cache.stats()["hits"] == 1
+
+        monkeypatch.setitem(optimizer.COSTS, "food_kits", 11)
+        assert cached("Medium", 1_000_000)["total_cost"] == 457000
+        assert optimizer.optimize_cache.stats()["misses"] == 3
+
+    def test_cache_evicts_lru_and_expires(self, monkeypatch):
+        cache = ResultCache(2, 60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert cache.get("b") is None and cache.get("a") == 1
+        clock = iter([0.0, 100.0])
+        monkeypatch.setattr(result_cache.time, "monotonic", lambda: next(clock))
+        cache.put("d", 4)
+        assert cache.get("d") is None
+
+
+class TestJointAllocation:
+    WAREHOUSES = [
+        {"id": "north_depot", "stock": {"food_kits": 10000, "medical_units": 300, "shelters": 3000},
+         "transport_costs": {"north": 1, "south": 5}},
+        {"id": "south_depot", "stock": {"food_kits": 10000, "medical_units": 300, "shelters": 3000},
+         "transport_costs": {"south": 1}},
+    ]
+
+    def test_respects_stock_and_reachability(self):
+        incidents = [
+            {"id": "quake", "region": "north", "severity": "High"},
+            {"id": "flood", "region": "south", "severity": "Medium"},
+        ]
+        result = allocate_incidents(incidents, self.WAREHOUSES)
+        assert result["proven_optimal"]
+        shipped = {}
+        for a in result["allocations"]:
+            shipped[(a["warehouse"], a["item"])] = shipped.get((a["warehouse"], a["item"]), 0) + a["quantity"]
+            if a["incident"] == "quake":
+                assert a["warehouse"] == "north_depot"
+        for w in self.WAREHOUSES:
+            for item, stock in w["stock"].items():
+                assert shipped.get((w["id"], item), 0) <= stock
+        # The flood is fully served from the cheaper south depot; the quake gets what north has left
+        assert result["incidents"]["flood"]["shortfall"] == {"food_kits": 0, "medical_units": 0, "shelters": 0}
+        assert result["incidents"]["quake"]["fulfilled"] == {"food_kits": 10000, "medical_units": 300, "shelters": 3000}
+
+    def test_priority_decides_contested_stock(self):
+        warehouses = [{"id": "w", "stock": {"food_kits": 500}, "transport_costs": {"a": 1, "b": 1}}]
+        incidents = [
+            {"id": "minor", "region": "a", "demand": {"food_kits": 500}},
+            {"id": "major", "region": "b", "demand": {"food_kits": 500}, "priority": 5},
+        ]
+        result = allocate_incidents(incidents, warehouses)
+        assert result["incidents"]["major"]["fulfilled"]["food_kits"] == 500
+        assert result["incidents"]["minor"]["shortfall"]["food_kits"] == 500
+
+    def test_warm_start_reuses_previous_solution(self):
+        incidents = [{"id": "flood", "region": "south", "severity": "Low"}]
+        first = allocate_incidents(incidents, self.WAREHOUSES)
+        second = allocate_incidents(incidents, self.WAREHOUSES)
+        assert second["warm_started_variables"] > 0
+        assert second["total_cost"] == first["total_cost"]
+
+    def test_rejects_unknown_and_negative_quantities(self):
+        incidents = [{"id": "flood", "region": "south", "demand": {"blankets": 5}}]
+        assert "blankets" in allocate_incidents(incidents, self.WAREHOUSES)["error"]
+        incidents = [{"id": "flood", "region": "south", "demand": {"food_kits": -5}}]
+        assert "Negative demand" in allocate_incidents(incidents, self.WAREHOUSES)["error"]
+        warehouses = [{"id": "w", "stock": {"food_kits": 5}, "transport_costs": {"south": -1}}]
+        assert "transport" in allocate_incidents([{"id": "f", "region": "south", "severity": "Low"}], warehouses)["error"]
+
+
+# --- encoder tests ---
+
+class TestFeatureEncoder:
+    FEATURES = ["deaths", "affected", "damage_usd", "disaster_type_Flood", "disaster_type_Storm"]
+
+    def test_encode_one(self):
+        from types import SimpleNamespace
+        from encoder import FeatureEncoder
+        enc = FeatureEncoder(self.FEATURES, [0.5, 0.3, 0.195, 0.005, 0.0])
+        row = enc.encode_one(SimpleNamespace(disaster_type="Storm", deaths=1, affected=2, damage_usd=3))
+        assert row.tolist() == [[1.0, 2.0, 3.0, 0.0, 1.0]]
+        # Baseline (dropped) category encodes as all-zero dummies
+        row = enc.encode_one(SimpleNamespace(disaster_type="Drought", deaths=4, affected=5, damage_usd=6))
+        assert row.tolist() == [[4.0, 5.0, 6.0, 0.0, 0.0]]
+        assert enc.importance == {"deaths": 0.5, "affected": 0.3, "damage_usd": 0.195}
+
+    def test_encode_batch(self):
+        from types import SimpleNamespace
+        from encoder import FeatureEncoder
+        enc = FeatureEncoder(self.FEATURES)
+        records = [
+            SimpleNamespace(disaster_type="Flood", deaths=1, affected=2, damage_usd=3),
+            SimpleNamespace(disaster_type="Storm", deaths=4, affected=5, damage_usd=6),
+        ]
+        assert enc.encode_batch(records).tolist() == [[1, 2, 3, 1, 0], [4, 5, 6, 0, 1]]
+
+
+# --- training tests ---
+
+class TestTraining:
+    @pytest.fixture(scope="class")
+    def split(self):
+        from data_pipeline import run_pipeline
+        return run_pipeline(os.path.join(os.path.dirname(__file__), "disaster_data.csv"))
+
+    def test_parallel_fit_matches_serial_and_serves_single_threaded(self, split):
+        from train import train_model
+        X_train, X_test, y_train, _ = split
+        serial = train_model(X_train, y_train, n_estimators=8)
+        parallel = train_model(X_train, y_train, n_estimators=8, n_jobs=2)
+        assert parallel.n_jobs is None
+        np.testing.assert_array_equal(serial.predict_proba(X_test), parallel.predict_proba(X_test))
+
+    def test_grow_model_adds_trees_on_new_data(self, split):
+        from forest import FlatForest
+        from train import grow_model, train_model
+        X_train, X_test, y_train, _ = split
+        model = train_model(X_train[:400], y_train[:400], n_estimators=5)
+        first_trees = list(model.estimators_)
+        grow_model(model, X_train[400:], y_train[400:], 3)
+        assert len(model.estimators_) == 8
+        assert model.estimators_[:5] == first_trees
+        assert not model.warm_start
+        np.testing.assert_array_equal(FlatForest.from_sklearn(model).predict_proba(X_test), model.predict_proba(X_test))
+
+        only_low = y_train[y_train == "Low"]
+        with pytest.raises(ValueError, match="missing classes"):
+            grow_model(model, X_train.loc[only_low.index], only_low, 2)
+        relabelled = y_train[400:].replace("Low", "Negligible")
+        with pytest.raises(ValueError, match="adds \\['Negligible'\\]"):
+            grow_model(model, X_train[400:], relabelled, 2)
+        assert len(model.estimators_) == 8
+
+    def test_incremental_training_from_columnar_parts(self, tmp_path):
+        from data_pipeline import write_columnar
+        from train import train_incremental
+        write_columnar(os.path.join(os.path.dirname(__file__), "disaster_data.csv"), str(tmp_path / "ds"), chunk_rows=250)
+        model, report = train_incremental(str(tmp_path / "ds"), trees_per_part=2)
+        assert len(model.estimators_) == 8
+        assert list(model.classes_) == ["High", "Low", "Medium"]
+        assert report == {"parts": 4, "skipped_parts": []}
+
+        # Sorted by deaths, the first two parts hold no High incidents
+        import pandas as pd
+        csv = tmp_path / "sorted.csv"
+        pd.read_csv(os.path.join(os.path.dirname(__file__), "disaster_data.csv")).sort_values("deaths").to_csv(csv, index=False)
+        write_columnar(str(csv), str(tmp_path / "sorted"), chunk_rows=250)
+        model, report = train_incremental(str(tmp_path / "sorted"), trees_per_part=2)
+        assert report == {"parts": 4, "skipped_parts": [0, 1]}
+        assert len(model.estimators_) == 4
+
+    def test_sweep_ranks_configurations(self, split):
+        from train import sweep, train_model, training_report
+        X_train, X_test, y_train, y_test = split
+        results = sweep(X_train, y_train, X_test, y_test, grid={"n_estimators": [3, 6], "max_depth": [2, None]}, processes=2)
+        assert len(results) == 4
+        assert results[0]["accuracy"] == max(r["accuracy"] for r in results)
+        assert results[0]["accuracy"] > results[-1]["accuracy"]
+
+        report = training_report(train_model(X_train, y_train, n_estimators=4), len(X_train), 0.5)
+        assert report["trees"] == 4 and report["rows_per_s"] == len(X_train) * 2
+
+
+# --- flat forest tests ---
+
+class TestFlatForest:
+    def test_probabilities_bit_identical(self, trained_model):
+        from data_pipeline import run_pipeline
+        from forest import FlatForest
+        _, X_test, _, _ = run_pipeline(os.path.join(os.path.dirname(__file__), "disaster_data.csv"))
+        flat = FlatForest.from_sklearn(trained_model)
+        expected = trained_model.predict_proba(X_test)
+        actual = flat.predict_proba(X_test.to_numpy(dtype=np.float64))
+        assert np.array_equal(actual, expected)
+        assert list(flat.predict(X_test.to_numpy(dtype=np.float64))) == list(trained_model.predict(X_test))
+
+    def test_leaf_counts_are_normalized(self, trained_model):
+        import copy
+        from data_pipeline import run_pipeline
+        from forest import FlatForest
+        _, X_test, _, _ = run_pipeline(os.path.join(os.path.dirname(__file__), "disaster_data.csv"))
+        # scikit-learn < 1.4 stores weighted class counts rather than fractions in tree_.value
+        model = copy.deepcopy(trained_model)
+        for estimator in model.estimators_:
+            estimator.tree_.value[:] *= estimator.tree_.weighted_n_node_samples[:, None, None]
+        flat = FlatForest.from_sklearn(model)
+        np.testing.assert_allclose(flat.value.sum(axis=1), 1.0)
+        np.testing.assert_allclose(flat.predict_proba(X_test.to_numpy(dtype=np.float64)), trained_model.predict_proba(X_test))
+
+    def test_export_and_load(self, trained_model, tmp_path):
+        from forest import FlatForest, export_forest
+        path = str(tmp_path / "model_bundle")
+        flat = export_forest(trained_model, path)
+        loaded = FlatForest.load(path)
+        assert isinstance(loaded.value.base, np.memmap)
+        X = np.array([[100.0, 5e4, 1e6, 0, 1, 0, 0], [0.0, 0.0, 0.0, 0, 0, 0, 0]])[:, :len(flat.feature_names_in_)]
+        assert np.array_equal(loaded.predict_proba(X), flat.predict_proba(X))
+        assert list(loaded.classes_) == list(trained_model.classes_)
+        assert list(loaded.feature_names_in_) == list(trained_model.feature_names_in_)
+
+    def test_save_model_writes_bundle(self, trained_model, tmp_path):
+        from forest import FlatForest
+        from train import save_model
+        save_model(trained_model, str(tmp_path / "model.pkl"))
+        save_model(trained_model, str(tmp_path / "model.pkl"))  # overwrite swaps the bundle in place
+        assert sorted(os.listdir(tmp_path)) == ["model.pkl", "model_bundle"]
+        assert FlatForest.load(str(tmp_path / "model_bundle")).n_estimators == 20
+
+    def test_contributions_sum_to_probabilities(self, trained_model):
+        from sklearn.tree import DecisionTreeClassifier
+        from data_pipeline import run_pipeline
+        from forest import FlatForest
+        _, X_test, _, _ = run_pipeline(os.path.join(os.path.dirname(__file__), "disaster_data.csv"))
+        X = X_test.to_numpy(dtype=np.float64)
+        flat = FlatForest.from_sklearn(trained_model)
+        bias, contributions = flat.contributions(X)
+        assert contributions.shape == (len(X), X.shape[1], len(flat.classes_))
+        np.testing.assert_allclose(bias + contributions.sum(axis=1), flat.predict_proba(X), atol=1e-12)
+
+        # A single split on feature 1: everything is credited to it, relative to the root
+        stump = DecisionTreeClassifier(max_depth=1).fit([[0, 0], [0, 1], [0, 1], [0, 1]], ["a", "b", "b", "b"])
+        stump.estimators_, stump.feature_names_in_ = [stump], np.array(["x0", "x1"])
+        bias, contributions = FlatForest.from_sklearn(stump).contributions(np.array([[5.0, 0.0], [5.0, 1.0]]))
+        np.testing.assert_allclose(bias, [0.25, 0.75])
+        np.testing.assert_allclose(contributions[:, 0], 0.0)
+        np.testing.assert_allclose(contributions[:, 1], [[0.75, -0.75], [-0.25, 0.25]])
+
+
+# --- batcher tests ---
+
+class TestPredictBatcher:
+    @staticmethod
+    def _gather(batcher, rows):
+        import asyncio
+
+        async def main():
+            return await asyncio.gather(*(batcher.predict_proba(row) for row in rows))
+        return asyncio.run(main())
+
+    def test_coalesces_within_window_and_fans_out(self):
+        from batcher import PredictBatcher
+        seen = []
+
+        async def run(X, group):
+            seen.append(X.shape[0])
+            return X * 2
+
+        batcher = PredictBatcher(run, window_ms=20, max_batch=4)
+        rows = [np.full((1, 3), i, dtype=np.float64) for i in range(10)]
+        results = self._gather(batcher, rows)
+        assert seen == [4, 4, 2]
+        for i, result in enumerate(results):
+            assert result.tolist() == [2.0 * i] * 3
+        stats = batcher.stats()
+        assert stats["mean_batch_size"] == pytest.approx(10 / 3)
+        assert stats["batch_sizes"] == {"le_1": 0, "le_2": 1, "le_4": 2}
+
+    def test_errors_reach_every_waiter(self):
+        from batcher import PredictBatcher
+
+        async def run(X, group):
+            raise RuntimeError("boom")
+
+        batcher = PredictBatcher(run, window_ms=5, max_batch=8)
+        with pytest.raises(RuntimeError, match="boom"):
+            self._gather(batcher, [np.zeros((1, 2))] * 3)
+        assert batcher.stats()["requests"] == 3
+
+
+# --- storage tests ---
+
+def _reserve_and_commit_worker(db_path: str, attempts: int) -> int:
+    """Run in a separate process: reserve+commit one unit per attempt, counting successes."""
+    storage.DB_PATH = db_path
+    succeeded = 0
+    for _ in range(attempts):
+        try:
+            reservation_id = storage.reserve_inventory({"medical_units": 1})
+        except storage.InsufficientInventoryError:
+            continue
+        storage.commit_reservation(reservation_id, {"severity": "Low"}, {"resource_plan": {"medical_units": 1}})
+        succeeded += 1
+    return succeeded
+
+
+class TestStorage:
+    def test_seeds_default_inventory(self):
+        assert storage.get_inventory() == storage.DEFAULT_STATE["inventory"]
+        assert storage.get_history() == []
+
+    def test_update_inventory_and_history(self):
+        plan = {"food_kits": 500, "medical_units": 20, "shelters": 100}
+        storage.update_inventory(plan)
+        storage.add_history({"severity": "Low"}, {"resource_plan": plan, "total_cost": 59000})
+        assert storage.get_inventory()["food_kits"] == 49500
+        history = storage.get_history()
+        assert len(history) == 1
+        assert history[0]["prediction"] == {"severity": "Low"}
+        assert history[0]["optimization"]["total_cost"] == 59000
+
+    def test_inventory_cache_sees_other_connections(self):
+        import threading
+        storage.get_inventory()
+        worker = threading.Thread(target=storage.update_inventory, args=({"shelters": 10},))
+        worker.start()
+        worker.join()
+        assert storage.get_inventory()["shelters"] == 9990
+
+    def test_update_inventory_rejects_overdraw(self):
+        with pytest.raises(storage.InsufficientInventoryError) as exc:
+            storage.update_inventory({"food_kits": 100, "medical_units": 2001})
+        assert exc.value.shortages == {"medical_units": {"requested": 2001, "available": 2000}}
+        # Nothing is deducted when any item is short
+        assert storage.get_inventory() == storage.DEFAULT_STATE["inventory"]
+
+    def test_version_bumps_only_on_changes(self):
+        import threading
+        start = storage.get_version()
+        storage.get_stats()
+        storage.load_storage()
+        with pytest.raises(storage.InsufficientInventoryError):
+            storage.update_inventory({"food_kits": 10**9})
+        with pytest.raises(KeyError):
+            storage.release_reservation(12345)
+        assert storage.get_version() == start
+        storage.update_inventory({"food_kits": 1})
+        # Writes from another connection advance the same counter
+        worker = threading.Thread(target=storage.add_history, args=({"severity": "Low"}, {}))
+        worker.start()
+        worker.join()
+        version = storage.get_version()
+        assert version["version"] == start["version"] + 2
+        assert version["database_id"] == start["database_id"]
+        assert version["updated_at"] >= start["updated_at"]
+
+    def test_reserve_commit_release(self):
+        first = storage.reserve_inventory({"food_kits": 30000})
+        assert storage.get_inventory()["food_kits"] == 20000
+        with pytest.raises(storage.InsufficientInventoryError):
+            storage.reserve_inventory({"food_kits": 30000})
+        storage.release_reservation(first)
+        assert storage.get_inventory()["food_kits"] == 50000
+        with pytest.raises(KeyError):
+            storage.commit_reservation(first)
+
+        second = storage.reserve_inventory({"shelters": 100})
+        storage.commit_reservation(second, {"severity": "Low"}, {"resource_plan": {"shelters": 100}, "total_cost": 50000})
+        assert storage.get_inventory()["shelters"] == 9900
+        assert storage.get_stats()["total_analyses"] == 1
+
+    def test_stale_reservations_expire(self, monkeypatch):
+        storage.reserve_inventory({"medical_units": 2000})
+        monkeypatch.setattr(storage, "RESERVATION_TTL_S", -1)
+        storage.reserve_inventory({"medical_units": 500})
+        assert storage.get_inventory()["medical_units"] == 1500
+
+    def test_reservations_are_exact_across_processes(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        storage.save_storage({"inventory": {"food_kits": 0, "medical_units": 150, "shelters": 0}, "history": []})
+        with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("fork")) as pool:
+            successes = sum(pool.map(_reserve_and_commit_worker, [storage.DB_PATH] * 4, [50] * 4))
+        assert successes == 150
+        assert storage.get_inventory()["medical_units"] == 0
+        assert storage.get_stats()["total_analyses"] == 150
+        assert storage.verify_stats() == {}
+
+    def test_stats_aggregates(self):
+        storage.add_history({"severity": "Low"}, {"resource_plan": {"food_kits": 500, "medical_units": 20, "shelters": 100}, "total_cost": 59000})
+        storage.add_history({"severity": "High"}, {"resource_plan": {"food_kits": 15000, "medical_units": 500, "shelters": 5000}, "total_cost": 2750000})
+        storage.add_history({"severity": "Unknown"}, {})
+        stats = storage.get_stats()
+        assert stats["total_analyses"] == 3
+        assert stats["total_cost"] == 2809000
+        assert stats["total_resources_deployed"] == 21120
+        assert stats["severity_distribution"] == {"Low": 1, "Medium": 0, "High": 1}
+        assert stats["current_inventory"] == storage.DEFAULT_STATE["inventory"]
+        assert storage.verify_stats() == {}
+
+    def test_rebuild_stats_repairs_drift(self):
+        storage.add_history({"severity": "Medium"}, {"resource_plan": {"food_kits": 3000}, "total_cost": 454000})
+        storage._connect().execute("UPDATE aggregates SET value = 99 WHERE name = 'total_cost'")
+        assert storage.verify_stats() == {"total_cost": (99, 454000)}
+        storage.rebuild_stats()
+        assert storage.verify_stats() == {}
+        assert storage.get_stats()["total_cost"] == 454000
+
+    def test_compaction_archives_old_history_by_month(self, isolated_storage):
+        from datetime import datetime
+
+        def entry(timestamp, severity, cost):
+            return {"timestamp": timestamp, "prediction": {"severity": severity},
+                    "optimization": {"resource_plan": {"food_kits": cost}, "total_cost": cost}}
+
+        storage.append_history_entries([
+            entry("2026-01-05T10:00:00", "Low", 1), entry("2026-01-20T10:00:00", "High", 2),
+            entry("2026-02-03T10:00:00", "Medium", 3), entry("2026-04-01T10:00:00", "Low", 4),
+        ])
+        stats = storage.get_stats()
+        now = datetime(2026, 4, 10)
+        result = storage.compact_history(retention_days=30, now=now)
+        assert (result["archived"], result["months"]) == (3, ["2026-01", "2026-02"])
+        assert [h["timestamp"] for h in storage.get_history()] == ["2026-04-01T10:00:00"]
+        assert [s["entries"] for s in storage.list_archive_segments()] == [2, 1]
+        assert storage.get_stats() == stats
+        assert storage.verify_stats() == {}
+        assert result["snapshot"]["aggregates"]["total_analyses"] == 4
+
+        # A late entry for an archived month is merged into that month's one segment
+        storage.append_history_entries([entry("2026-01-10T10:00:00", "Medium", 5)])
+        storage.compact_history(retention_days=30, now=now)
+        segments = storage.list_archive_segments()
+        assert [s["entries"] for s in segments] == [3, 1]
+        assert sorted(os.listdir(isolated_storage / "archive")) == sorted(s["path"] for s in segments)
+        rows = [row for chunk in storage.iter_history_export_rows(chunk_size=2, archived=True) for row in chunk]
+        assert [row[2] for row in rows] == [1, 5, 2, 3, 4]
+        assert [e["optimization"]["total_cost"] for e in storage.iter_archived_history(since="2026-01-15")] == [2, 3]
+
+        # Expired segments are deleted, but the KPIs keep counting their entries
+        assert storage.compact_history(30, archive_retention_days=75, now=now)["expired"] == ["2026-01"]
+        assert storage.get_stats()["total_analyses"] == 5
+        assert storage.verify_stats() == {}
+        assert storage.take_snapshot() is None
+
+    def test_replacing_state_drops_the_archive(self, isolated_storage):
+        from datetime import datetime
+        old = {"timestamp": "2026-01-05T10:00:00", "prediction": {"severity": "High"},
+               "optimization": {"resource_plan": {"food_kits": 7}, "total_cost": 70}}
+        storage.append_history_entries([old])
+        assert storage.compact_history(retention_days=30, now=datetime(2026, 4, 10))["archived"] == 1
+        replacement = {"timestamp": "2026-04-01T10:00:00", "prediction": {"severity": "Low"},
+                       "optimization": {"resource_plan": {"food_kits": 1}, "total_cost": 10}}
+        storage.save_storage({"inventory": storage.DEFAULT_STATE["inventory"], "history": [replacement]})
+        stats = storage.get_stats()
+        assert (stats["total_analyses"], stats["total_cost"]) == (1, 10)
+        assert stats["severity_distribution"] == {"Low": 1, "Medium": 0, "High": 0}
+        assert storage.verify_stats() == {}
+        assert storage.list_archive_segments() == []
+        assert os.listdir(isolated_storage / "archive") == []
+        rows = [row for chunk in storage.iter_history_export_rows(archived=True) for row in chunk]
+        assert [row[0] for row in rows] == ["2026-04-01T10:00:00"]
+
+    def test_iter_history_chunks_and_indexes(self):
+        for severity in ["Low", "High"] * 5:
+            storage.add_history({"severity": severity}, {})
+        chunks = list(storage.iter_history(severity="High", chunk_size=2))
+        assert [len(c) for c in chunks] == [2, 2, 1]
+        assert all(e["prediction"]["severity"] == "High" for c in chunks for e in c)
+        where, params = storage._history_filter(("2026", 0), "2026", None, "High")
+        plan = storage._connect().execute(
+            f"EXPLAIN QUERY PLAN SELECT id, timestamp, entry FROM history {where} ORDER BY timestamp, id", params
+        ).fetchall()
+        assert "USING INDEX idx_history_severity" in plan[0][-1]
+
+    def test_migrate_from_json(self, tmp_path):
+        import json
+        legacy = {
+            "inventory": {"food_kits": 10, "medical_units": 5, "shelters": 1},
+            "history": [{"timestamp": "2026-01-01T00:00:00", "prediction": {"severity": "High"},
+                         "optimization": {"resource_plan": {}, "total_cost": 1}}],
+        }
+        path = tmp_path / "legacy.json"
+        path.write_text(json.dumps(legacy))
+        assert storage.migrate_from_json(str(path)) == 1
+        assert storage.load_storage() == legacy
+        assert storage.get_stats()["severity_distribution"]["High"] == 1
+        with pytest.raises(RuntimeError):
+            storage.migrate_from_json(str(path))
+
+
+# --- benchmark tests ---
+
+class TestBenchmark:
+    def test_compare_results_flags_only_real_slowdowns(self):
+        from benchmark import compare_results
+        baseline = {"api": {"fast": {"p50_ms": 0.01}, "slow": {"p50_ms": 10.0}, "same": {"p50_ms": 5.0}}}
+        current = {
+            "api": {"fast": {"p50_ms": 0.02}, "slow": {"p50_ms": 20.0}, "same": {"p50_ms": 5.5}, "new": {"p50_ms": 1.0}},
+            "storage": {"get_stats": {"p50_ms": 1.0}},
+        }
+        regressions = compare_results(current, baseline, threshold=0.25)
+        assert [(r["benchmark"], r["case"]) for r in regressions] == [("api", "slow")]
+        assert regressions[0]["change"] == pytest.approx(1.0)
+
+    def test_storage_sweep_and_load_generator(self, isolated_storage):
+        import asyncio
+        import httpx
+        import benchmark
+        import main
+        results = benchmark.bench_storage(n=2, max_history=1000)
+        assert {"get_stats_h100", "load_storage_h1000", "save_storage_h1000"} <= set(results)
+        assert "populate_history" in benchmark.bench_generator(n=1)
+        # Both ran on their own databases and restored the configured one
+        assert storage.DB_PATH == str(isolated_storage / "storage.db")
+
+        async def drive():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                return await benchmark._drive(client, [("GET", "/health", None)] * 20 + [("GET", "/missing", None)], 4)
+
+        stats = asyncio.run(drive())
+        assert stats["n"] == 21 and stats["failed"] == 1 and stats["req_per_s"] > 0
+
 
 # --- API tests ---
 
@@ -94,11 +720,50 @@ class TestAPI:
         from main import app
         return TestClient(app)
 
+    @pytest.fixture
+    def with_model(self, trained_model, monkeypatch):
+        from collections import OrderedDict
+        import main
+        import workers
+        monkeypatch.setattr(main, "model_state", main.model_state)
+        monkeypatch.setattr(workers, "_models", OrderedDict())
+        main.set_model(trained_model)
+        return trained_model
+
+    @pytest.fixture
+    def registry(self, tmp_path, monkeypatch):
+        """An empty model registry, with the serving state restored afterwards."""
+        from collections import OrderedDict
+        import main
+        import model_registry
+        import workers
+        path = str(tmp_path / "registry")
+        monkeypatch.setattr(model_registry, "MODEL_REGISTRY_DIR", path)
+        monkeypatch.setattr(main, "model_state", main.model_state)
+        monkeypatch.setattr(workers, "_models", OrderedDict())
+        return path
+
     def test_health(self, client):
         resp = client.get("/health")
         assert resp.status_code == 200
         assert resp.json()["status"] == "ok"
 
+    def test_health_reports_startup_timing(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        import main
+        monkeypatch.setattr(main, "MODEL_PATH", "/nonexistent/model.pkl")
+        with TestClient(main.app) as client:
+            client.portal.call(main._serving_state)
+            startup = client.get("/health").json()["startup"]
+        assert startup["ready_ms"] >= startup["worker_start_ms"] >= 0
+        assert startup["model_load_ms"] >= 0
+
+    def test_import_main_within_budget(self):
+        from benchmark import IMPORT_TIME_BUDGET_S, import_profile
+        profile = import_profile("main")
+        assert profile["loaded"] == []
+        assert profile["seconds"] < IMPORT_TIME_BUDGET_S, profile["packages"]
+
     def test_optimize_endpoint(self, client):
         resp = client.post("/optimize", json={"severity_level": "Low", "budget": 500000})
         assert resp.status_code == 200
@@ -106,20 +771,588 @@ class TestAPI:
         assert data["resource_plan"] is not None
         assert data["total_cost"] <= 500000
 
+    def test_optimize_rejects_plans_exceeding_stock(self, client):
+        storage.save_storage({"inventory": {"food_kits": 100, "medical_units": 2000, "shelters": 10000}, "history": []})
+        data = client.post("/optimize", json={"severity_level": "Low", "budget": 500000}).json()
+        assert data["resource_plan"] is None
+        assert "Insufficient inventory: food_kits" in data["error"]
+        assert storage.get_inventory()["food_kits"] == 100
+        assert storage.get_history() == []
+
+    def test_parallel_optimize_never_overdraws(self, client):
+        """300 concurrent Low plans against stock for exactly 100 of them."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def call(_):
+            return client.post("/optimize", json={"severity_level": "Low", "budget": 500000}).json()
+
+        with ThreadPoolExecutor(32) as pool:
+            results = list(pool.map(call, range(300)))
+        assert sum(r["resource_plan"] is not None for r in results) == 100
+        assert storage.get_inventory() == {"food_kits": 0, "medical_units": 0, "shelters": 0}
+        stats = storage.get_stats()
+        assert stats["total_analyses"] == 100
+        assert stats["total_resources_deployed"] == 100 * (500 + 20 + 100)
+
+    def test_optimize_cache_hits_still_deduct_inventory(self, client):
+        optimizer.optimize_cache.clear()
+        responses = [client.post("/optimize", json={"severity_level": "Low", "budget": 500000}).json() for _ in range(3)]
+        assert all(r["resource_plan"] for r in responses)
+        assert [r["cached"] for r in responses] == [False, True, True]
+        assert {r["solver"] for r in responses} == {responses[0]["solver"]}
+        stats = client.get("/optimize/cache").json()
+        assert (stats["hits"], stats["misses"]) == (2, 1)
+        assert stats["tables_version"] == optimizer.tables_version()
+        assert storage.get_inventory()["food_kits"] == 50000 - 3 * 500
+        assert storage.get_stats()["total_analyses"] == 3
+
+    def test_optimize_joint_endpoint(self, client):
+        resp = client.post("/optimize/joint", json={
+            "incidents": [{"id": "i1", "region": "r1", "severity": "Low"}],
+            "warehouses": [{"id": "w1", "stock": {"food_kits": 1000, "medical_units": 100, "shelters": 100},
+                            "transport_costs": {"r1": 2}}],
+        })
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["total_cost"] == 500 * 12 + 20 * 202 + 100 * 502
+        assert data["incidents"]["i1"]["shortfall"] == {"food_kits": 0, "medical_units": 0, "shelters": 0}
+        dup = client.post("/optimize/joint", json={
+            "incidents": [{"id": "i1", "region": "r1", "severity": "Low"}] * 2,
+            "warehouses": [{"id": "w1", "stock": {}, "transport_costs": {}}],
+        })
+        assert dup.status_code == 400
+        incident, warehouse = {"id": "i1", "region": "r1"}, {"id": "w1", "transport_costs": {"r1": 2}}
+        for bad in (
+            {"incidents": [{**incident, "demand": {"food_kits": -5}}], "warehouses": [{**warehouse, "stock": {}}]},
+            {"incidents": [{**incident, "severity": "Low"}], "warehouses": [{**warehouse, "stock": {"food_kits": -1}}]},
+            {"incidents": [{**incident, "severity": "Low"}],
+             "warehouses": [{"id": "w1", "stock": {}, "transport_costs": {"r1": -2}}]},
+        ):
+            assert client.post("/optimize/joint", json=bad).status_code == 422
+        unknown = client.post("/optimize/joint", json={
+            "incidents": [{**incident, "demand": {"blankets": 5}}], "warehouses": [{**warehouse, "stock": {}}],
+        })
+        assert unknown.status_code == 400
+        assert "blankets" in unknown.json()["detail"]
+
     def test_optimize_endpoint_insufficient(self, client):
         resp = client.post("/optimize", json={"severity_level": "High", "budget": 10})
         assert resp.status_code == 200
         data = resp.json()
         assert data["error"] is not None
 
-    def test_predict_endpoint_no_model(self, client):
-        """If model is not loaded, predict returns 503."""
-        from main import model
-        if model is None:
-            resp = client.post("/predict", json={
-                "disaster_type": "Flood",
-                "deaths": 100,
-                "affected": 50000,
-                "damage_usd": 1000000,
-            })
-            assert resp.status_code == 503
+    def test_predict_endpoint_no_model(self, client, registry, monkeypatch):
+        """If no model can be loaded, predict returns 503."""
+        import threading
+        import main
+        monkeypatch.setattr(main, "MODEL_PATH", "/nonexistent/model.pkl")
+        monkeypatch.setattr(main, "model_state", None)
+        monkeypatch.setattr(main, "_initial_load", threading.Event())
+        resp = client.post("/predict", json={
+            "disaster_type": "Flood",
+            "deaths": 100,
+            "affected": 50000,
+            "damage_usd": 1000000,
+        })
+        assert resp.status_code == 503
+        assert main._initial_load.is_set()
+
+    def test_first_predict_loads_model_without_prewarm(self, client, trained_model, registry, monkeypatch):
+        import threading
+        import main
+        from train import publish_model
+        publish_model(trained_model, registry, version="v1")
+        monkeypatch.setattr(main, "model_state", None)
+        monkeypatch.setattr(main, "_initial_load", threading.Event())
+        monkeypatch.setattr(main, "PREWARM_ON_STARTUP", False)
+        with client:
+            assert client.get("/health").json()["model_loaded"] is False
+            resp = client.post("/predict", json={"disaster_type": "Flood", "deaths": 1, "affected": 10, "damage_usd": 100})
+            assert resp.status_code == 200
+            assert client.get("/health").json()["model_version"] == "v1"
+
+    def test_predict_batch_matches_single(self, client, with_model):
+        records = [
+            {"disaster_type": "Flood", "deaths": 100, "affected": 50000, "damage_usd": 1e6},
+            {"disaster_type": "Earthquake", "deaths": 5000, "affected": 1e6, "damage_usd": 1e9},
+            {"disaster_type": "Drought", "deaths": 0, "affected": 10, "damage_usd": 0},
+            {"disaster_type": "Meteor", "deaths": 3, "affected": 300, "damage_usd": 5e4},
+        ]
+        resp = client.post("/predict/batch", json={"records": records})
+        assert resp.status_code == 200
+        results = resp.json()["results"]
+        assert len(results) == len(records)
+        for record, result in zip(records, results):
+            single = client.post("/predict", json=record).json()
+            assert result["severity_level"] == single["severity_level"]
+            assert result["confidence"] == pytest.approx(single["confidence"])
+
+    def test_predict_matches_dataframe_path(self, client, with_model):
+        import main
+        record = {"disaster_type": "Storm", "deaths": 40, "affected": 20000, "damage_usd": 3e7}
+        df = pd.DataFrame([{**record, "disaster_type": None}]).drop(columns="disaster_type")
+        features = main.model_state.encoder.feature_names
+        for feat in features:
+            if feat not in df.columns:
+                df[feat] = 1.0 if feat == "disaster_type_Storm" else 0.0
+        expected = with_model.predict_proba(df[features])[0]
+        data = client.post("/predict", json=record).json()
+        assert data["severity_level"] == with_model.classes_[expected.argmax()]
+        assert data["confidence"] == expected.max()
+        assert data["feature_importance"] == main.model_state.encoder.importance
+
+    def test_predict_with_flat_engine(self, client, with_model):
+        import main
+        from forest import FlatForest
+        record = {"disaster_type": "Earthquake", "deaths": 800, "affected": 2e5, "damage_usd": 4e8}
+        expected = client.post("/predict", json=record).json()
+        main.set_model(FlatForest.from_sklearn(with_model))
+        assert client.post("/predict", json=record).json() == expected
+
+    def test_predict_explanations_are_opt_in_and_memoized(self, client, with_model):
+        import main
+        records = [
+            {"disaster_type": "Earthquake", "deaths": 800, "affected": 2e5, "damage_usd": 4e8},
+            {"disaster_type": "Drought", "deaths": 0, "affected": 10, "damage_usd": 0},
+        ]
+        assert client.post("/predict", json=records[0]).json()["explanation"] is None
+        main.explain_cache.clear()
+        single = client.post("/predict", params={"explain": True}, json=records[0]).json()
+        explanation = single["explanation"]
+        assert set(explanation["contributions"]) == set(with_model.feature_names_in_)
+        assert explanation["base_value"] + sum(explanation["contributions"].values()) == pytest.approx(single["confidence"])
+        assert main.explain_cache.stats()["misses"] == 1
+
+        # The batch reuses the first row's explanation and computes only the second
+        batch = client.post("/predict/batch", params={"explain": True}, json={"records": records}).json()["results"]
+        assert main.explain_cache.stats()["hits"] == 1 and main.explain_cache.stats()["misses"] == 2
+        assert batch[0]["explanation"] == explanation
+        for record, result in zip(records, batch):
+            assert client.post("/predict", params={"explain": True}, json=record).json()["explanation"] == result["explanation"]
+
+    def test_full_worker_queue_returns_429(self, client, monkeypatch):
+        import main
+        from workers import WorkerPool
+        monkeypatch.setattr(main, "worker_pool", WorkerPool(processes=0, queue_depth=0))
+        optimizer.optimize_cache.clear()
+        resp = client.post("/optimize", json={"severity_level": "High", "budget": 10})
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "1"
+        health = client.get("/health").json()
+        assert health["status"] == "ok"
+        assert health["workers"]["rejected"] == 1
+
+    def test_process_pool_serves_predict_and_optimize(self, client, with_model, tmp_path, monkeypatch):
+        import joblib
+        import main
+        from workers import WorkerPool
+        record = {"disaster_type": "Flood", "deaths": 120, "affected": 40000, "damage_usd": 2e6}
+        expected = client.post("/predict", json=record).json()
+        model_path = str(tmp_path / "model.pkl")
+        joblib.dump(with_model, model_path)
+        pool = WorkerPool(processes=1, queue_depth=8)
+        monkeypatch.setattr(main, "worker_pool", pool)
+        main.set_model(with_model, source=model_path, engine="sklearn")
+        pool.start(main.model_state.key)
+        try:
+            assert client.post("/predict", json=record).json() == expected
+            optimizer.optimize_cache.clear()
+            assert client.post("/optimize", json={"severity_level": "Low", "budget": 500000}).json()["total_cost"] == 59000
+            assert client.get("/health").json()["workers"]["processes"] == 1
+        finally:
+            pool.shutdown()
+        assert storage.get_inventory()["food_kits"] == 50000 - 500
+
+    @pytest.fixture
+    def admin_client(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        import main
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        return TestClient(main.app, headers={"X-Admin-Token": "secret"})
+
+    def test_admin_reload_swaps_registry_versions(self, admin_client, trained_model, registry):
+        import main
+        from train import publish_model, train_model
+        record = {"disaster_type": "Storm", "deaths": 40, "affected": 20000, "damage_usd": 3e7}
+        v1 = publish_model(trained_model, registry, version="v1")
+        first = admin_client.post("/admin/reload").json()
+        assert first["version"] == "v1"
+        assert admin_client.get("/health").json()["model_version"] == "v1"
+        before = admin_client.post("/predict", json=record).json()
+
+        X = pd.DataFrame([[0.0] * trained_model.n_features_in_] * 6, columns=trained_model.feature_names_in_)
+        X.iloc[:, 0] = range(6)
+        other = train_model(X, ["Low", "Medium", "High"] * 2, n_estimators=3)
+        publish_model(other, registry, version="v2")
+        resp = admin_client.post("/admin/reload").json()
+        assert resp["version"] == "v2" and resp["previous_version"] == "v1"
+        assert main.model_state.version == "v2"
+        assert main.model_state.model.n_estimators == 3
+
+        # Rolling back to a pinned version serves its exact predictions again
+        resp = admin_client.post("/admin/reload", params={"version": v1}).json()
+        assert resp["version"] == "v1" and resp["previous_version"] == "v2"
+        assert admin_client.post("/predict", json=record).json() == before
+        assert admin_client.post("/admin/reload", params={"version": "missing"}).status_code == 404
+
+    def test_reload_keeps_active_version_when_load_fails(self, admin_client, trained_model, registry):
+        import main
+        from train import publish_model
+        publish_model(trained_model, registry, version="v1")
+        main.reload_model()
+        # A truncated pickle, as left by an interrupted copy into the registry
+        os.makedirs(os.path.join(registry, "v2"))
+        with open(os.path.join(registry, "v1", "model.pkl"), "rb") as src:
+            with open(os.path.join(registry, "v2", "model.pkl"), "wb") as dst:
+                dst.write(src.read(1000))
+        assert admin_client.post("/admin/reload").status_code == 422
+        assert admin_client.get("/health").json()["model_version"] == "v1"
+
+    def test_admin_reload_requires_token(self, client, trained_model, registry, monkeypatch):
+        import main
+        from train import publish_model
+        publish_model(trained_model, registry, version="v1")
+        # Without a configured token the route is disabled, whatever the request carries
+        assert client.post("/admin/reload").status_code == 403
+        assert client.post("/admin/reload", headers={"X-Admin-Token": ""}).status_code == 403
+        assert main.model_state is None or main.model_state.version != "v1"
+        monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+        assert client.post("/admin/reload").status_code == 403
+        assert client.post("/admin/reload", headers={"X-Admin-Token": "wrong"}).status_code == 403
+        assert client.post("/admin/reload", headers={"X-Admin-Token": "secret"}).json()["version"] == "v1"
+
+    def test_registry_watcher_activates_new_versions(self, trained_model, registry, monkeypatch):
+        import time
+        from fastapi.testclient import TestClient
+        import main
+        from train import publish_model
+        publish_model(trained_model, registry, version="v1")
+        monkeypatch.setattr(main, "MODEL_WATCH_INTERVAL_S", 0.05)
+        with TestClient(main.app) as client:
+            client.portal.call(main._serving_state)
+            assert client.get("/health").json()["model_version"] == "v1"
+            publish_model(trained_model, registry, version="v2")
+            deadline = time.monotonic() + 5
+            while client.get("/health").json()["model_version"] != "v2" and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert client.get("/health").json()["model_version"] == "v2"
+
+    def test_predict_micro_batching(self, with_model, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from fastapi.testclient import TestClient
+        import main
+        from batcher import PredictBatcher
+        records = [
+            {"disaster_type": t, "deaths": 7.0 * i, "affected": 900.0 * i, "damage_usd": 3e4 * i}
+            for i, t in enumerate(["Flood", "Storm", "Earthquake", "Wildfire"] * 8)
+        ]
+        with TestClient(main.app) as client:
+            main.set_model(with_model)
+            expected = [client.post("/predict", json=r).json() for r in records]
+            monkeypatch.setattr(main, "predict_batcher", PredictBatcher(main._predict_rows, window_ms=50, max_batch=16))
+            # One portal for all threads, so the requests share an event loop
+            with ThreadPoolExecutor(len(records)) as pool:
+                batched = list(pool.map(lambda r: client.post("/predict", json=r).json(), records))
+            stats = client.get("/predict/batching").json()
+        assert batched == expected
+        assert stats["requests"] == len(records)
+        assert stats["batches"] < len(records)
+
+    def test_metrics_exposition(self, client, with_model):
+        import re
+        optimizer.optimize_cache.clear()
+        client.post("/predict", json={"disaster_type": "Flood", "deaths": 1, "affected": 10, "damage_usd": 100})
+        client.post("/optimize", json={"severity_level": "Low", "budget": 500000})
+        client.get("/history", params={"after": "bad"})
+        text = client.get("/metrics").text
+
+        def sample(pattern):
+            match = re.search(rf"^{pattern} (\S+)$", text, re.M)
+            assert match, pattern
+            return float(match.group(1))
+
+        assert sample(r'http_requests_total\{route="/history",method="GET",status="400"\}') >= 1
+        assert sample(r'http_request_duration_seconds_count\{route="/predict",method="POST"\}') >= 1
+        assert sample(r'http_request_duration_seconds_bucket\{route="/predict",method="POST",le="\+Inf"\}') >= 1
+        for stage in ("encode", "model_inference", "optimize_solve", "reserve_inventory", "commit_reservation"):
+            assert sample(rf'stage_duration_seconds_count\{{stage="{stage}"\}}') >= 1
+
+    def test_metrics_sum_across_workers(self, client, tmp_path, monkeypatch):
+        import json
+        import subprocess
+        import metrics
+        monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+        other = metrics.Registry()
+        other.counter("http_requests_total", "", ("route", "method", "status")).inc("/health", "GET", "200", amount=5)
+        (tmp_path / f"metrics-{os.getppid()}.json").write_text(json.dumps(other.snapshot()))
+        # A snapshot left by a worker that has since exited is dropped
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        (tmp_path / f"metrics-{exited.pid}.json").write_text(json.dumps(other.snapshot()))
+        before = metrics.requests_total.series.get(("/health", "GET", "200"), 0)
+        client.get("/health")
+        text = client.get("/metrics").text
+        assert f'http_requests_total{{route="/health",method="GET",status="200"}} {before + 6.0}' in text
+        assert not (tmp_path / f"metrics-{exited.pid}.json").exists()
+
+    def test_read_routes_answer_304_until_storage_changes(self, client, monkeypatch):
+        import main
+        for path in ("/warehouse", "/stats", "/alerts", "/history?limit=5"):
+            first = client.get(path)
+            assert first.status_code == 200 and first.headers["Last-Modified"].endswith("GMT")
+            etag = first.headers["ETag"]
+            unchanged = client.get(path, headers={"If-None-Match": f'"other", W/{etag}'})
+            assert unchanged.status_code == 304 and unchanged.content == b""
+            assert unchanged.headers["ETag"] == etag
+
+        etag = client.get("/warehouse").headers["ETag"]
+        # Between writes the serialized body is reused instead of rebuilt
+        calls = []
+        monkeypatch.setattr(main, "get_inventory", lambda: calls.append(1) or storage.get_inventory())
+        assert client.get("/warehouse").json() == storage.DEFAULT_STATE["inventory"]
+        assert calls == []
+
+        storage.update_inventory({"shelters": 10})
+        changed = client.get("/warehouse", headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etag
+        assert changed.json()["shelters"] == 9990 and calls == [1]
+
+    def test_event_stream_pushes_deltas_to_every_subscriber(self):
+        import asyncio
+        import json
+        import subprocess
+        import main
+        from events import EventBroker
+
+        async def next_event(stream):
+            message = await asyncio.wait_for(anext(stream), 5)
+            fields = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+            return fields["event"], json.loads(fields["data"])
+
+        async def scenario():
+            broker = EventBroker(poll_s=0.05, keepalive_s=30)
+            main.broker, previous = broker, main.broker
+            await broker.start()
+            try:
+                response = await main.event_stream()
+                assert response.media_type == "text/event-stream"
+                first, second = response.body_iterator, broker.stream()
+                event, snapshot = await next_event(first)
+                assert event == "snapshot" and snapshot["inventory"]["food_kits"] == 50000
+                assert snapshot["alerts"] == [] and "current_inventory" not in snapshot["stats"]
+                assert (await next_event(second))[0] == "snapshot"
+
+                # One write below the food threshold: one state read fans out to both streams
+                refreshes = broker.refreshes
+                await asyncio.to_thread(storage.update_inventory, {"food_kits": 45000})
+                for stream in (first, second):
+                    assert await next_event(stream) == ("inventory", {"food_kits": 5000})
+                    event, alerts = await next_event(stream)
+                    assert event == "alerts" and alerts["cleared"] == []
+                    assert [a["resource"] for a in alerts["raised"]] == ["food_kits"]
+                assert broker.refreshes == refreshes + 1
+
+                # A write from another process bypasses the listener and is found by polling
+                script = (
+                    "import storage; data = storage.load_storage(); "
+                    "data['inventory']['food_kits'] = 30000; storage.save_storage(data)"
+                )
+                env = {**os.environ, "STORAGE_DB_PATH": storage.DB_PATH}
+                await asyncio.to_thread(
+                    subprocess.run, [sys.executable, "-c", script], cwd=os.path.dirname(__file__), env=env, check=True
+                )
+                assert await next_event(first) == ("inventory", {"food_kits": 30000})
+                event, alerts = await next_event(first)
+                assert event == "alerts" and alerts == {"raised": [], "cleared": ["food_kits"], "active": []}
+                await first.aclose()
+                await second.aclose()
+                assert broker.stats()["subscribers"] == 0
+            finally:
+                await broker.stop()
+                main.broker = previous
+
+        asyncio.run(scenario())
+
+    def test_write_right_after_snapshot_is_pushed(self):
+        import asyncio
+        from events import EventBroker
+
+        async def scenario():
+            # Polling effectively off: the event must come from the change listener
+            broker = EventBroker(poll_s=60, keepalive_s=60)
+            await broker.start()
+            try:
+                stream = broker.stream()
+                assert "event: snapshot" in await anext(stream)
+                await asyncio.to_thread(storage.update_inventory, {"food_kits": 100})
+                message = await asyncio.wait_for(anext(stream), 3)
+                assert "event: inventory" in message and '"food_kits": 49900' in message
+                await stream.aclose()
+            finally:
+                await broker.stop()
+
+        asyncio.run(scenario())
+
+    def test_slow_event_subscriber_is_disconnected(self):
+        import asyncio
+        from events import EventBroker
+
+        async def scenario():
+            broker = EventBroker(queue_max=2)
+            stream = broker.stream()
+            await anext(stream)
+            for i in range(3):
+                broker.publish("inventory", {"food_kits": i})
+            assert [message async for message in stream] == []
+            assert broker.stats() == {"subscribers": 0, "refreshes": 0, "published": 3, "dropped": 1}
+
+        asyncio.run(scenario())
+
+    @pytest.fixture
+    def seeded_history(self):
+        history = [
+            {"timestamp": f"2026-03-{day:02d}T12:00:00", "prediction": {"severity": severity},
+             "optimization": {"resource_plan": {"food_kits": day}, "total_cost": day * 10}}
+            for day, severity in zip(range(1, 11), ["Low", "High", "Medium", "High", "Low"] * 2)
+        ]
+        storage.save_storage({"inventory": storage.DEFAULT_STATE["inventory"], "history": history})
+        return history
+
+    def test_history_returns_everything_by_default(self, client, seeded_history):
+        resp = client.get("/history")
+        assert resp.status_code == 200
+        data = resp.json()
+        assert [h["timestamp"] for h in data] == [h["timestamp"] for h in seeded_history]
+        assert data[0]["prediction"] == {"severity": "Low"}
+        assert "X-Next-Cursor" not in resp.headers
+
+    def test_history_cursor_pagination(self, client, seeded_history):
+        seen, params = [], {"limit": 4}
+        while True:
+            resp = client.get("/history", params=params)
+            seen.extend(h["timestamp"] for h in resp.json())
+            if "X-Next-Cursor" not in resp.headers:
+                break
+            params = {"limit": 4, "after": resp.headers["X-Next-Cursor"]}
+        assert seen == [h["timestamp"] for h in seeded_history]
+
+    def test_history_newest_first_pages_from_the_tail(self, client, seeded_history):
+        newest = [h["timestamp"] for h in reversed(seeded_history)]
+        resp = client.get("/history", params={"order": "desc", "limit": 3})
+        assert [h["timestamp"] for h in resp.json()] == newest[:3]
+        seen, params = [], {"order": "desc", "limit": 3, "severity": "High"}
+        while True:
+            resp = client.get("/history", params=params)
+            seen.extend(h["optimization"]["total_cost"] for h in resp.json())
+            if "X-Next-Cursor" not in resp.headers:
+                break
+            params["after"] = resp.headers["X-Next-Cursor"]
+        assert seen == [90, 70, 40, 20]
+        assert client.get("/history", params={"order": "newest"}).status_code == 422
+        where, params = storage._history_filter(None, None, None, None, descending=True)
+        plan = storage._connect().execute(
+            f"EXPLAIN QUERY PLAN SELECT id, timestamp, entry FROM history {where} "
+            f"ORDER BY {storage._history_order(True)} LIMIT 10", params
+        ).fetchall()
+        assert "USING INDEX idx_history_timestamp" in plan[0][-1]
+
+    def test_history_page_and_cursor_share_a_snapshot(self, client, seeded_history, monkeypatch):
+        next_cursor, inserted = storage._next_cursor, []
+
+        def cursor_then_write(*args):
+            cursor = next_cursor(*args)
+            if not inserted:
+                # A write landing between the cursor read and the page read
+                storage.add_history({"severity": "Low"}, {"resource_plan": {}, "total_cost": 0})
+                inserted.append(True)
+            return cursor
+
+        monkeypatch.setattr(storage, "_next_cursor", cursor_then_write)
+        seen, params = [], {"order": "desc", "limit": 3}
+        while True:
+            resp = client.get("/history", params=params)
+            seen.extend(h["timestamp"] for h in resp.json())
+            if "X-Next-Cursor" not in resp.headers:
+                break
+            params["after"] = resp.headers["X-Next-Cursor"]
+        assert inserted
+        assert seen == [h["timestamp"] for h in reversed(seeded_history)]
+
+    def test_history_filters(self, client, seeded_history):
+        data = client.get("/history", params={"severity": "High"}).json()
+        assert [h["optimization"]["total_cost"] for h in data] == [20, 40, 70, 90]
+        data = client.get("/history", params={"since": "2026-03-03T00:00:00", "until": "2026-03-06T00:00:00"}).json()
+        assert [h["timestamp"][:10] for h in data] == ["2026-03-03", "2026-03-04", "2026-03-05"]
+        resp = client.get("/history", params={"severity": "High", "limit": 3})
+        assert len(resp.json()) == 3
+        rest = client.get("/history", params={"severity": "High", "limit": 3, "after": resp.headers["X-Next-Cursor"]})
+        assert [h["optimization"]["total_cost"] for h in rest.json()] == [90]
+
+    def test_export_history_csv(self, client, seeded_history):
+        import csv
+        import gzip
+        import io
+        resp = client.get("/export/history")
+        assert resp.status_code == 200
+        rows = list(csv.reader(io.StringIO(resp.text)))
+        assert rows[0] == ["Timestamp", "Severity", "Total Cost", "Food Kits", "Medical Units", "Shelters"]
+        assert rows[1] == ["2026-03-01T12:00:00", "Low", "10", "1", "", ""]
+        assert len(rows) == 11
+
+        resp = client.get("/export/history", params={"gzip": True, "since": "2026-03-09T00:00:00"})
+        assert resp.headers["content-type"] == "application/gzip"
+        rows = list(csv.reader(io.StringIO(gzip.decompress(resp.content).decode())))
+        assert [r[0] for r in rows[1:]] == ["2026-03-09T12:00:00", "2026-03-10T12:00:00"]
+
+    def test_export_history_includes_archive_on_request(self, client, seeded_history):
+        import csv
+        import io
+        from datetime import datetime
+        assert storage.compact_history(retention_days=30, now=datetime(2026, 4, 5))["archived"] == 5
+        assert len(client.get("/history").json()) == 5
+        rows = list(csv.reader(io.StringIO(client.get("/export/history").text)))
+        assert [r[0] for r in rows[1:]] == [h["timestamp"] for h in seeded_history[5:]]
+        rows = list(csv.reader(io.StringIO(client.get("/export/history", params={"include_archive": True}).text)))
+        assert [r[0] for r in rows[1:]] == [h["timestamp"] for h in seeded_history]
+        assert rows[1] == ["2026-03-01T12:00:00", "Low", "10", "1", "", ""]
+        early = {"until": "2026-03-03T00:00:00"}
+        assert client.get("/export/history", params=early).status_code == 404
+        assert len(client.get("/export/history", params={**early, "include_archive": True}).text.splitlines()) == 3
+
+    def test_export_history_empty(self, client):
+        assert client.get("/export/history").status_code == 404
+
+    def test_export_history_memory_is_bounded(self, isolated_storage):
+        """Streaming a million-row export keeps peak RSS far below the size of the CSV."""
+        import subprocess
+        conn = storage._connect()
+        with storage._transaction(conn):
+            conn.execute(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000000) "
+                "INSERT INTO history (timestamp, severity, entry) "
+                "SELECT strftime('%Y-%m-%dT%H:%M:%S', '2026-01-01', '+' || i || ' seconds'), 'Low', "
+                "'{\"prediction\": {\"severity\": \"Low\"}, \"optimization\": {\"resource_plan\": "
+                "{\"food_kits\": 500, \"medical_units\": 20, \"shelters\": 100}, \"total_cost\": 59000}}' FROM n"
+            )
+        script = (
+            "import resource, main, storage\n"
+            "before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+            "total = sum(len(part) for part in main._history_csv_stream(storage.iter_history_export_rows()))\n"
+            "after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+            "print(total, (after - before) * 1024)\n"
+        )
+        env = {**os.environ, "STORAGE_DB_PATH": storage.DB_PATH}
+        out = subprocess.run(
+            [sys.executable, "-c", script], cwd=os.path.dirname(__file__), env=env,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        total_bytes, rss_growth = map(int, out.split())
+        assert total_bytes > 40_000_000
+        assert rss_growth < 16_000_000
+
+    def test_history_invalid_cursor(self, client):
+        assert client.get("/history", params={"after": "not-a-cursor"}).status_code == 400
+
+    def test_predict_batch_rejects_empty(self, client, with_model):
+        resp = client.post("/predict/batch", json={"records": []})
+        assert resp.status_code == 422
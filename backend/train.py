@@ -1,27 +1,174 @@
 """
 Model training for disaster severity classification.
-Trains a RandomForestClassifier and saves it as model.pkl.
+Trains a RandomForestClassifier and saves it as model.pkl, plus the
+memory-mappable array bundle (model_bundle/) used by the FlatForest engine.
+
+Fitting can use several cores (--n-jobs), an existing model can be grown
+with extra trees fitted on new labelled data (--warm-start-from), and
+--sweep fans a hyperparameter grid out across processes. Every run prints a
+training report with wall time and throughput and writes it as JSON.
+--publish also adds the model to the versioned registry, where a running API
+picks it up without a restart.
+
+Run with: python train.py [--dataset <csv file or columnar dataset dir>] [--n-jobs N]
+                          [--trees N] [--warm-start-from model.pkl] [--sweep] [--processes P]
+                          [--publish]
 """
 
+import argparse
+import itertools
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
 import joblib
+import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, accuracy_score
 
-from data_pipeline import run_pipeline
+from data_pipeline import iter_columnar, read_columnar_meta, run_columnar_pipeline, run_pipeline
+from forest import export_forest
+from model_registry import BUNDLE_DIRNAME, MODEL_FILENAME, MODEL_REGISTRY_DIR
+
+# Grid searched by --sweep
+SWEEP_GRID = {
+    "n_estimators": [50, 100, 200],
+    "max_depth": [None, 12, 20],
+    "min_samples_leaf": [1, 4],
+}
 
 
 def train_model(
-    X_train, y_train, n_estimators: int = 100, random_state: int = 42
+    X_train, y_train, n_estimators: int = 100, random_state: int = 42, n_jobs: int | None = None, **params
 ) -> RandomForestClassifier:
-    """Train a RandomForestClassifier on the provided data."""
+    """
+    Train a RandomForestClassifier on the provided data.
+
+    n_jobs parallelizes fitting across cores. It is reset to None on the
+    returned model so that serving predicts single-threaded: per-request
+    thread fan-out only adds latency, and sequential accumulation is what
+    keeps FlatForest bit-identical.
+    """
     model = RandomForestClassifier(
-        n_estimators=n_estimators, random_state=random_state
+        n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs, **params
     )
     model.fit(X_train, y_train)
+    model.set_params(n_jobs=None)
+    return model
+
+
+def grow_model(
+    model: RandomForestClassifier, X_new, y_new, n_new_trees: int, n_jobs: int | None = None
+) -> RandomForestClassifier:
+    """
+    Add n_new_trees trees fitted on (X_new, y_new), keeping the existing ones.
+
+    Uses warm_start, so only the new trees are trained; the forest then votes
+    over old and new trees alike. The new batch must contain every class the
+    model knows, otherwise the new trees' probability columns would not line
+    up with the old ones. Nor may it add a class the model has never seen.
+    """
+    classes, known = set(np.unique(y_new)), set(model.classes_)
+    if classes != known:
+        raise ValueError(
+            f"New batch is missing classes {sorted(known - classes)} and adds {sorted(classes - known)}; "
+            "its classes must match the model's exactly."
+        )
+    model.set_params(warm_start=True, n_estimators=model.n_estimators + n_new_trees, n_jobs=n_jobs)
+    model.fit(X_new, y_new)
+    model.set_params(warm_start=False, n_jobs=None)
     return model
 
 
+def train_incremental(dataset_path: str, trees_per_part: int = 10, n_jobs: int | None = None, random_state: int = 42):
+    """
+    Train on a columnar dataset one stored part at a time.
+
+    Each part adds trees_per_part trees via grow_model, so peak memory is one
+    part's feature matrix. Parts lacking a class are skipped. Returns
+    (model, {"parts", "skipped_parts"}), skipped_parts listing the indices
+    of the parts that trained nothing.
+    """
+    meta = read_columnar_meta(dataset_path)
+    model = None
+    parts, skipped = 0, []
+    for part, (X, y) in enumerate(iter_columnar(dataset_path)):
+        parts += 1
+        if set(np.unique(y)) != set(meta["labels"]):
+            skipped.append(part)
+            continue
+        X = _frame(X, meta["feature_names"])
+        if model is None:
+            model = train_model(X, y, n_estimators=trees_per_part, random_state=random_state, n_jobs=n_jobs)
+        else:
+            grow_model(model, X, y, trees_per_part, n_jobs=n_jobs)
+    if model is None:
+        raise ValueError(f"No part of {dataset_path} contains every class.")
+    return model, {"parts": parts, "skipped_parts": skipped}
+
+
+def _frame(X: np.ndarray, feature_names: list[str]):
+    import pandas as pd
+    return pd.DataFrame(X, columns=feature_names, copy=False)
+
+
+# Sweep workers receive the data once, through the pool initializer
+_sweep_data: tuple = ()
+
+
+def _init_sweep_worker(X_train, y_train, X_test, y_test) -> None:
+    global _sweep_data
+    _sweep_data = (X_train, y_train, X_test, y_test)
+
+
+def _sweep_trial(params: dict) -> dict:
+    X_train, y_train, X_test, y_test = _sweep_data
+    start = time.perf_counter()
+    model = train_model(X_train, y_train, n_jobs=1, **params)
+    fit_s = time.perf_counter() - start
+    return {"params": params, "accuracy": accuracy_score(y_test, model.predict(X_test)), "fit_s": fit_s}
+
+
+def sweep(X_train, y_train, X_test, y_test, grid: dict = SWEEP_GRID, processes: int | None = None) -> list[dict]:
+    """
+    Train one single-threaded model per grid combination across processes.
+
+    Returns one {"params", "accuracy", "fit_s"} result per combination,
+    best accuracy first (faster fit breaking ties).
+    """
+    combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    with ProcessPoolExecutor(
+        processes, initializer=_init_sweep_worker, initargs=(X_train, y_train, X_test, y_test)
+    ) as pool:
+        results = list(pool.map(_sweep_trial, combinations))
+    return sorted(results, key=lambda r: (-r["accuracy"], r["fit_s"]))
+
+
+def training_report(
+    model: RandomForestClassifier, n_rows: int, fit_s: float, trees_fitted: int | None = None, **extra
+) -> dict:
+    """
+    Wall time and throughput of a fit, for the nightly retraining budget.
+
+    trees_fitted is the number of trees trained in fit_s (defaults to all of
+    them; pass the added count after grow_model).
+    """
+    if trees_fitted is None:
+        trees_fitted = len(model.estimators_)
+    return {
+        "rows": n_rows,
+        "features": int(model.n_features_in_),
+        "trees": len(model.estimators_),
+        "trees_fitted": trees_fitted,
+        "fit_s": round(fit_s, 3),
+        "rows_per_s": round(n_rows / fit_s, 1) if fit_s else None,
+        "trees_per_s": round(trees_fitted / fit_s, 2) if fit_s else None,
+        **extra,
+    }
+
+
 def evaluate_model(model: RandomForestClassifier, X_test, y_test) -> dict:
     """Evaluate the model and return accuracy and classification report."""
     y_pred = model.predict(X_test)
@@ -30,18 +177,80 @@ def evaluate_model(model: RandomForestClassifier, X_test, y_test) -> dict:
     return {"accuracy": acc, "report": report}
 
 
-def save_model(model: RandomForestClassifier, filepath: str = "model.pkl") -> None:
-    """Save the trained model to disk."""
+def save_model(
+    model: RandomForestClassifier, filepath: str = "model.pkl", bundle_path: str | None = None
+) -> None:
+    """
+    Save the trained model to disk.
+
+    Alongside the joblib pickle this writes the flat .npy bundle (default:
+    model_bundle/ next to filepath) that API workers memory-map at startup.
+    """
     joblib.dump(model, filepath)
+    if bundle_path is None:
+        bundle_path = os.path.join(os.path.dirname(filepath), "model_bundle")
+    export_forest(model, bundle_path)
+
+
+def publish_model(model: RandomForestClassifier, registry: str = MODEL_REGISTRY_DIR, version: str | None = None) -> str:
+    """
+    Save the model as a new version in the model registry and return the version.
+
+    The version (default: a UTC timestamp, so versions sort chronologically)
+    is written to a hidden temp directory and renamed into place, so a
+    watching API never sees a partially written version.
+    """
+    version = version or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    final_dir = os.path.join(registry, version)
+    if os.path.exists(final_dir):
+        raise FileExistsError(f"Model version {version!r} already exists in {registry}")
+    tmp_dir = os.path.join(registry, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+    save_model(model, os.path.join(tmp_dir, MODEL_FILENAME), os.path.join(tmp_dir, BUNDLE_DIRNAME))
+    os.rename(tmp_dir, final_dir)
+    return version
 
 
 def main() -> None:
     """Run training pipeline end-to-end."""
-    dataset_path = os.path.join(os.path.dirname(__file__), "disaster_data.csv")
-    X_train, X_test, y_train, y_test = run_pipeline(dataset_path)
+    parser = argparse.ArgumentParser(description="Train the severity classifier")
+    parser.add_argument(
+        "--dataset",
+        default=os.path.join(os.path.dirname(__file__), "disaster_data.csv"),
+        help="CSV file, or a columnar dataset directory written by data_pipeline.py",
+    )
+    parser.add_argument("--n-jobs", type=int, default=None, help="Cores used for fitting (-1: all)")
+    parser.add_argument("--trees", type=int, default=100, help="Trees to train (or to add with --warm-start-from)")
+    parser.add_argument("--warm-start-from", help="Existing model.pkl to grow with trees fitted on --dataset")
+    parser.add_argument("--sweep", action="store_true", help="Run the SWEEP_GRID hyperparameter sweep and train the best")
+    parser.add_argument("--processes", type=int, default=None, help="Sweep processes (default: CPU count)")
+    parser.add_argument("--report", default=os.path.join(os.path.dirname(__file__), "training_report.json"))
+    parser.add_argument("--publish", action="store_true", help="Also publish the model as a new registry version")
+    args = parser.parse_args()
 
-    print("Training RandomForestClassifier...")
-    model = train_model(X_train, y_train)
+    wall_start = time.perf_counter()
+    if os.path.isdir(args.dataset):
+        X_train, X_test, y_train, y_test = run_columnar_pipeline(args.dataset)
+    else:
+        X_train, X_test, y_train, y_test = run_pipeline(args.dataset)
+    load_s = time.perf_counter() - wall_start
+
+    params = {"n_estimators": args.trees}
+    sweep_results = None
+    if args.sweep:
+        print(f"Sweeping {np.prod([len(v) for v in SWEEP_GRID.values()])} configurations...")
+        sweep_results = sweep(X_train, y_train, X_test, y_test, processes=args.processes)
+        params = sweep_results[0]["params"]
+        print(f"Best: {params} (accuracy {sweep_results[0]['accuracy']:.4f})")
+
+    fit_start = time.perf_counter()
+    if args.warm_start_from:
+        print(f"Adding {args.trees} trees to {args.warm_start_from}...")
+        model = grow_model(joblib.load(args.warm_start_from), X_train, y_train, args.trees, n_jobs=args.n_jobs)
+    else:
+        print("Training RandomForestClassifier...")
+        model = train_model(X_train, y_train, n_jobs=args.n_jobs, **params)
+    fit_s = time.perf_counter() - fit_start
 
     results = evaluate_model(model, X_test, y_test)
     print(f"Accuracy: {results['accuracy']:.4f}")
@@ -50,7 +259,25 @@ def main() -> None:
 
     model_path = os.path.join(os.path.dirname(__file__), "model.pkl")
     save_model(model, model_path)
-    print(f"Model saved to {model_path}")
+    print(f"Model saved to {model_path} (+ model_bundle/)")
+    if args.publish:
+        version = publish_model(model)
+        print(f"Published model version {version} to {MODEL_REGISTRY_DIR}")
+
+    report = training_report(
+        model, len(X_train), fit_s,
+        trees_fitted=args.trees if args.warm_start_from else None,
+        n_jobs=args.n_jobs,
+        load_s=round(load_s, 3),
+        wall_s=round(time.perf_counter() - wall_start, 3),
+        accuracy=results["accuracy"],
+        params=params,
+        sweep=sweep_results,
+    )
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Fit {report['rows']} rows x {report['trees_fitted']} trees in {report['fit_s']} s "
+          f"({report['rows_per_s']} rows/s); wall {report['wall_s']} s -> {args.report}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+"""
+Execution layer for CPU-bound request work (forest inference, optimizer solves).
+
+With WORKER_PROCESSES > 0 the work runs in a process pool whose workers load
+the model once at startup, so sklearn inference and CBC solves neither hold
+the GIL in the API process nor occupy Starlette's threadpool, which stays free
+for storage reads and light routes like /health. With WORKER_PROCESSES = 0 (the
+default) the same tasks run in the threadpool, exactly as the sync handlers did.
+
+Either way at most WORKER_QUEUE_DEPTH tasks may be queued or running; beyond
+that run() raises PoolBusyError and the API answers 429.
+
+Models are addressed by key, an (artifact path, engine) pair: each process
+caches the most recent MAX_CACHED_MODELS models and loads a key it has not
+seen on first use. A request therefore always runs on the exact version it
+was encoded for, even while a reload swaps versions underneath it.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.concurrency import run_in_threadpool
+
+from forest import FlatForest
+from optimizer import optimize_resources
+
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", 0))
+WORKER_QUEUE_DEPTH = int(os.environ.get("WORKER_QUEUE_DEPTH", 64))
+
+# Loaded models by key, most recently installed last: filled by _init_worker
+# and on demand in pool processes, and by main.set_model in the API process.
+_models: OrderedDict = OrderedDict()
+_models_lock = threading.Lock()
+# Old version kept alongside the new one while in-flight requests drain
+MAX_CACHED_MODELS = 2
+# FlatForest views of cached models, used for explanations (by the same keys)
+_explainers: dict = {}
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when WORKER_QUEUE_DEPTH tasks are already queued or running."""
+
+
+def load_model(path: str, engine: str):
+    """Load the serving model: the FlatForest bundle for engine "flat", else the pickled estimator."""
+    if engine == "flat":
+        return FlatForest.load(path)
+    # Imported here: joblib and the sklearn modules the pickle pulls in cost ~1 s
+    import joblib
+    return joblib.load(path)
+
+
+def install_model(key: tuple[str, str], model) -> None:
+    with _models_lock:
+        _models[key] = model
+        _models.move_to_end(key)
+        _explainers.pop(key, None)
+        while len(_models) > MAX_CACHED_MODELS:
+            _explainers.pop(_models.popitem(last=False)[0], None)
+
+
+def get_model(key: tuple[str, str]):
+    """The model for key, loading it from its artifact path if this process has not yet."""
+    with _models_lock:
+        model = _models.get(key)
+    if model is None:
+        path, engine = key
+        if path.startswith("memory:"):
+            raise KeyError(f"In-memory model {path} is not installed in process {os.getpid()}")
+        model = load_model(path, engine)
+        install_model(key, model)
+    return model
+
+
+def get_explainer(key: tuple[str, str]) -> FlatForest:
+    """The model under key as a FlatForest (itself for the flat engine), flattened once per process."""
+    with _models_lock:
+        explainer = _explainers.get(key)
+    if explainer is None:
+        model = get_model(key)
+        explainer = model if isinstance(model, FlatForest) else FlatForest.from_sklearn(model)
+        with _models_lock:
+            if key in _models:
+                _explainers[key] = explainer
+    return explainer
+
+
+def _init_worker(model_key: tuple[str, str] | None) -> None:
+    warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+    if model_key is not None and os.path.exists(model_key[0]):
+        install_model(model_key, load_model(*model_key))
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def warm_task(model_key: tuple[str, str]) -> int:
+    """Load model_key into this worker's cache ahead of traffic."""
+    get_model(model_key)
+    return os.getpid()
+
+
+def predict_proba_task(model_key: tuple[str, str], X):
+    """Class probabilities for an encoded feature matrix, from the model version model_key."""
+    return get_model(model_key).predict_proba(X)
+
+
+def explain_task(model_key: tuple[str, str], X):
+    """(bias, contributions) of FlatForest.contributions for the model version model_key."""
+    return get_explainer(model_key).contributions(X)
+
+
+def optimize_task(severity_level: str, budget: float) -> dict:
+    return optimize_resources(severity_level, budget)
+
+
+class WorkerPool:
+    """
+    Bounded executor shared by the CPU-bound routes.
+
+    Tasks must be module-level functions so they can be sent to a worker
+    process; arguments and results are pickled, so callers should pass
+    arrays they no longer mutate (e.g. a copy of FeatureEncoder's buffer).
+    """
+
+    def __init__(self, processes: int = WORKER_PROCESSES, queue_depth: int = WORKER_QUEUE_DEPTH):
+        self.processes = processes
+        self.queue_depth = queue_depth
+        self.rejected = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self, model_key: tuple[str, str] | None) -> None:
+        """Spawn the worker processes and wait until each has loaded the model."""
+        if self.processes <= 0 or self._executor is not None:
+            return
+        # spawn, not fork: the API process already runs an event loop and threads
+        self._executor = ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_key,),
+        )
+        futures = [self._executor.submit(_ping) for _ in range(self.processes)]
+        for future in futures:
+            future.result()
+
+    def warm(self, model_key: tuple[str, str]) -> None:
+        """
+        Have the worker processes load model_key before it takes traffic.
+
+        One load task per worker; loads take long enough that idle workers
+        pick up one each. A worker that misses it loads on first use.
+        """
+        if self._executor is None:
+            return
+        futures = [self._executor.submit(warm_task, model_key) for _ in range(self.processes)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process (or the threadpool when disabled) and await the result."""
+        with self._lock:
+            if self._in_flight >= self.queue_depth:
+                self.rejected += 1
+                raise PoolBusyError(f"{self._in_flight} tasks already queued")
+            self._in_flight += 1
+        try:
+            if self._executor is None:
+                return await run_in_threadpool(fn, *args)
+            return await asyncio.wrap_future(self._executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "processes": self.processes if self._executor is not None else 0,
+                "queue_depth": self.queue_depth,
+                "in_flight": self._in_flight,
+                "rejected": self.rejected,
+            }
@@ -16,6 +16,13 @@ import CommandPalette from './components/CommandPalette';
 import axios from 'axios';
 
 const API = 'http://localhost:8000';
+// The warehouse trend chart shows the most recent analyses only
+const HISTORY_LIMIT = 10;
+// Newest-first page of HISTORY_LIMIT entries, returned oldest-first for the chart
+const getRecentHistory = async () => {
+  const res = await axios.get(`${API}/history`, { params: { order: 'desc', limit: HISTORY_LIMIT } });
+  return Array.isArray(res.data) ? res.data.reverse() : [];
+};
 
 // Framer-motion animation variants
 const fadeUp = {
@@ -74,16 +81,46 @@ export default function App() {
     fetchManagementData();
   }, []);
 
+  // Inventory, KPIs and alerts are pushed by the backend as they change
+  useEffect(() => {
+    const source = new EventSource(`${API}/events`);
+    source.addEventListener('snapshot', (e) => {
+      const data = JSON.parse(e.data);
+      setWarehouse(data.inventory);
+      setStats((prev) => ({ ...(prev || {}), ...data.stats, current_inventory: data.inventory }));
+      setAlerts(data.alerts);
+    });
+    source.addEventListener('inventory', (e) => {
+      const changed = JSON.parse(e.data);
+      setWarehouse((prev) => ({ ...(prev || {}), ...changed }));
+      setStats((prev) => prev && { ...prev, current_inventory: { ...prev.current_inventory, ...changed } });
+    });
+    source.addEventListener('stats', (e) => {
+      const changed = JSON.parse(e.data);
+      setStats((prev) => ({ ...(prev || {}), ...changed }));
+    });
+    source.addEventListener('alerts', (e) => setAlerts(JSON.parse(e.data).active));
+    return () => source.close();
+  }, []);
+
+  const fetchHistory = async () => {
+    try {
+      setHistory(await getRecentHistory());
+    } catch (err) {
+      console.error("History sync failed", err);
+    }
+  };
+
   const fetchManagementData = async () => {
     try {
-      const [whRes, histRes, statsRes, alertRes] = await Promise.all([
+      const [whRes, recentHistory, statsRes, alertRes] = await Promise.all([
         axios.get(`${API}/warehouse`),
-        axios.get(`${API}/history`),
+        getRecentHistory(),
         axios.get(`${API}/stats`),
         axios.get(`${API}/alerts`),
       ]);
       setWarehouse(whRes.data || null);
-      setHistory(Array.isArray(histRes.data) ? histRes.data : []);
+      setHistory(recentHistory);
       setStats(statsRes.data || null);
       setAlerts(Array.isArray(alertRes.data) ? alertRes.data : []);
     } catch (err) {
@@ -97,7 +134,7 @@ export default function App() {
     setResult(null);
 
     try {
-      const predRes = await axios.post(`${API}/predict`, {
+      const predRes = await axios.post(`${API}/predict?explain=true`, {
         disaster_type: form.disaster_type,
         deaths: parseFloat(form.deaths || 0),
         affected: parseFloat(form.affected || 0),
@@ -110,7 +147,7 @@ export default function App() {
       });
 
       setResult({ ...predRes.data, ...optRes.data });
-      fetchManagementData();
+      fetchHistory();
       toast.success(`Analysis complete — Severity: ${predRes.data.severity_level}`);
     } catch (err) {
       console.error("Analysis Pipeline Crash:", err);
@@ -355,7 +392,7 @@ export default function App() {
                         transition={{ delay: 0.3, duration: 0.5 }}
                         className="mt-6"
                       >
-                        <ExplainabilityChart data={result.feature_importance} />
+                        <ExplainabilityChart data={result.explanation?.contributions || result.feature_importance} />
                       </motion.div>
                     )}
                   </motion.div>
@@ -11,7 +11,8 @@ const ExplainabilityChart = ({ data }) => {
             name: name.replace('disaster_type_', '').replace(/_/g, ' '),
             importance: value * 100,
         }))
-        .sort((a, b) => b.importance - a.importance);
+        // Per-prediction contributions can be negative; rank by magnitude
+        .sort((a, b) => Math.abs(b.importance) - Math.abs(a.importance));
 
     return (
         <div className="glass-card-static p-6 animate-fade-in-delay-3">
@@ -66,7 +67,7 @@ const ExplainabilityChart = ({ data }) => {
                 </ResponsiveContainer>
             </div>
             <p className="text-[10px] mt-2 italic text-center" style={{ color: '#475569' }}>
-                Higher percentage → Stronger impact on classification decision.
+                Percentage points each factor added to (or took from) this prediction's confidence.
             </p>
         </div>
     );